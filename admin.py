@@ -3,7 +3,7 @@ import streamlit as st
 import pandas as pd
 from datetime import date, datetime
 
-from database import run_query, fetch_employee_details
+from database import run_query, run_query_frame, run_cached_query, run_many, fetch_employee_details, transaction
 
 # Configuration
 USER_ROLE_OPTIONS_SUPER = ['Accounts', 'Admin', 'Engineer', 'Super Admin', 'TeamLeader', 'Technician']
@@ -32,69 +32,130 @@ def pd_to_date(val):
 def _get_center_info(center_code: str):
     if not center_code:
         return {"center_name": None, "center_location": None}
-    row = run_query(
+    row = run_cached_query(
         "SELECT center_name, center_location FROM center_details WHERE center_code = :cc LIMIT 1",
         {"cc": center_code}, fetch_one=True
     )
     return dict(row) if row else {"center_name": None, "center_location": None}
 
 def _list_centers():
-    rows = run_query("SELECT * FROM center_details ORDER BY center_code", fetch_one=False)
+    rows = run_cached_query("SELECT * FROM center_details ORDER BY center_code", fetch_one=False)
     return rows or []
 
 def _load_all_employees():
-    rows = run_query("SELECT * FROM employee_details ORDER BY employee_code", fetch_one=False)
-    return rows or []
+    """All employees as a DataFrame (empty if the table is empty or unreadable)."""
+    df = run_query_frame("SELECT * FROM employee_details ORDER BY employee_code")
+    return df if df is not None else pd.DataFrame()
+
+def _count_employees():
+    row = run_query("SELECT COUNT(*) AS n FROM employee_details", fetch_one=True)
+    return row["n"] if row else 0
+
+CREATE_EMPLOYEE_SQL = """
+    INSERT INTO employee_details
+    (employee_code, employee_name, password, center_code, center_name, center_location,
+     center_type, user_role, user_details, employee_doj, employee_status, last_working_day, Updated_By)
+    VALUES
+    (:employee_code, :employee_name, :password, :center_code, :center_name, :center_location,
+     :center_type, :user_role, :user_details, :employee_doj, :employee_status, :last_working_day, :updated_by)
+"""
+
+BULK_USER_COLUMNS = ["employee_code", "employee_name", "password", "center_code",
+                     "user_role", "user_details", "employee_status", "employee_doj"]
 
 def _create_employee(payload: dict):
-    sql = """
-        INSERT INTO employee_details
-        (employee_code, employee_name, password, center_code, center_name, center_location,
-         center_type, user_role, user_details, employee_doj, employee_status, last_working_day, Updated_By)
-        VALUES
-        (:employee_code, :employee_name, :password, :center_code, :center_name, :center_location,
-         :center_type, :user_role, :user_details, :employee_doj, :employee_status, :last_working_day, :updated_by)
-    """
-    return run_query(sql, payload)
+    return run_query(CREATE_EMPLOYEE_SQL, payload)
+
+def _prepare_bulk_employees(df: pd.DataFrame, current_user_code: str, current_user_role: str):
+    """Validate an onboarding CSV. Returns (payloads, errors) where errors is a list of strings."""
+    role_options = USER_ROLE_OPTIONS_SUPER if current_user_role == "Super Admin" else USER_ROLE_OPTIONS_ADMIN
+    centers = {c["center_code"]: c for c in _list_centers()}
+    existing = {r["employee_code"] for r in (run_query("SELECT employee_code FROM employee_details", fetch_one=False) or [])}
+
+    payloads, errors, seen = [], [], set()
+    for idx, row in df.iterrows():
+        line = idx + 2  # header is line 1
+        rec = {k: (str(row[k]).strip() if k in row and pd.notna(row[k]) else "") for k in BULK_USER_COLUMNS}
+        code = rec["employee_code"]
+        if not code or not rec["employee_name"] or not rec["password"]:
+            errors.append(f"Line {line}: employee_code, employee_name and password are required.")
+            continue
+        if code in existing or code in seen:
+            errors.append(f"Line {line}: employee code {code} already exists.")
+            continue
+        if rec["user_role"] not in role_options:
+            errors.append(f"Line {line}: role '{rec['user_role']}' is not allowed.")
+            continue
+        center = centers.get(rec["center_code"]) if rec["center_code"] else None
+        if rec["center_code"] and not center:
+            errors.append(f"Line {line}: unknown center code {rec['center_code']}.")
+            continue
+        seen.add(code)
+        payloads.append({
+            "employee_code": code,
+            "employee_name": rec["employee_name"],
+            "password": rec["password"],
+            "center_code": rec["center_code"] or None,
+            "center_name": center.get("center_name") if center else None,
+            "center_location": center.get("center_location") if center else None,
+            "center_type": center.get("center_type") if center else None,
+            "user_role": rec["user_role"],
+            "user_details": rec["user_details"] or None,
+            "employee_doj": pd_to_date(rec["employee_doj"]),
+            "employee_status": rec["employee_status"] or "Active",
+            "last_working_day": None,
+            "updated_by": current_user_code,
+        })
+    return payloads, errors
+
+UPDATE_EMPLOYEE_SQL = """
+    UPDATE employee_details SET
+        employee_code = :new_emp_code,
+        employee_name = :employee_name,
+        password = :password,
+        center_code = :center_code,
+        center_name = :center_name,
+        center_location = :center_location,
+        center_type = :center_type,
+        user_role = :user_role,
+        user_details = :user_details,
+        employee_doj = :employee_doj,
+        employee_status = :employee_status,
+        last_working_day = :last_working_day,
+        Updated_By = :updated_by
+    WHERE employee_code = :orig_emp_code
+"""
 
 def _update_employee(payload: dict):
-    sql = """
-        UPDATE employee_details SET
-            employee_code = :new_emp_code,
-            employee_name = :employee_name,
-            password = :password,
-            center_code = :center_code,
-            center_name = :center_name,
-            center_location = :center_location,
-            center_type = :center_type,
-            user_role = :user_role,
-            user_details = :user_details,
-            employee_doj = :employee_doj,
-            employee_status = :employee_status,
-            last_working_day = :last_working_day,
-            Updated_By = :updated_by
-        WHERE employee_code = :orig_emp_code
-    """
-    return run_query(sql, payload)
+    return run_query(UPDATE_EMPLOYEE_SQL, payload)
+
+CREATE_CENTER_SQL = """
+    INSERT INTO center_details (center_code, center_name, center_location, center_type, status)
+    VALUES (:center_code, :center_name, :center_location, :center_type, :status)
+"""
 
 def _create_center(payload: dict):
-    sql = """
-        INSERT INTO center_details (center_code, center_name, center_location, center_type, status)
-        VALUES (:center_code, :center_name, :center_location, :center_type, :status)
-    """
-    return run_query(sql, payload)
+    return run_query(CREATE_CENTER_SQL, payload)
+
+UPDATE_CENTER_SQL = """
+    UPDATE center_details SET
+        center_code = :new_center_code,
+        center_name = :center_name,
+        center_location = :center_location,
+        center_type = :center_type,
+        status = :status
+    WHERE center_code = :orig_center_code
+"""
 
 def _update_center(payload: dict):
-    sql = """
-        UPDATE center_details SET
-            center_code = :new_center_code,
-            center_name = :center_name,
-            center_location = :center_location,
-            center_type = :center_type,
-            status = :status
-        WHERE center_code = :orig_center_code
-    """
-    return run_query(sql, payload)
+    return run_query(UPDATE_CENTER_SQL, payload)
+
+def _write_and_verify(sql: str, payload: dict, verify_sql: str, verify_params: dict):
+    """Run a write and read the row back on the same connection/commit. Returns the row or None."""
+    with transaction() as tx:
+        tx.execute(sql, payload)
+        row = tx.execute(verify_sql, verify_params, fetch_one=True)
+    return row if tx.ok else None
 
 # Manage Users: search/edit + create
 def _manage_users_tab(current_user_code: str, current_user_role: str):
@@ -102,15 +163,14 @@ def _manage_users_tab(current_user_code: str, current_user_role: str):
 
     # Show employee table to both Admin and Super Admin (so Super Admin sees it like Admin)
     st.subheader("All employees")
-    rows = _load_all_employees()
-    if rows:
-        df = pd.DataFrame(rows)
+    df = _load_all_employees()
+    if not df.empty:
         st.dataframe(df, width='stretch')
         st.download_button("Download employee_details as CSV", data=df.to_csv(index=False), file_name="employee_details.csv", mime="text/csv")
     else:
         st.info("No employee records found.")
 
-    tabs = st.tabs(["Search / Edit user", "Add new user"])
+    tabs = st.tabs(["Search / Edit user", "Add new user", "Bulk upload users"])
 
     # Search / Edit
     with tabs[0]:
@@ -228,8 +288,8 @@ def _manage_users_tab(current_user_code: str, current_user_role: str):
                         "orig_emp_code": orig_emp_code,
                     }
 
-                    res = _update_employee(payload)
-                    verify = run_query("SELECT * FROM employee_details WHERE employee_code = :emp", {"emp": payload["new_emp_code"]}, fetch_one=True)
+                    verify = _write_and_verify(UPDATE_EMPLOYEE_SQL, payload,
+                                               "SELECT * FROM employee_details WHERE employee_code = :emp", {"emp": payload["new_emp_code"]})
                     if verify:
                         st.success("User updated successfully.")
                     else:
@@ -281,13 +341,41 @@ def _manage_users_tab(current_user_code: str, current_user_role: str):
                             "last_working_day": None,
                             "updated_by": current_user_code,
                         }
-                        r = _create_employee(payload)
-                        verify = run_query("SELECT * FROM employee_details WHERE employee_code = :emp", {"emp": payload["employee_code"]}, fetch_one=True)
+                        verify = _write_and_verify(CREATE_EMPLOYEE_SQL, payload,
+                                                   "SELECT * FROM employee_details WHERE employee_code = :emp", {"emp": payload["employee_code"]})
                         if verify:
                             st.success("User created successfully.")
                         else:
                             st.error("Failed to create user. Check DB and logs.")
 
+    # Bulk onboarding from CSV
+    with tabs[2]:
+        st.subheader("Bulk upload users")
+        st.caption("CSV columns: " + ", ".join(BULK_USER_COLUMNS) + ". Center name/location are filled from the center code.")
+        st.download_button("Download CSV template", data=",".join(BULK_USER_COLUMNS) + "\n",
+                           file_name="employee_upload_template.csv", mime="text/csv")
+        upload = st.file_uploader("Upload CSV", type=["csv"], key="bulk_users_csv")
+        batch_size = st.number_input("Rows per commit", min_value=1, max_value=5000, value=500, step=100)
+        if upload is not None:
+            try:
+                upload_df = pd.read_csv(upload, dtype=str)
+            except Exception as e:
+                st.error(f"Could not read CSV: {e}")
+                return
+            payloads, errors = _prepare_bulk_employees(upload_df, current_user_code, current_user_role)
+            st.write(f"{len(payloads)} valid row(s), {len(errors)} rejected.")
+            if errors:
+                with st.expander("Rejected rows"):
+                    for err in errors:
+                        st.write(err)
+            if payloads and st.button(f"Create {len(payloads)} user(s)", key="bulk_users_create"):
+                summary = run_many(CREATE_EMPLOYEE_SQL, payloads, batch_size=int(batch_size))
+                if summary["error"]:
+                    st.error(f"Stopped after {summary['rowcount']} user(s): {summary['error']}")
+                else:
+                    st.success(f"Created {summary['rowcount']} user(s) in {len(summary['batches'])} batch(es).")
+                st.dataframe(pd.DataFrame(summary["batches"]), width='stretch')
+
 # Manage centers tab
 def _manage_centers_tab(current_user_code: str, current_user_role: str):
     st.header("Manage Centers")
@@ -322,8 +410,8 @@ def _manage_centers_tab(current_user_code: str, current_user_role: str):
                             "center_type": center_type.strip() if center_type else None,
                             "status": status.strip() if status else None,
                         }
-                        r = _create_center(payload)
-                        verify = run_query("SELECT * FROM center_details WHERE center_code = :cc", {"cc": payload["center_code"]}, fetch_one=True)
+                        verify = _write_and_verify(CREATE_CENTER_SQL, payload,
+                                                   "SELECT * FROM center_details WHERE center_code = :cc", {"cc": payload["center_code"]})
                         if verify:
                             st.success("Center added successfully.")
                         else:
@@ -355,8 +443,8 @@ def _manage_centers_tab(current_user_code: str, current_user_role: str):
                             "status": new_status.strip() or center_row.get("status"),
                             "orig_center_code": orig_center_code,
                         }
-                        r = _update_center(payload)
-                        verify = run_query("SELECT * FROM center_details WHERE center_code = :cc LIMIT 1", {"cc": payload["new_center_code"]}, fetch_one=True)
+                        verify = _write_and_verify(UPDATE_CENTER_SQL, payload,
+                                                   "SELECT * FROM center_details WHERE center_code = :cc LIMIT 1", {"cc": payload["new_center_code"]})
                         if verify:
                             st.success("Center updated successfully.")
                         else:
@@ -379,8 +467,7 @@ def admin_page():
     st.title("Administration")
     st.markdown("---")
 
-    rows = _load_all_employees()
-    st.markdown(f"**Total employees:** {len(rows)}")
+    st.markdown(f"**Total employees:** {_count_employees()}")
     st.markdown("---")
 
     main_tabs = st.tabs(["Manage Users", "Manage Centers"])
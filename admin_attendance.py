@@ -1,97 +1,29 @@
 import streamlit as st
-from io import BytesIO, StringIO
-import tempfile
-from pathlib import Path
-from datetime import datetime, timedelta, date
+from tempfile import TemporaryFile
+from datetime import timedelta, date
 import os
 import csv
-import base64
-from PIL import Image, UnidentifiedImageError
-
-from database import run_query  # your DB helper
-
-# Where to save temp images (Option B - temp directory)
-IMAGE_DIR = Path(tempfile.gettempdir()) / "attendance_images"
-IMAGE_DIR.mkdir(parents=True, exist_ok=True)
-
-# How long to keep temp files (hours)
-CLEANUP_HOURS = 24
-
-
-def _cleanup_old_images():
-    cutoff = datetime.now() - timedelta(hours=CLEANUP_HOURS)
-    for p in IMAGE_DIR.glob("*"):
-        try:
-            if datetime.fromtimestamp(p.stat().st_mtime) < cutoff:
-                p.unlink(missing_ok=True)
-        except Exception:
-            pass
-
-
-def _ensure_bytes(blob):
-    """Accepts bytes, memoryview, or str and returns bytes or None."""
-    if blob is None:
-        return None
-    if isinstance(blob, bytes):
-        return blob
-    if isinstance(blob, memoryview):
-        return blob.tobytes()
-    if isinstance(blob, str):
-        return blob.encode("utf-8", errors="ignore")
-    try:
-        return bytes(blob)
-    except Exception:
-        return None
-
-
-def _blob_to_png_bytes(blob):
-    """Try to convert any image blob to PNG bytes via PIL. If that fails, return raw bytes."""
-    b = _ensure_bytes(blob)
-    if not b:
-        return None
-    try:
-        img = Image.open(BytesIO(b))
-        # Normalize to a safe mode
-        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
-            img = img.convert("RGBA")
-        else:
-            img = img.convert("RGB")
-        out = BytesIO()
-        img.save(out, format="PNG")
-        return out.getvalue()
-    except UnidentifiedImageError:
-        # Not a recognized image — return raw bytes (still may display depending on browser)
-        return b
-    except Exception:
-        return b
-
-
-def _save_blob_to_file(blob: bytes, prefix: str):
-    """Save blob to disk (PNG if convertible) and return Path or None."""
-    pngbytes = _blob_to_png_bytes(blob)
-    if not pngbytes:
-        return None
-    ts = int(datetime.now().timestamp() * 1000)
-    dest = IMAGE_DIR / f"{prefix}_{ts}.png"
-    try:
-        with open(dest, "wb") as f:
-            f.write(pngbytes)
-        return dest
-    except Exception:
-        return None
-
-
-def _blob_to_data_url(blob: bytes):
-    """Return a data:image/png;base64,... string suitable for use as an href/src."""
-    pngbytes = _blob_to_png_bytes(blob)
-    if not pngbytes:
-        return None
-    b64 = base64.b64encode(pngbytes).decode("ascii")
-    return f"data:image/png;base64,{b64}"
+
+from database import (  # your DB helper
+    run_query, run_query_frame, run_case_update, stream_query, STREAM_CHUNK_SIZE,
+    BlobHandle, blob_projection, with_blob_handles, load_blobs,
+)
+from attendance import compute_working_hours
+from image_server import image_url, install_image_route
+from image_purge import (
+    PURGE_RETENTION_DAYS, count_purgeable, is_alive, is_resumable, job_state, purge_cutoff,
+    purge_thread_running, start_purge_thread, stop_purge_thread,
+)
+
+
+ATTENDANCE_TABLE = "preamji_attendance"
+# Rows rendered in the results table; the CSV always has all of them
+RESULTS_MAX_HTML_ROWS = 500
 
 
 def _build_search_query(emp_code: str = None, start_date: date = None, end_date: date = None):
-    base = "SELECT * FROM preamji_attendance"
+    # image columns come back as sizes; _render_streamed_rows links or loads them per chunk
+    base = f"SELECT {blob_projection(ATTENDANCE_TABLE)} FROM {ATTENDANCE_TABLE}"
     conditions = []
     params = {}
     if emp_code:
@@ -109,19 +41,6 @@ def _build_search_query(emp_code: str = None, start_date: date = None, end_date:
     return base, params
 
 
-def _rows_to_csv_bytes(rows):
-    """Convert list-of-mappings rows to CSV bytes."""
-    if not rows:
-        return b""
-    columns = list(rows[0].keys())
-    str_buf = StringIO()
-    writer = csv.writer(str_buf)
-    writer.writerow(columns)
-    for r in rows:
-        writer.writerow([r.get(c) if r.get(c) is not None else "" for c in columns])
-    return str_buf.getvalue().encode("utf-8")
-
-
 def _rows_to_dataframe(rows):
     import pandas as pd
     if not rows:
@@ -140,73 +59,36 @@ def _escape_html(s):
     )
 
 
-def _make_image_cell(blob, row_id, col_key):
-    """Return HTML for a single image cell (thumbnail + click to open)."""
-    if not blob:
+# Normal data columns (DB field name, header text) – ID REMOVED
+TABLE_COLUMNS = [
+    ("attendance_date", "Date"),
+    ("emp_code_of_thetechnician", "Employee Code"),
+    ("name_of_technician", "Name"),
+    ("on_duty_in_time", "In Time"),
+    ("on_duty_out_time", "Out Time"),
+    ("total_working_hrs", "Total Hrs"),
+    ("effective_working_hrs", "Effective Hrs"),
+    ("center_location", "Location"),
+]
+
+
+def _image_cell(row, col_key):
+    """Return HTML for a single image cell (thumbnail, linking to the full image)."""
+    # links to the image route; the browser fetches (and caches) the bytes
+    thumb_url = image_url(ATTENDANCE_TABLE, col_key, row, thumb=True)
+    full_url = image_url(ATTENDANCE_TABLE, col_key, row)
+    if not thumb_url or not full_url:
         return '<div style="color:#999">No image</div>'
+    return (
+        f'<a href="{full_url}" target="_blank" rel="noopener noreferrer" '
+        f'title="Open full image">'
+        f'<img src="{thumb_url}" loading="lazy" '
+        f'style="max-width:80px;max-height:60px;border-radius:4px;"/></a>'
+    )
 
-    data_url = _blob_to_data_url(blob)
-    saved = _save_blob_to_file(blob, prefix=f"att_{row_id}_{col_key}")
-
-    if data_url:
-        return (
-            f'<a href="{data_url}" target="_blank" rel="noopener noreferrer" '
-            f'title="Open full image"><img src="{data_url}" '
-            f'style="max-width:80px;max-height:60px;border-radius:4px;"/></a>'
-        )
-
-    if saved:
-        file_url = f"file://{saved}"
-        return (
-            f'<a href="{file_url}" target="_blank" rel="noopener noreferrer">'
-            f'<img src="{file_url}" style="max-width:80px;max-height:60px;'
-            f'border-radius:4px;"/></a>'
-        )
-
-    return '<div style="color:#999">No image</div>'
-
-
-def _build_html_table(rows, max_rows=100):
-    """Render an HTML table (compact) with 4 separate image columns."""
-    # Normal data columns (DB field name, header text) – ID REMOVED
-    columns = [
-        ("attendance_date", "Date"),
-        ("emp_code_of_thetechnician", "Employee Code"),
-        ("name_of_technician", "Name"),
-        ("on_duty_in_time", "In Time"),
-        ("on_duty_out_time", "Out Time"),
-        ("total_working_hrs", "Total Hrs"),
-        ("effective_working_hrs", "Effective Hrs"),
-        ("center_location", "Location"),
-    ]
-
-    def _image_cell(row, col_key):
-        """Return HTML for a single image cell."""
-        blob = row.get(col_key)
-        if not blob:
-            return '<div style="color:#999">No image</div>'
-
-        # we can still use id internally if present, but it's not displayed
-        row_id = row.get("id", "")
-        data_url = _blob_to_data_url(blob)
-        saved = _save_blob_to_file(blob, prefix=f"att_{row_id}_{col_key}")
-
-        if data_url:
-            return (
-                f'<a href="{data_url}" target="_blank" rel="noopener noreferrer" '
-                f'title="Open full image">'
-                f'<img src="{data_url}" '
-                f'style="max-width:80px;max-height:60px;border-radius:4px;"/></a>'
-            )
-        if saved:
-            file_url = f"file://{saved}"
-            return (
-                f'<a href="{file_url}" target="_blank" rel="noopener noreferrer">'
-                f'<img src="{file_url}" '
-                f'style="max-width:80px;max-height:60px;border-radius:4px;"/></a>'
-            )
-        return '<div style="color:#999">No image</div>'
 
+def _html_table_head():
+    """Opening markup (styles + header row) of the attendance table."""
     html = []
     html.append("<style>")
     html.append("""
@@ -244,53 +126,169 @@ def _build_html_table(rows, max_rows=100):
     html.append("<th>Out Photo</th>")
     html.append("<th>Break start photo</th>")
     html.append("<th>Break end photo</th>")
-    for _, label in columns:
+    for _, label in TABLE_COLUMNS:
         html.append(f"<th>{_escape_html(label)}</th>")
     html.append("</tr></thead><tbody>")
+    return "\n".join(html)
 
-    # ---------- table body ----------
-    for r in rows[:max_rows]:
-        html.append("<tr>")
 
-        # 4 separate image cells
-        html.append(f'<td class="thumb-cell">{_image_cell(r, "on_duty_in_image")}</td>')
-        html.append(f'<td class="thumb-cell">{_image_cell(r, "on_duty_out_image")}</td>')
-        html.append(f'<td class="thumb-cell">{_image_cell(r, "intermidiate_off_out_image")}</td>')
-        html.append(f'<td class="thumb-cell">{_image_cell(r, "intermidiate_off_in_image")}</td>')
+def _html_table_row(r):
+    """One <tr> of the attendance table."""
+    html = ["<tr>"]
 
-        # normal text columns
-        for col_key, _label in columns:
-            val = r.get(col_key)
-            html.append(f"<td>{_escape_html(val)}</td>")
+    # 4 separate image cells
+    html.append(f'<td class="thumb-cell">{_image_cell(r, "on_duty_in_image")}</td>')
+    html.append(f'<td class="thumb-cell">{_image_cell(r, "on_duty_out_image")}</td>')
+    html.append(f'<td class="thumb-cell">{_image_cell(r, "intermidiate_off_out_image")}</td>')
+    html.append(f'<td class="thumb-cell">{_image_cell(r, "intermidiate_off_in_image")}</td>')
 
-        html.append("</tr>")
+    # normal text columns
+    for col_key, _label in TABLE_COLUMNS:
+        val = r.get(col_key)
+        html.append(f"<td>{_escape_html(val)}</td>")
 
+    html.append("</tr>")
+    return "\n".join(html)
+
+
+def _build_html_table(rows, max_rows=100):
+    """Render an HTML table (compact) with 4 separate image columns."""
+    html = [_html_table_head()]
+    for r in rows[:max_rows]:
+        html.append(_html_table_row(r))
     html.append("</tbody></table>")
     return "\n".join(html)
 
 
+def _render_streamed_rows(chunks, route="primary", max_html_rows=RESULTS_MAX_HTML_ROWS):
+    """
+    Consume row chunks from stream_query exactly once and build the CSV
+    export and the HTML table together. Returns (row_count, csv_file, html,
+    html_rows); csv_file is a text temp file on disk, positioned at the
+    start (st.download_button still reads it into memory to serve it).
+    Only the first max_html_rows rows are rendered, so the HTML (and any
+    inlined images) does not grow with the date range; the CSV has every
+    row, with image sizes instead of the raw bytes. Image columns are linked
+    to the image route (or, without it, fetched with one query per chunk
+    for the rendered rows only).
+    """
+    csv_file = TemporaryFile(mode="w+", encoding="utf-8", newline="")
+    writer = csv.writer(csv_file)
+    columns = None
+    html = [_html_table_head()]
+    count = 0
+
+    for chunk in chunks:
+        with_blob_handles(chunk, ATTENDANCE_TABLE, route=route)
+        shown = chunk[:max(0, max_html_rows - count)]
+        if shown and not install_image_route():
+            load_blobs([v for r in shown for v in r.values() if isinstance(v, BlobHandle)])
+        for r in chunk:
+            if columns is None:
+                columns = list(r.keys())
+                writer.writerow(columns)
+            writer.writerow([r.get(c) if r.get(c) is not None else "" for c in columns])
+        html.extend(_html_table_row(r) for r in shown)
+        count += len(chunk)
+
+    html.append("</tbody></table>")
+    csv_file.seek(0)
+    return count, csv_file, "\n".join(html), min(count, max_html_rows)
+
+
+def _recompute_working_hours(start_date: date, end_date: date, batch_size: int = 500):
+    """Recalculate total/break/effective hours for every completed day in the range."""
+    rows = run_query(
+        """
+        SELECT id, on_duty_in_time, intermidiate_off_out_time,
+               intermidiate_off_in_time, on_duty_out_time
+        FROM preamji_attendance
+        WHERE attendance_date BETWEEN :start AND :end
+          AND on_duty_in_time IS NOT NULL
+          AND on_duty_out_time IS NOT NULL
+        """,
+        {"start": start_date.isoformat(), "end": end_date.isoformat()},
+        fetch_one=False,
+    ) or []
+    updates = []
+    for r in rows:
+        hours = compute_working_hours(r)
+        if hours:
+            updates.append({
+                "id": r["id"],
+                "total_working_hrs": hours["tw"],
+                "total_break_hrs": hours["tb"],
+                "effective_working_hrs": hours["ew"],
+            })
+    # one UPDATE ... CASE per batch; executemany would send one UPDATE per row
+    return run_case_update("preamji_attendance", "id", updates, batch_size=batch_size)
+
+
+def _render_purge_state(state):
+    if not state:
+        return
+    done = 1.0 if state["status"] == "done" else int(state["rows_done"]) / max(int(state["rows_total"]), 1)
+    st.progress(
+        min(done, 1.0),
+        text=(
+            f"{state['status'].capitalize()}: pictures before {state['cutoff']} - "
+            f"{state['rows_done']} of {state['rows_total']} record(s) cleared, "
+            f"up to id {state['last_id']} of {state['max_id']}"
+        ),
+    )
+    if state.get("message"):
+        st.caption(state["message"])
+
+
+@st.fragment(run_every=2)
+def _live_purge_progress():
+    state = job_state()
+    _render_purge_state(state)
+    if not purge_thread_running() and not is_alive(state):
+        st.rerun()  # finished: redraw the section without polling
+
+
+def _purge_section():
+    """Dry-run count, start / resume / stop and progress of the background picture purge."""
+    with st.expander("🧹 Clear old pictures"):
+        days = st.number_input(
+            "Keep pictures of the last N days", min_value=1, value=PURGE_RETENTION_DAYS, step=1, key="purge_days"
+        )
+        cutoff = purge_cutoff(days)
+        state = job_state()
+        running = purge_thread_running() or is_alive(state)
+
+        c1, c2, c3 = st.columns(3)
+        if c1.button("Count (dry run)", key="purge_count"):
+            counts = count_purgeable(cutoff)
+            if counts is not None:
+                st.info(f"{counts['rows']} record(s) dated before {cutoff} still have pictures.")
+        resume = is_resumable(state) and not running
+        if c2.button("Resume purge" if resume else "Start purge", key="purge_start", disabled=running):
+            if start_purge_thread(cutoff):
+                running = True
+            else:
+                st.warning("A purge is already running.")
+        if c3.button("Stop", key="purge_stop", disabled=not purge_thread_running()):
+            stop_purge_thread()
+            st.info("The purge stops after the current batch; it can be resumed later.")
+
+        if resume:
+            st.caption(f"An unfinished purge (pictures before {state['cutoff']}) will be resumed.")
+        st.caption("Images cleared here are deleted from the image store by `python image_store.py gc`.")
+        if running:
+            _live_purge_progress()
+        else:
+            _render_purge_state(state)
+
+
 def admin_attendance_page():
     if not st.session_state.get("logged_in"):
         st.warning("Please log in to view attendance records.")
         return
 
-    # --- Maintenance button at top of page ---
-    if st.button("🧹 Clear old picture (older than 31 days)"):
-        try:
-            clear_sql = """
-                UPDATE preamji_attendance
-                SET
-                    on_duty_in_image = NULL,
-                    on_duty_out_image = NULL,
-                    intermidiate_off_out_image = NULL,
-                    intermidiate_off_in_image = NULL
-                WHERE attendance_date < (CURDATE() - INTERVAL 31 DAY)
-            """
-            # run the UPDATE
-            run_query(clear_sql, fetch_one=False)
-            st.success("Old picture fields cleared for all records older than 31 days.")
-        except Exception as e:
-            st.error(f"Failed to clear old pictures: {e}")
+    # --- Maintenance at top of page ---
+    _purge_section()
 #===================================================================
     # --- Summary report for a date range (per employee) ---
     st.subheader("Attendance summary report")
@@ -331,16 +329,16 @@ def admin_attendance_page():
                 "start": summary_start.isoformat(),
                 "end": summary_end.isoformat(),
             }
-            summary_rows = run_query(summary_sql, params, fetch_one=False) or []
-            st.write(f"Found {len(summary_rows)} employee(s) in this date range.")
+            df_summary = run_query_frame(summary_sql, params, reporting=True)
+            if df_summary is None:
+                df_summary = _rows_to_dataframe([])
+            st.write(f"Found {len(df_summary)} employee(s) in this date range.")
 
-            if summary_rows:
-                # Convert to dataframe for nice table view
-                df_summary = _rows_to_dataframe(summary_rows)
+            if not df_summary.empty:
                 st.dataframe(df_summary, width='stretch')
 
                 # CSV download
-                csv_bytes = _rows_to_csv_bytes(summary_rows)
+                csv_bytes = df_summary.to_csv(index=False).encode("utf-8")
                 st.download_button(
                     "Download summary report as CSV",
                     data=csv_bytes,
@@ -352,6 +350,28 @@ def admin_attendance_page():
 
 
 
+#===================================================================
+    # --- Historical fix: recompute working hours in bulk ---
+    with st.expander("Recompute working hours for a date range"):
+        r1, r2, r3 = st.columns([2, 2, 1])
+        with r1:
+            fix_start = st.date_input("From", value=date.today() - timedelta(days=30), key="fix_hours_start")
+        with r2:
+            fix_end = st.date_input("To", value=date.today(), key="fix_hours_end")
+        with r3:
+            fix_batch = st.number_input("Batch size", min_value=50, max_value=5000, value=500, step=50, key="fix_hours_batch")
+        if st.button("Recompute hours", key="btn_fix_hours"):
+            if fix_start > fix_end:
+                st.error("Start date cannot be after end date.")
+            else:
+                summary = _recompute_working_hours(fix_start, fix_end, int(fix_batch))
+                if summary["error"]:
+                    st.error(f"Stopped after {summary['rowcount']} row(s): {summary['error']}")
+                else:
+                    st.success(f"Updated {summary['rowcount']} row(s) in {len(summary['batches'])} batch(es).")
+                if summary["batches"]:
+                    st.dataframe(_rows_to_dataframe(summary["batches"]), width='stretch')
+
 #===================================================================
     # ---- Search area ----
     st.subheader("Search attendance (employee code + date range)")
@@ -370,19 +390,22 @@ def admin_attendance_page():
         q, params = _build_search_query(
             emp_code.strip() if emp_code else None, start, end
         )
-        rows = run_query(q, params, fetch_one=False) or []
-        st.write(f"Found {len(rows)} matching rows")
+        count, csv_file, html, shown = _render_streamed_rows(
+            stream_query(q, params, chunk_size=STREAM_CHUNK_SIZE, reporting=True),
+            route="reporting",
+        )
+        st.write(f"Found {count} matching rows")
 
-        if rows:
-            csv_bytes = _rows_to_csv_bytes(rows)
+        if count:
+            if shown < count:
+                st.caption(f"Showing the first {shown} rows; the CSV has all {count}.")
             st.download_button(
                 "Download results as CSV",
-                data=csv_bytes,
+                data=csv_file,
                 file_name="attendance_results.csv",
                 mime="text/csv",
             )
 
-            html = _build_html_table(rows, max_rows=len(rows))
             st.markdown(
                 f"""
                 <div style="width:100%; overflow-x:auto;">
@@ -393,30 +416,27 @@ def admin_attendance_page():
             )
         else:
             st.info("No records match your search.")
+        csv_file.close()
 
     st.markdown("---")
     st.caption(
-        "Images are rendered as thumbnails and open in a new tab when clicked. "
-        "Temporary image files are saved in the server's temp folder and cleaned after 24 hours."
+        "Images are rendered as thumbnails and open in a new tab when clicked."
     )
 
-    _cleanup_old_images()
-
     # --- Today's records, shown only after button click ---
     st.subheader("Today's attendance entries (table)")
 
     if st.button("Show today's attendance records"):
         today = date.today().isoformat()
-        today_sql = """
-            SELECT *
-            FROM preamji_attendance
-            WHERE attendance_date = :today
-            ORDER BY id DESC
-        """
-        today_rows = run_query(today_sql, {"today": today}, fetch_one=False) or []
+        today_sql, params = _build_search_query(None, date.today(), date.today())
+        count, csv_file, html, shown = _render_streamed_rows(
+            stream_query(today_sql, params, chunk_size=STREAM_CHUNK_SIZE, reporting=True),
+            route="reporting",
+        )
 
-        if today_rows:
-            html = _build_html_table(today_rows, max_rows=len(today_rows))
+        if count:
+            if shown < count:
+                st.caption(f"Showing the first {shown} rows; the CSV has all {count}.")
             st.markdown(
                 f"""
                 <div style="width:100%; overflow-x:auto;">
@@ -427,14 +447,14 @@ def admin_attendance_page():
             )
 
             # CSV download for today's records
-            csv_bytes = _rows_to_csv_bytes(today_rows)
             st.download_button(
                 "Download today's attendance as CSV",
-                data=csv_bytes,
+                data=csv_file,
                 file_name=f"attendance_{today}.csv",
                 mime="text/csv",
             )
         else:
             st.info("No attendance records found for today.")
+        csv_file.close()
 
     st.markdown("---")
@@ -0,0 +1,205 @@
+# admin_diagnostics.py
+import streamlit as st
+import pandas as pd
+
+from attendance import face_detector_health
+from disk_cache import image_cache
+from image_store import clear_thumbnail_cache, get_thumbnail_cache_stats
+
+from database import (
+    clear_cache,
+    get_cache_stats,
+    get_engine_stats,
+    get_query_stats,
+    get_rerun_query_counts,
+    read_slow_query_log,
+    reset_query_stats,
+)
+
+
+def _query_stats_section():
+    st.subheader("Query statistics (this server process)")
+
+    stats = get_query_stats()
+    if not stats:
+        st.info("No queries recorded yet.")
+        return
+
+    df = pd.DataFrame(stats)
+    df["avg_kb"] = (df["avg_bytes"] / 1024).round(1)
+    df["total_mb"] = (df["bytes"] / (1024 * 1024)).round(2)
+
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Distinct statements", len(df))
+    c2.metric("Total calls", int(df["calls"].sum()))
+    c3.metric("Data returned (MB)", round(float(df["total_mb"].sum()), 2))
+
+    sort_by = st.selectbox(
+        "Sort by",
+        ["total_ms", "p95_ms", "p99_ms", "calls", "total_mb", "avg_rows"],
+        key="diag_sort_by",
+    )
+    df = df.sort_values(sort_by, ascending=False)
+
+    filter_text = st.text_input("Filter statements (e.g. preamji_attendance)", key="diag_filter")
+    if filter_text:
+        df = df[df["fingerprint"].str.contains(filter_text, case=False, regex=False)]
+
+    st.dataframe(
+        df[[
+            "fingerprint", "calls", "errors", "total_ms", "p50_ms", "p95_ms",
+            "p99_ms", "max_ms", "avg_rows", "avg_kb", "total_mb",
+        ]],
+        width='stretch',
+        hide_index=True,
+    )
+    st.download_button(
+        "Download statistics as CSV",
+        data=df.to_csv(index=False),
+        file_name="query_stats.csv",
+        mime="text/csv",
+    )
+
+
+def _rerun_stats_section():
+    st.subheader("Queries per rerun")
+    counts = get_rerun_query_counts()
+    if not counts:
+        st.info("No completed reruns recorded yet.")
+        return
+    s = pd.Series(counts)
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Reruns sampled", len(s))
+    c2.metric("Median queries / rerun", int(s.median()))
+    c3.metric("Max queries / rerun", int(s.max()))
+    st.bar_chart(s.reset_index(drop=True))
+
+
+def _cache_section():
+    st.subheader("Read cache")
+    stats = get_cache_stats()
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = (stats["hits"] / lookups * 100) if lookups else 0.0
+
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Hit rate", f"{hit_rate:.1f}%")
+    c2.metric("Entries", f"{stats['entries']} / {stats['max_entries']}")
+    c3.metric("Invalidated", stats["invalidations"])
+    c4.metric("Evicted", stats["evictions"])
+
+    if st.button("Clear read cache"):
+        clear_cache()
+        st.success("Read cache cleared.")
+
+
+def _thumbnail_cache_section():
+    st.subheader("Thumbnail cache")
+    stats = get_thumbnail_cache_stats()
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = (stats["hits"] / lookups * 100) if lookups else 0.0
+
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Hit rate", f"{hit_rate:.1f}%")
+    c2.metric("Entries", stats["entries"])
+    c3.metric("Size (MB)", f"{stats['bytes'] / 1024 / 1024:.1f} / {stats['max_bytes'] / 1024 / 1024:.0f}")
+    c4.metric("Evicted", stats["evictions"])
+
+    disk = image_cache().get_stats()
+    if disk["disabled"]:
+        st.warning(f"Disk cache disabled: {image_cache().entries} was not created by the cache.")
+    st.caption(
+        f"Disk cache ({image_cache().root}): {disk['entries']} file(s), "
+        f"{disk['bytes'] / 1024 / 1024:.1f} / {disk['max_bytes'] / 1024 / 1024:.0f} MB, "
+        f"{disk['hits']} hit(s), {disk['misses']} miss(es), {disk['evictions']} evicted."
+    )
+
+    if st.button("Clear thumbnail cache"):
+        clear_thumbnail_cache()
+        st.success("Thumbnail cache cleared.")
+
+
+def _face_detector_section():
+    st.subheader("Face detector")
+    health = face_detector_health()
+    if not health["ok"]:
+        st.error(f"Not loaded, attendance photos are not checked: {health['error']}")
+        return
+    c1, c2 = st.columns(2)
+    c1.metric("Load time (ms)", health["load_ms"])
+    c2.metric("Classifiers loaded", health["instances"])
+    st.caption(f"Cascade: {health['path']}")
+
+
+def _engine_section():
+    st.subheader("Engines and connection pools")
+    st.caption("Reports marked reporting=True use the 'reporting' route; all writes use 'primary'.")
+    st.dataframe(pd.DataFrame(get_engine_stats()), width='stretch', hide_index=True)
+
+
+def _slow_query_section():
+    st.subheader("Slow queries")
+    limit = st.number_input("Show last N entries", min_value=10, max_value=1000, value=50, step=10, key="diag_slow_limit")
+    entries = read_slow_query_log(int(limit))
+    if not entries:
+        st.info("No slow queries logged.")
+        return
+    df = pd.DataFrame(entries)
+    st.dataframe(
+        df[["logged_at", "elapsed_ms", "rows", "route", "caller", "fingerprint"]],
+        width='stretch',
+        hide_index=True,
+    )
+    idx = st.selectbox(
+        "Inspect entry",
+        options=list(range(len(entries))),
+        format_func=lambda i: f"{entries[i]['logged_at']} — {entries[i]['elapsed_ms']} ms — {entries[i]['caller']}",
+        key="diag_slow_entry",
+    )
+    entry = entries[idx]
+    st.code(entry["sql"], language="sql")
+    st.write("**Parameters**")
+    st.json(entry.get("params") or {})
+    st.write("**EXPLAIN**")
+    if isinstance(entry.get("explain"), list):
+        st.dataframe(pd.DataFrame(entry["explain"]), width='stretch', hide_index=True)
+    else:
+        st.write(entry.get("explain") or "Not available for this statement.")
+
+
+def admin_diagnostics_page():
+    if not st.session_state.get("logged_in"):
+        st.warning("You must be logged in first.")
+        return
+
+    user = st.session_state.get("user") or {}
+    if user.get("user_role") not in ("Admin", "Super Admin"):
+        st.error("Access denied.")
+        return
+
+    st.title("Database diagnostics")
+    st.caption(
+        "Statistics are collected in memory by run_query and reset when the server restarts. "
+        "Statements are grouped by fingerprint (literals and parameters replaced by ?)."
+    )
+
+    if st.button("Reset statistics"):
+        reset_query_stats()
+        st.success("Statistics cleared.")
+
+    _query_stats_section()
+    st.markdown("---")
+    _slow_query_section()
+    st.markdown("---")
+    _rerun_stats_section()
+    st.markdown("---")
+    _cache_section()
+    st.markdown("---")
+    _thumbnail_cache_section()
+    st.markdown("---")
+    _face_detector_section()
+    st.markdown("---")
+    _engine_section()
+
+
+if __name__ == "__main__":
+    admin_diagnostics_page()
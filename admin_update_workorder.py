@@ -1,6 +1,8 @@
 import streamlit as st
 from datetime import timedelta
-from database import run_query
+from database import run_query, run_parallel, transaction
+import image_store
+from imaging import normalize_capture
 from attendance import get_current_ist
 from new_wo_entry import (
     get_teamlead_center,
@@ -57,7 +59,13 @@ def admin_update_workorder_page(user):
     selected = st.selectbox("Search Workorder by ID", list(wo_map.keys()))
     workorder_id = wo_map[selected]
 
-    data = get_workorder_details(workorder_id)
+    # The workorder and the manufacturer list are independent; the technicians
+    # and models depend on the workorder, so they go in a second round.
+    first = run_parallel({
+        "data": lambda: get_workorder_details(workorder_id),
+        "manufacturers": get_vehicle_manufacturers,
+    })
+    data, manufacturers = first["data"], first["manufacturers"]
     if not data:
         st.error("Unable to load workorder details.")
         return
@@ -99,7 +107,11 @@ def admin_update_workorder_page(user):
         "center_location": data["center_location"],
     }
 
-    tech_map = get_technician_map(center["center_code"])
+    second = run_parallel({
+        "tech_map": lambda: get_technician_map(center["center_code"]),
+        "models": lambda: get_vehicle_models(data["vehicle_manufacturer"]),
+    })
+    tech_map = second["tech_map"]
     tech_keys = list(tech_map.keys())
 
     with st.form("edit_workorder_form"):
@@ -146,14 +158,19 @@ def admin_update_workorder_page(user):
 
             vehicle_manufacturer = st.selectbox(
                 "Vehicle Manufacturer",
-                get_vehicle_manufacturers(),
-                index=get_vehicle_manufacturers().index(data["vehicle_manufacturer"]),
+                manufacturers,
+                index=manufacturers.index(data["vehicle_manufacturer"]),
             )
 
+            models = (
+                second["models"]
+                if vehicle_manufacturer == data["vehicle_manufacturer"]
+                else get_vehicle_models(vehicle_manufacturer)
+            )
             vehicle_model = st.selectbox(
                 "Vehicle Model",
-                get_vehicle_models(vehicle_manufacturer),
-                index=get_vehicle_models(vehicle_manufacturer).index(data["vehicle_model"]),
+                models,
+                index=models.index(data["vehicle_model"]) if data["vehicle_model"] in models else 0,
             )
 
             vehicle_variant = st.text_input(
@@ -224,17 +241,10 @@ def admin_update_workorder_page(user):
     # -----------------------------------------------------
     if submit:
 
-        photo_bytes = (
-            jobcard_photo.getvalue()
-            if jobcard_photo
-            else data["jobcard_photo"]
-        )
-
         payload = {
             "jobcard_type": jobcard_type,
             "technician_code": tech["employee_code"],
             "name_of_technician": tech["employee_name"],
-            "jobcard_photo": photo_bytes,
             "vehicle_registration_no": vehicle_registration_no,
             "vehicle_manufacturer": vehicle_manufacturer,
             "vehicle_model": vehicle_model,
@@ -262,13 +272,21 @@ def admin_update_workorder_page(user):
         else:
             completion_sql = ""
 
+        # Only touch the photo when a new one was captured; otherwise the stored
+        # one is left as it is (it is never downloaded for this page).
+        if jobcard_photo:
+            payload["jobcard_photo_sha256"] = image_store.put(normalize_capture(jobcard_photo.getvalue()))
+            photo_sql = "jobcard_photo_sha256 = :jobcard_photo_sha256, jobcard_photo = NULL,"
+        else:
+            photo_sql = ""
+
         sql = f"""
             UPDATE workorder_entry
             SET
                 jobcard_type = :jobcard_type,
                 technician_code = :technician_code,
                 name_of_technician = :name_of_technician,
-                jobcard_photo = :jobcard_photo,
+                {photo_sql}
                 vehicle_registration_no = :vehicle_registration_no,
                 vehicle_manufacturer = :vehicle_manufacturer,
                 vehicle_model = :vehicle_model,
@@ -286,6 +304,18 @@ def admin_update_workorder_page(user):
             WHERE id = :id
         """
 
-        run_query(sql, payload)
-        st.success("✅ Workorder updated successfully.")
-        st.rerun()
+        # Lock the row and make sure nobody changed its status since the form
+        # was loaded, then update - one connection, one commit.
+        with transaction() as tx:
+            current = tx.execute(
+                "SELECT job_status FROM workorder_entry WHERE id = :id FOR UPDATE",
+                {"id": workorder_id},
+                fetch_one=True,
+            )
+            if not current or current["job_status"] != old_status:
+                tx.abort("❌ This workorder was changed by someone else. Please reload and try again.")
+            tx.execute(sql, payload)
+
+        if tx.ok:
+            st.success("✅ Workorder updated successfully.")
+            st.rerun()
@@ -3,17 +3,20 @@ from datetime import datetime
 import pytz
 import requests
 # import ntplib
-from sqlalchemy import text
-from database import get_db_engine
-from io import BytesIO
-from PIL import Image
-import base64
+from database import run_query, transaction, with_blob_handles
+import image_store
+from image_server import image_url
+from imaging import decode_image, encode_image
 import time
 from zoneinfo import ZoneInfo
 # NEW imports for face detection
 import cv2
 import numpy as np
-import os
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
 
 
 # -------------------------------------------------------------
@@ -76,26 +79,197 @@ def get_current_ist(timeout=3, debug=False):
 
 
 # -------------------------------------------------------------
-# IMAGE COMPRESSION
+# CAPTURE DECODING
 # -------------------------------------------------------------
-def compress_image(image_data, max_size=(640, 480), quality=60):
+# Stored attendance photo
+CAPTURE_MAX_SIZE = (640, 480)
+CAPTURE_QUALITY = 60
+# Longest side of the grayscale frame the face detector sees
+DETECT_MAX_SIDE = 320
+# minSize used to be 40px on the full capture; the same face at the detection
+# resolution (20px). The cascade's window is 24px, so in practice the smallest
+# face found is 48px of a 640px capture - far below min_face_fraction anyway.
+DETECT_MIN_SIZE = max(1, round(40 * DETECT_MAX_SIDE / max(CAPTURE_MAX_SIZE)))
+# The oval the camera preview is clipped to (CSS ellipse(36% 50% at 50% 46%)
+# in attendance_page): centre x, centre y, radius x, radius y as fractions
+# of the preview, a square showing the centre of the frame (object-fit: cover)
+GUIDE_OVAL = (0.50, 0.46, 0.36, 0.50)
+# Only look for the face inside the oval's bounding box
+FACE_CHECK_ROI = True
+
+
+def decode_capture(image_bytes, max_size=CAPTURE_MAX_SIZE):
+    """The capture as an upright RGB image no larger than max_size, or None if unreadable."""
     try:
-        img = Image.open(BytesIO(image_data))
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        img.thumbnail(max_size)
-        buf = BytesIO()
-        img.save(buf, format="JPEG", quality=quality, optimize=True)
-        return buf.getvalue()
-    except Exception as e:
-        st.error(f"Image compression failed: {e}")
-        return image_data
+        return decode_image(image_bytes, max_size)
+    except Exception:
+        return None
+
+
+def detection_frame(img):
+    """Grayscale array of a decoded capture, shrunk to DETECT_MAX_SIDE for the face detector."""
+    gray = np.asarray(img.convert("L"))
+    h, w = gray.shape
+    scale = DETECT_MAX_SIDE / max(h, w)
+    if scale < 1:
+        gray = cv2.resize(gray, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def encode_capture(img, quality=CAPTURE_QUALITY):
+    """JPEG bytes stored for an accepted capture."""
+    return encode_image(img, quality, "JPEG")
 
 
 # -------------------------------------------------------------
 # FACE DETECTION HELPER
 # -------------------------------------------------------------
-def verify_face(image_bytes, min_face_fraction=0.12):
+CASCADE_FILENAME = "haarcascade_frontalface_default.xml"
+
+# Idle classifiers. detectMultiScale is not safe to call concurrently on one
+# instance, so each detection borrows one (loading another only when all are busy).
+_cascade_pool = queue.SimpleQueue()
+_cascade_lock = threading.Lock()
+_cascade_health = {"ok": None, "path": None, "error": None, "load_ms": None, "instances": 0}
+_LOGGER = logging.getLogger(__name__)
+
+
+def _cascade_path():
+    """The cascade next to this file, else the copy bundled with opencv-python; None if neither exists."""
+    candidates = [Path(__file__).resolve().parent / CASCADE_FILENAME]
+    if hasattr(cv2, "data"):
+        candidates.append(Path(cv2.data.haarcascades) / CASCADE_FILENAME)
+    return next((p for p in candidates if p.exists()), None)
+
+
+def _load_cascade(path):
+    # caller holds _cascade_lock
+    cascade = cv2.CascadeClassifier(str(path))
+    if cascade.empty():
+        raise RuntimeError(f"could not load {path}")
+    _cascade_health["instances"] += 1
+    return cascade
+
+
+def warm_up_face_detector():
+    """
+    Load the face classifier once per process (call at app start) and
+    return the health flag: {"ok", "path", "error", "load_ms", "instances"}.
+    """
+    if _cascade_health["ok"] is not None:
+        return dict(_cascade_health)
+    with _cascade_lock:
+        if _cascade_health["ok"] is None:
+            start = time.perf_counter()
+            path = _cascade_path()
+            try:
+                if path is None:
+                    raise FileNotFoundError(f"{CASCADE_FILENAME} not found")
+                _cascade_pool.put(_load_cascade(path))
+                _cascade_health.update(ok=True, path=str(path), load_ms=round((time.perf_counter() - start) * 1000, 1))
+            except Exception as e:
+                _cascade_health.update(ok=False, path=str(path) if path else None, error=str(e))
+                _LOGGER.error("Face detector unavailable, captures will not be checked: %s", e)
+    return dict(_cascade_health)
+
+
+def face_detector_health():
+    return warm_up_face_detector()
+
+
+@contextmanager
+def _face_cascade():
+    """Borrow a classifier for one detection (None if the detector is unavailable)."""
+    health = warm_up_face_detector()
+    if not health["ok"]:
+        yield None
+        return
+    try:
+        cascade = _cascade_pool.get_nowait()
+    except queue.Empty:
+        with _cascade_lock:
+            cascade = _load_cascade(health["path"])
+    try:
+        yield cascade
+    finally:
+        _cascade_pool.put(cascade)
+
+
+def _guide_ellipse(w, h):
+    """(cx, cy, rx, ry) in pixels of the guide oval on a w x h frame, through the square cover crop."""
+    side = min(w, h)
+    ox, oy = (w - side) / 2, (h - side) / 2
+    cx, cy, rx, ry = GUIDE_OVAL
+    return ox + cx * side, oy + cy * side, rx * side, ry * side
+
+
+def _guide_box(w, h):
+    """(x0, y0, x1, y1) of the guide oval's bounding box in a w x h frame, clipped to the frame."""
+    cx, cy, rx, ry = _guide_ellipse(w, h)
+    return (
+        max(0, int(cx - rx)),
+        max(0, int(cy - ry)),
+        min(w, int(round(cx + rx))),
+        min(h, int(round(cy + ry))),
+    )
+
+
+def _in_guide(x, y, w, h):
+    cx, cy, rx, ry = _guide_ellipse(w, h)
+    return ((x - cx) / rx) ** 2 + ((y - cy) / ry) ** 2 <= 1.0
+
+
+def check_face(img, min_face_fraction=0.12, roi=FACE_CHECK_ROI,
+               scale_factor=1.2, min_neighbors=5, min_size=None):
+    """
+    (ok, reason) for a grayscale frame from detection_frame().
+    min_face_fraction: minimum acceptable face area as fraction of the frame.
+    roi: only scan the guide oval's bounding box, for faces between half the
+    minimum size and the box size; a face centred outside the oval is
+    rejected ("face_outside_guide").
+    scale_factor / min_neighbors / min_size: detectMultiScale settings;
+    min_size is a side in detection-frame pixels (None: derived as above).
+    """
+    h, w = img.shape[:2]
+    total_area = float(h * w)
+    x0 = y0 = 0
+    size = {"minSize": (DETECT_MIN_SIZE, DETECT_MIN_SIZE)}
+    if roi:
+        x0, y0, x1, y1 = _guide_box(w, h)
+        img = img[y0:y1, x0:x1]
+        # half the minimum side: smaller faces are still found, to report face_too_small
+        side = max(DETECT_MIN_SIZE, int((min_face_fraction * total_area) ** 0.5 / 2))
+        largest = min(x1 - x0, y1 - y0)
+        size = {"minSize": (side, side), "maxSize": (largest, largest)}
+    if min_size:
+        size["minSize"] = (int(min_size), int(min_size))
+
+    with _face_cascade() as face_cascade:
+        if face_cascade is None:
+            # If cascade missing, do not block (warm_up_face_detector logged it).
+            return True, "cascade_missing"
+
+        faces = face_cascade.detectMultiScale(
+            img,
+            scaleFactor=scale_factor,
+            minNeighbors=min_neighbors,
+            **size,
+        )
+
+    if len(faces) == 0:
+        return False, "no_face"
+
+    fx, fy, fw, fh = max(faces, key=lambda f: f[2] * f[3])
+    if fw * fh < min_face_fraction * total_area:
+        return False, "face_too_small"
+    if roi and not _in_guide(x0 + fx + fw / 2, y0 + fy + fh / 2, w, h):
+        return False, "face_outside_guide"
+
+    return True, "ok"
+
+
+def verify_face(image_bytes, min_face_fraction=0.12, roi=FACE_CHECK_ROI,
+                scale_factor=1.2, min_neighbors=5, min_size=None):
     """
     Returns (ok: bool, reason: str).
 
@@ -103,41 +277,66 @@ def verify_face(image_bytes, min_face_fraction=0.12):
     ok == False -> block & show error based on reason.
 
     min_face_fraction: minimum acceptable face area as fraction of full image.
+    roi, scale_factor, min_neighbors, min_size: see check_face().
     """
-
-    # Load as grayscale using OpenCV
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+    img = decode_capture(image_bytes)
     if img is None:
         return False, "decode_failed"
+    return check_face(detection_frame(img), min_face_fraction, roi, scale_factor, min_neighbors, min_size)
 
-    h, w = img.shape[:2]
-    total_area = float(h * w)
 
-    cascade_filename = "haarcascade_frontalface_default.xml"
-    if not os.path.exists(cascade_filename):
-        # If cascade missing, do not block (but we can log/info if needed).
-        return True, "cascade_missing"
+def process_capture(image_bytes, min_face_fraction=0.12):
+    """
+    Decode a camera capture once, check the face on a small grayscale copy
+    and encode the photo to store. Returns (ok, reason, jpeg); jpeg is None
+    when the capture is rejected.
+    """
+    img = decode_capture(image_bytes)
+    if img is None:
+        return False, "decode_failed", None
+    ok, reason = check_face(detection_frame(img), min_face_fraction)
+    if not ok:
+        return ok, reason, None
+    return ok, reason, encode_capture(img)
 
-    face_cascade = cv2.CascadeClassifier(cascade_filename)
-    if face_cascade.empty():
-        return True, "cascade_missing"
 
-    faces = face_cascade.detectMultiScale(
-        img,
-        scaleFactor=1.2,
-        minNeighbors=5,
-        minSize=(40, 40),
-    )
+# -------------------------------------------------------------
+# WORKING HOURS
+# -------------------------------------------------------------
+UPDATE_HOURS_SQL = """
+    UPDATE preamji_attendance
+    SET total_working_hrs=:tw,
+        total_break_hrs=:tb,
+        effective_working_hrs=:ew
+    WHERE id=:id
+"""
 
-    if len(faces) == 0:
-        return False, "no_face"
 
-    max_area = max((fw * fh) for (x, y, fw, fh) in faces)
-    if max_area < min_face_fraction * total_area:
-        return False, "face_too_small"
+def compute_working_hours(rec):
+    """
+    Returns {"tw", "tb", "ew"} (total / break / effective hours, rounded)
+    for an attendance row, or None if the day has no in and out time yet.
+    """
+    ti = rec.get("on_duty_in_time")
+    to = rec.get("on_duty_out_time")
+    if not ti or not to:
+        return None
 
-    return True, "ok"
+    total_work = (to - ti).total_seconds() / 3600
+
+    bo = rec.get("intermidiate_off_out_time")
+    bi = rec.get("intermidiate_off_in_time")
+    if bo and bi:
+        total_break = (bi - bo).total_seconds() / 3600
+    else:
+        total_break = 0
+
+    eff = total_work - total_break
+    return {
+        "tw": round(total_work, 2),
+        "tb": round(total_break, 2),
+        "ew": round(eff, 2),
+    }
 
 
 # -------------------------------------------------------------
@@ -168,21 +367,19 @@ def attendance_page(user):
     }
 
     # Fetch today's record
-    engine = get_db_engine()
-    with engine.connect() as conn:
-        row = conn.execute(
-            text(
-                """
-                SELECT *
-                FROM preamji_attendance
-                WHERE emp_code_of_thetechnician=:emp AND attendance_date=:dt
-            """
-            ),
-            {"emp": emp_code, "dt": today_ist},
-        ).fetchone()
+    row = run_query(
+        """
+        SELECT id, on_duty_in_time, intermidiate_off_out_time,
+               intermidiate_off_in_time, on_duty_out_time
+        FROM preamji_attendance
+        WHERE emp_code_of_thetechnician=:emp AND attendance_date=:dt
+        """,
+        {"emp": emp_code, "dt": today_ist},
+        fetch_one=True,
+    )
 
     record = (
-        dict(row._mapping)
+        row
         if row
         else {
             "id": None,
@@ -252,7 +449,7 @@ def attendance_page(user):
             object-fit: cover !important;
             background: black;
 
-            /* show only an oval in the middle */
+            /* show only an oval in the middle (GUIDE_OVAL) */
             clip-path: ellipse(36% 50% at 50% 46%);
             -webkit-clip-path: ellipse(36% 50% at 50% 46%);
             border-radius: 50%;
@@ -284,7 +481,7 @@ def attendance_page(user):
         raw_bytes = img.getvalue()
 
         # ---------- FACE CHECK FIRST (BEFORE DB) ----------
-        ok, reason = verify_face(raw_bytes)
+        ok, reason, compressed = process_capture(raw_bytes)
 
         if not ok:
             # Use ERROR (red) & DO NOT save anything
@@ -300,6 +497,11 @@ def attendance_page(user):
                     "Please move closer so that your face fills most of the oval, "
                     "then retake the photo."
                 )
+            elif reason == "face_outside_guide":
+                st.error(
+                    "❌ Your face is not inside the red oval.\n\n"
+                    "Please centre your face in the oval and take the photo again."
+                )
             elif reason == "decode_failed":
                 st.error("❌ Could not read the image properly. Please try again.")
             else:
@@ -322,110 +524,78 @@ def attendance_page(user):
         h = hash(raw_bytes)
         if h != st.session_state.last_capture:
 
-            compressed = compress_image(raw_bytes)
             tcol, icol, *_ = action_map[next_action]
+            # the row only keeps the hash; the bytes go to the image store
+            hcol = image_store.hash_column(icol)
+            img_hash = image_store.put(compressed)
 
-            with engine.begin() as conn:
+            with transaction() as tx:
 
                 # UPDATE
                 if record["id"]:
-                    conn.execute(
-                        text(
-                            f"UPDATE preamji_attendance "
-                            f"SET {tcol}=:t, {icol}=:img, last_edit_timestamp=:ts "
-                            f"WHERE id=:id"
-                        ),
-                        {"t": now_ist, "img": compressed, "ts": now_ist, "id": record["id"]},
+                    tx.execute(
+                        f"UPDATE preamji_attendance "
+                        f"SET {tcol}=:t, {hcol}=:img, last_edit_timestamp=:ts "
+                        f"WHERE id=:id",
+                        {"t": now_ist, "img": img_hash, "ts": now_ist, "id": record["id"]},
                     )
 
                     # Recalculate only for Out
                     if next_action == "On Duty Out":
-                        rec = conn.execute(
-                            text(
-                                """
-                                SELECT on_duty_in_time,
-                                       intermidiate_off_out_time,
-                                       intermidiate_off_in_time,
-                                       on_duty_out_time
-                                FROM preamji_attendance
-                                WHERE id=:id
-                                """
-                            ),
+                        rec = tx.execute(
+                            """
+                            SELECT on_duty_in_time,
+                                   intermidiate_off_out_time,
+                                   intermidiate_off_in_time,
+                                   on_duty_out_time
+                            FROM preamji_attendance
+                            WHERE id=:id
+                            """,
                             {"id": record["id"]},
-                        ).fetchone()
-
-                        if rec and rec.on_duty_in_time and rec.on_duty_out_time:
-                            ti = rec.on_duty_in_time
-                            to = rec.on_duty_out_time
-                            total_work = (to - ti).total_seconds() / 3600
-
-                            if rec.intermidiate_off_out_time and rec.intermidiate_off_in_time:
-                                bo = rec.intermidiate_off_out_time
-                                bi = rec.intermidiate_off_in_time
-                                total_break = (bi - bo).total_seconds() / 3600
-                            else:
-                                total_break = 0
-
-                            eff = total_work - total_break
-
-                            conn.execute(
-                                text(
-                                    """
-                                    UPDATE preamji_attendance
-                                    SET total_working_hrs=:tw,
-                                        total_break_hrs=:tb,
-                                        effective_working_hrs=:ew
-                                    WHERE id=:id
-                                    """
-                                ),
-                                {
-                                    "tw": round(total_work, 2),
-                                    "tb": round(total_break, 2),
-                                    "ew": round(eff, 2),
-                                    "id": record["id"],
-                                },
-                            )
+                            fetch_one=True,
+                        )
+
+                        hours = compute_working_hours(rec) if rec else None
+                        if hours:
+                            tx.execute(UPDATE_HOURS_SQL, {**hours, "id": record["id"]})
 
                 # INSERT
                 else:
-                    center = conn.execute(
-                        text(
-                            "SELECT center_name, center_location "
-                            "FROM employee_details WHERE employee_code=:e"
-                        ),
+                    center = tx.execute(
+                        "SELECT center_name, center_location "
+                        "FROM employee_details WHERE employee_code=:e",
                         {"e": emp_code},
-                    ).fetchone()
-
-                    cname = center.center_name if center else None
-                    cloc = center.center_location if center else None
-
-                    conn.execute(
-                        text(
-                            f"""
-                            INSERT INTO preamji_attendance(
-                                attendance_date,
-                                emp_code_of_thetechnician,
-                                name_of_technician,
-                                center_name,
-                                center_location,
-                                {tcol},
-                                {icol},
-                                all_innitial_time,
-                                last_edit_timestamp
-                            )
-                            VALUES (
-                                :dt,
-                                :emp,
-                                :name,
-                                :cname,
-                                :cloc,
-                                :t,
-                                :img,
-                                :first,
-                                :ts
-                            )
-                            """
-                        ),
+                        fetch_one=True,
+                    )
+
+                    cname = center["center_name"] if center else None
+                    cloc = center["center_location"] if center else None
+
+                    tx.execute(
+                        f"""
+                        INSERT INTO preamji_attendance(
+                            attendance_date,
+                            emp_code_of_thetechnician,
+                            name_of_technician,
+                            center_name,
+                            center_location,
+                            {tcol},
+                            {hcol},
+                            all_innitial_time,
+                            last_edit_timestamp
+                        )
+                        VALUES (
+                            :dt,
+                            :emp,
+                            :name,
+                            :cname,
+                            :cloc,
+                            :t,
+                            :img,
+                            :first,
+                            :ts
+                        )
+                        """,
                         {
                             "dt": today_ist,
                             "emp": emp_code,
@@ -433,12 +603,16 @@ def attendance_page(user):
                             "cname": cname,
                             "cloc": cloc,
                             "t": now_ist,
-                            "img": compressed,
+                            "img": img_hash,
                             "first": now_ist,
                             "ts": now_ist,
                         },
                     )
 
+            if not tx.ok:
+                # transaction() showed the error; nothing was saved
+                return
+
             st.session_state.last_capture = h
             st.success(f"✅ {next_action} recorded!")
             time.sleep(1)
@@ -491,35 +665,38 @@ def show_today_summary(emp_code):
     now_ist = get_current_ist()
     today_ist = now_ist.date()
 
-    engine = get_db_engine()
-    with engine.connect() as conn:
-        r = conn.execute(
-            text(
-                """
-                SELECT
-                    on_duty_in_time,
-                    on_duty_in_image,
-                    intermidiate_off_out_time,
-                    intermidiate_off_out_image,
-                    intermidiate_off_in_time,
-                    intermidiate_off_in_image,
-                    on_duty_out_time,
-                    on_duty_out_image,
-                    total_working_hrs,
-                    total_break_hrs,
-                    effective_working_hrs
-                FROM preamji_attendance
-                WHERE emp_code_of_thetechnician = :emp AND attendance_date = :dt
-                """
-            ),
-            {"emp": emp_code, "dt": today_ist},
-        ).fetchone()
-
-    if not r:
+    record = run_query(
+        """
+        SELECT
+            id,
+            on_duty_in_time,
+            LENGTH(on_duty_in_image) AS on_duty_in_image,
+            on_duty_in_image_sha256,
+            intermidiate_off_out_time,
+            LENGTH(intermidiate_off_out_image) AS intermidiate_off_out_image,
+            intermidiate_off_out_image_sha256,
+            intermidiate_off_in_time,
+            LENGTH(intermidiate_off_in_image) AS intermidiate_off_in_image,
+            intermidiate_off_in_image_sha256,
+            on_duty_out_time,
+            LENGTH(on_duty_out_image) AS on_duty_out_image,
+            on_duty_out_image_sha256,
+            total_working_hrs,
+            total_break_hrs,
+            effective_working_hrs,
+            last_edit_timestamp
+        FROM preamji_attendance
+        WHERE emp_code_of_thetechnician = :emp AND attendance_date = :dt
+        """,
+        {"emp": emp_code, "dt": today_ist},
+        fetch_one=True,
+    )
+
+    if not record:
         st.info("No attendance data captured yet for today.")
         return
-
-    record = dict(r._mapping)
+    # only the thumbnails are read on every rerun; full images on Preview
+    with_blob_handles(record, "preamji_attendance")
 
     actions = [
         ("On Duty In", "on_duty_in_time", "on_duty_in_image"),
@@ -540,19 +717,12 @@ def show_today_summary(emp_code):
             ts = record.get(time_col)
             st.write(ts.strftime("%H:%M:%S") if ts else "—")
         with col3:
-            image_data = record.get(image_col)
-            if image_data:
-                img = Image.open(BytesIO(image_data))
-                img.thumbnail((100, 100))
-                buf = BytesIO()
-                img.save(buf, format="JPEG")
-                thumb_bytes = buf.getvalue()
-                thumb_b64 = base64.b64encode(thumb_bytes).decode("utf-8")
-
+            thumb_url = image_url("preamji_attendance", image_col, record, thumb=True)
+            if thumb_url:
                 st.markdown(
                     f"""
                     <div class="attendance-thumb" style="display:flex;flex-direction:column;align-items:center;">
-                        <img src="data:image/jpeg;base64,{thumb_b64}" alt="thumbnail" />
+                        <img src="{thumb_url}" alt="thumbnail" />
                     </div>
                     """,
                     unsafe_allow_html=True,
@@ -560,7 +730,7 @@ def show_today_summary(emp_code):
 
                 btn_key = f"view_{action_label.replace(' ', '_')}"
                 if st.button(f"🔎 Preview — {action_label}", key=btn_key):
-                    st.session_state.preview_image = image_data
+                    st.session_state.preview_image = image_store.read_image(record, image_col)
                     st.session_state.preview_label = action_label
             else:
                 st.write("—")
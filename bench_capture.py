@@ -0,0 +1,104 @@
+# bench_capture.py
+"""
+CPU time per attendance punch: face check plus the JPEG that is stored.
+
+    before   cv2.imdecode of the full frame for the face check, then a second
+             full decode with PIL for the stored JPEG (the old verify_face +
+             compress_image, with the pooled cascade)
+    after    attendance.process_capture: one decode, the face check on a
+             DETECT_MAX_SIDE grayscale copy, the stored JPEG from the same frame
+
+    python bench_capture.py                        # synthetic 1280x720 captures
+    python bench_capture.py --size 640 480 --punches 200
+    python bench_capture.py --images captures/*.jpg
+
+Both paths always encode the stored JPEG (the cost of an accepted punch),
+whatever the detector says about the image.
+"""
+import argparse
+import sys
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import attendance
+
+MODES = ("before", "after")
+
+
+def _capture(seed: int, size) -> bytes:
+    """A camera-like JPEG with gradients and noise."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([(x * 255 // w), (y * 255 // h), ((x + y) * 255 // (w + h))], axis=-1)
+    noise = rng.integers(-12, 12, size=(h, w, 3))
+    out = BytesIO()
+    Image.fromarray(np.clip(base + noise, 0, 255).astype("uint8")).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def _before(data: bytes):
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    with attendance._face_cascade() as cascade:
+        if cascade is not None:
+            cascade.detectMultiScale(img, scaleFactor=1.2, minNeighbors=5, minSize=(40, 40))
+    # the old compress_image
+    img = Image.open(BytesIO(data))
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    img.thumbnail(attendance.CAPTURE_MAX_SIZE)
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=attendance.CAPTURE_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+def _after(data: bytes):
+    img = attendance.decode_capture(data)
+    attendance.check_face(attendance.detection_frame(img))
+    return attendance.encode_capture(img)
+
+
+def run(captures, mode: str, punches: int):
+    """(CPU ms per punch, wall ms per punch, stored KB per punch)."""
+    punch = _before if mode == "before" else _after
+    punch(captures[0])  # warm up
+    stored = 0
+    cpu, wall = time.process_time(), time.perf_counter()
+    for i in range(punches):
+        stored += len(punch(captures[i % len(captures)]))
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    return cpu * 1000 / punches, wall * 1000 / punches, stored / 1024 / punches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--punches", type=int, default=100)
+    parser.add_argument("--size", type=int, nargs=2, default=(1280, 720), metavar=("W", "H"))
+    parser.add_argument("--images", nargs="+", help="real captures to use instead of synthetic ones")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--threads", type=int, default=1, help="cv2.setNumThreads (1 = CPU time of one punch)")
+    args = parser.parse_args(argv)
+
+    cv2.setNumThreads(args.threads)
+    health = attendance.warm_up_face_detector()
+    if not health["ok"]:
+        print(f"Face detector unavailable ({health['error']}); timing decode and encode only.")
+    if args.images:
+        captures = [open(path, "rb").read() for path in args.images]
+    else:
+        captures = [_capture(i, tuple(args.size)) for i in range(8)]
+
+    print(f"{args.punches} punches, {len(captures)} distinct capture(s)")
+    print(f"{'mode':<8} {'CPU ms':>8} {'wall ms':>8} {'KB':>6}")
+    for mode in args.modes:
+        cpu, wall, kb = run(captures, mode, args.punches)
+        print(f"{mode:<8} {cpu:>8.1f} {wall:>8.1f} {kb:>6.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# bench_face.py
+"""
+Offline benchmark for attendance.verify_face: latency and accept/reject
+accuracy over a grid of detector settings.
+
+The corpus is a directory of labelled captures:
+
+    corpus/accept/*.jpg    a usable selfie (face fills the oval)
+    corpus/reject/*.jpg    anything that must be refused
+
+Synthetic cases are added to it (see SYNTHETIC): blank frames with no face,
+a drawn face (_face, accepted by the bundled cascade) and variants made from
+it and from every accept image - the face shrunk into a larger frame
+(small), darkened (dark) and tilted (rotated), each with the label
+verify_face should give it. Without a corpus only the synthetic cases run.
+
+    python bench_face.py
+    python bench_face.py --corpus corpus
+    python bench_face.py --corpus corpus --scale-factors 1.1 1.2 1.3 --min-neighbors 3 5 7 --min-sizes 0 48
+    python bench_face.py --corpus corpus --roi off --csv grid.csv
+
+For each setting it prints the per-image latency percentiles (decode plus
+detection, one OpenCV thread) and the confusion matrix: TA / FR are accept
+images accepted / rejected, FA / TR are reject images accepted / rejected.
+"""
+import argparse
+import csv
+import itertools
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+import attendance
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
+# name -> label verify_face should give the synthetic variant of an accept image
+SYNTHETIC = {"small": "reject", "dark": "accept", "rotated": "accept"}
+SMALL_SCALE = 0.25     # face image shrunk to this fraction of the frame side
+DARK_BRIGHTNESS = 0.35
+ROTATE_DEGREES = 15
+BLANK_FRAMES = 8
+
+
+def _jpeg(img: Image.Image) -> bytes:
+    out = BytesIO()
+    img.convert("RGB").save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def _blank(seed: int, size=(640, 480)) -> bytes:
+    """A frame with gradients and noise and no face."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([(x * 255 // w), (y * 255 // h), ((x + y) * 255 // (w + h))], axis=-1)
+    noise = rng.integers(-40, 40, size=(h, w, 3))
+    return _jpeg(Image.fromarray(np.clip(base + noise, 0, 255).astype("uint8")))
+
+
+def _face(size=(640, 480)) -> bytes:
+    """A drawn frontal face filling the guide oval (hair, brows, eyes, nose, mouth), softened like a camera frame."""
+    w, h = size
+    img = Image.new("RGB", size, (70, 80, 90))
+    draw = ImageDraw.Draw(img)
+    cx, cy = w // 2, int(h * attendance.GUIDE_OVAL[1])
+    fw, fh = int(min(w, h) * 0.36), int(min(w, h) * 0.48)
+    draw.ellipse([cx - fw // 2 - 10, cy - fh // 2 - 30, cx + fw // 2 + 10, cy - fh // 8], fill=(40, 30, 25))
+    draw.ellipse([cx - fw // 2, cy - fh // 2, cx + fw // 2, cy + fh // 2], fill=(215, 175, 150))
+    ex, ey, er = fw // 5, cy - fh // 10, fw // 9
+    for side in (-1, 1):
+        x = cx + side * ex
+        draw.ellipse([x - er * 1.4, ey - er * 1.3, x + er * 1.4, ey - er * 0.9], fill=(60, 40, 30))
+        draw.ellipse([x - er, ey - er // 2, x + er, ey + er // 2], fill=(50, 40, 40))
+    draw.polygon([(cx, ey), (cx - fw // 14, cy + fh // 8), (cx + fw // 14, cy + fh // 8)], fill=(195, 150, 125))
+    draw.ellipse([cx - fw // 5, cy + fh // 4 - fh // 30, cx + fw // 5, cy + fh // 4 + fh // 30], fill=(120, 50, 50))
+    return _jpeg(img.filter(ImageFilter.GaussianBlur(4)))
+
+
+def _variant(data: bytes, kind: str) -> bytes:
+    img = attendance.decode_capture(data)
+    if kind == "small":
+        frame = Image.new("RGB", img.size, (128, 128, 128))
+        small = img.resize((int(img.width * SMALL_SCALE), int(img.height * SMALL_SCALE)))
+        # inside the guide oval, so only the size decides
+        frame.paste(small, ((img.width - small.width) // 2, (img.height - small.height) // 2))
+        return _jpeg(frame)
+    if kind == "dark":
+        return _jpeg(ImageEnhance.Brightness(img).enhance(DARK_BRIGHTNESS))
+    return _jpeg(img.rotate(ROTATE_DEGREES, fillcolor=(128, 128, 128)))
+
+
+def load_cases(corpus, synthetic: bool = True):
+    """[(name, label, bytes)] of the corpus images plus the synthetic ones."""
+    cases = []
+    if corpus:
+        for label in ("accept", "reject"):
+            folder = Path(corpus) / label
+            if not folder.is_dir():
+                continue
+            for path in sorted(folder.iterdir()):
+                if path.suffix.lower() in IMAGE_SUFFIXES:
+                    cases.append((f"{label}/{path.name}", label, path.read_bytes()))
+    if synthetic:
+        cases.append(("face:synthetic", "accept", _face()))
+        for name, label, data in [c for c in cases if c[1] == "accept"]:
+            for kind, expected in SYNTHETIC.items():
+                cases.append((f"{kind}:{name}", expected, _variant(data, kind)))
+        cases += [(f"blank:{i}", "reject", _blank(i)) for i in range(BLANK_FRAMES)]
+    return cases
+
+
+def run(cases, settings: dict, repeat: int = 1):
+    """Latencies (ms per image) and confusion counts of verify_face with one setting."""
+    latencies = []
+    counts = {"TA": 0, "FR": 0, "FA": 0, "TR": 0}
+    misses = []
+    for name, label, data in cases:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ok, reason = attendance.verify_face(data, **settings)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if label == "accept":
+            counts["TA" if ok else "FR"] += 1
+        else:
+            counts["FA" if ok else "TR"] += 1
+        if ok != (label == "accept"):
+            misses.append(f"{name} ({reason})")
+    return latencies, counts, misses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory with accept/ and reject/ subdirectories")
+    parser.add_argument("--no-synthetic", action="store_true")
+    parser.add_argument("--scale-factors", type=float, nargs="+", default=[1.1, 1.2, 1.3])
+    parser.add_argument("--min-neighbors", type=int, nargs="+", default=[3, 5, 7])
+    parser.add_argument("--min-sizes", type=int, nargs="+", default=[0],
+                        help="minSize side in detection-frame px; 0 = verify_face's default")
+    parser.add_argument("--roi", choices=["on", "off", "both"], default="on", help="guide-oval ROI mode")
+    parser.add_argument("--min-face-fraction", type=float, default=0.12)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per image")
+    parser.add_argument("--misses", action="store_true", help="list misclassified images")
+    parser.add_argument("--csv", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    cv2.setNumThreads(1)
+    health = attendance.warm_up_face_detector()
+    if not health["ok"]:
+        print(f"Face detector unavailable: {health['error']}")
+        return 1
+    cases = load_cases(args.corpus, not args.no_synthetic)
+    if not cases:
+        print("No images: pass --corpus or drop --no-synthetic.")
+        return 1
+    n_accept = sum(1 for c in cases if c[1] == "accept")
+    print(f"{len(cases)} image(s): {n_accept} accept, {len(cases) - n_accept} reject")
+    if not n_accept:
+        print("No accept images: only the rejection side is measured (add corpus/accept/).")
+    elif not args.corpus:
+        print("Synthetic cases only: add --corpus for real captures.")
+
+    rois = {"on": [True], "off": [False], "both": [True, False]}[args.roi]
+    header = ["roi", "scale", "neigh", "minsz", "p50", "p90", "p99", "max", "TA", "FR", "FA", "TR", "acc%"]
+    print(" ".join(f"{h:>6}" for h in header))
+    rows = []
+    for roi, scale, neighbors, min_size in itertools.product(rois, args.scale_factors, args.min_neighbors, args.min_sizes):
+        settings = {
+            "min_face_fraction": args.min_face_fraction,
+            "roi": roi,
+            "scale_factor": scale,
+            "min_neighbors": neighbors,
+            "min_size": min_size or None,
+        }
+        latencies, counts, misses = run(cases, settings, args.repeat)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        accuracy = (counts["TA"] + counts["TR"]) * 100 / len(cases)
+        row = ["on" if roi else "off", scale, neighbors, min_size or "-",
+               round(p50, 1), round(p90, 1), round(p99, 1), round(max(latencies), 1),
+               counts["TA"], counts["FR"], counts["FA"], counts["TR"], round(accuracy, 1)]
+        rows.append(row)
+        print(" ".join(f"{v:>6}" for v in row))
+        if args.misses:
+            for miss in misses:
+                print(f"{'':>8}miss: {miss}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        print(f"Results written to {args.csv}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# bench_images.py
+"""
+Render-time / HTML-size benchmark for the attendance records table.
+
+Builds N synthetic attendance rows with camera-sized JPEG selfies and
+renders them with admin_attendance._html_table_row in three modes:
+
+    png      the old cell: every image decoded and re-encoded as PNG, inlined
+    inline   images inlined as stored (thumbnail + original JPEG as data URLs)
+    route    links to the image route (image_server), no image bytes in the page
+
+    python bench_images.py                    # 500 rows, all modes
+    python bench_images.py --rows 100 --modes inline route
+
+No database is needed; the rows are built in memory.
+"""
+import argparse
+import base64
+import sys
+import time
+from datetime import date, datetime
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import admin_attendance
+import image_server
+from image_store import IMAGE_COLUMNS
+
+MODES = ("png", "inline", "route")
+
+
+def _selfie(seed: int, size=(640, 480)) -> bytes:
+    """A JPEG with gradients and noise, about the size of an st.camera_input capture."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([(x * 255 // w), (y * 255 // h), ((x + y) * 255 // (w + h))], axis=-1)
+    noise = rng.integers(-6, 6, size=(h, w, 3))
+    img = Image.fromarray(np.clip(base + noise, 0, 255).astype("uint8"))
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def _rows(n: int, distinct: int):
+    images = [_selfie(i) for i in range(distinct)]
+    rows = []
+    for i in range(n):
+        row = {
+            "id": i + 1,
+            "attendance_date": date.today(),
+            "emp_code_of_thetechnician": f"E{i % 40:03d}",
+            "name_of_technician": f"Technician {i % 40}",
+            "on_duty_in_time": datetime.now(),
+            "on_duty_out_time": datetime.now(),
+            "total_working_hrs": 8.5,
+            "effective_working_hrs": 8.0,
+            "center_location": "C1",
+        }
+        for k, col in enumerate(IMAGE_COLUMNS["preamji_attendance"]):
+            row[col] = images[(i * 4 + k) % distinct]
+        rows.append(row)
+    return rows
+
+
+def _png_cell(row, col_key):
+    """The cell as rendered before: a lossless PNG copy of the full image, used for both src and href."""
+    blob = row.get(col_key)
+    if not blob:
+        return '<div style="color:#999">No image</div>'
+    with Image.open(BytesIO(blob)) as img:
+        out = BytesIO()
+        img.convert("RGB").save(out, format="PNG")
+    url = f"data:image/png;base64,{base64.b64encode(out.getvalue()).decode('ascii')}"
+    return (
+        f'<a href="{url}" target="_blank" rel="noopener noreferrer" '
+        f'title="Open full image"><img src="{url}" '
+        f'style="max-width:80px;max-height:60px;border-radius:4px;"/></a>'
+    )
+
+
+def render(rows, mode: str):
+    """(seconds, html bytes) of rendering all rows in one mode."""
+    image_cell = admin_attendance._image_cell
+    if mode == "png":
+        admin_attendance._image_cell = _png_cell
+    else:
+        # pretend the route is (not) installed; URLs are only built, never fetched
+        image_server._installed = mode == "route"
+    try:
+        start = time.perf_counter()
+        html = "\n".join(admin_attendance._html_table_row(r) for r in rows)
+        elapsed = time.perf_counter() - start
+    finally:
+        admin_attendance._image_cell = image_cell
+        image_server._installed = None
+    return elapsed, len(html.encode("utf-8"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=200, help="distinct images the rows cycle through")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args(argv)
+
+    rows = _rows(args.rows, args.distinct)
+    stored = sum(len(r[c]) for r in rows for c in IMAGE_COLUMNS["preamji_attendance"])
+    print(f"{args.rows} rows, {args.rows * 4} images, {stored / 1024 / 1024:.1f} MB of stored JPEG")
+    print(f"{'mode':<8} {'render s':>9} {'ms/row':>7} {'HTML MB':>8}")
+    for mode in args.modes:
+        elapsed, size = render(rows, mode)
+        print(f"{mode:<8} {elapsed:>9.2f} {elapsed * 1000 / args.rows:>7.1f} {size / 1024 / 1024:>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,554 @@
 # database.py
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+
 import streamlit as st
-from sqlalchemy import create_engine, text
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+from sqlalchemy import LargeBinary, create_engine, inspect, text
 from sqlalchemy.exc import SQLAlchemyError
 
-@st.cache_resource
-def get_db_engine():
-    """Create and cache SQLAlchemy engine using Streamlit secrets."""
-    mysql_conf = st.secrets["mysql"]
-    connection_string = (
-        f"mysql+pymysql://{mysql_conf['user']}:{mysql_conf['password']}"
-        f"@{mysql_conf['host']}/{mysql_conf['database']}"
+# How many latency samples to keep per statement fingerprint (for percentiles)
+QUERY_STATS_SAMPLES = 1000
+# How many recent reruns to keep query counts for
+RERUN_STATS_SAMPLES = 200
+
+# Read cache (run_cached_query): entries expire after the TTL and the least
+# recently used entries are dropped once the cache is full.
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_ENTRIES = 512
+# Default number of parameter sets committed together by run_many
+BULK_BATCH_SIZE = 500
+# Rows fetched per round trip from the server-side cursor in stream_query
+STREAM_CHUNK_SIZE = 500
+# Worker threads shared by run_parallel; keep below the engine's pool_size so
+# parallel reads do not starve other sessions of connections
+PARALLEL_MAX_WORKERS = 4
+
+# Slow-query log defaults; override in st.secrets under [diagnostics]
+SLOW_QUERY_MS = 500
+SLOW_QUERY_LOG = "logs/slow_queries.log"
+SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+
+_stats_lock = threading.Lock()
+_query_stats = {}
+_rerun_query_counts = deque(maxlen=RERUN_STATS_SAMPLES)
+
+_cache_lock = threading.Lock()
+_cache = OrderedDict()          # key -> (expires_at, tags, value)
+_cache_tag_index = {}           # tag -> set(keys)
+_cache_tag_generation = {}      # tag -> int, bumped on every invalidation
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+# Engine routes -> st.secrets section. Writes always go to "primary"; reads
+# marked reporting=True go to "reporting", which falls back to the primary
+# engine when no [mysql_read] section is configured.
+ENGINE_ROUTES = {
+    "primary": "mysql",
+    "reporting": "mysql_read",
+}
+
+
+def _connection_url(conf) -> str:
+    """
+    A secrets section either gives a full SQLAlchemy `url` (handy for pointing
+    a route at a local SQLite/MySQL stand-in) or the usual MySQL fields.
+    """
+    if conf.get("url"):
+        return conf["url"]
+    return (
+        f"mysql+pymysql://{conf['user']}:{conf['password']}"
+        f"@{conf['host']}/{conf['database']}"
         "?charset=utf8mb4"
     )
-    engine = create_engine(connection_string, pool_pre_ping=True)
+
+
+@st.cache_resource
+def get_db_engine(route: str = "primary"):
+    """Create and cache the SQLAlchemy engine for a route using Streamlit secrets."""
+    section = ENGINE_ROUTES.get(route)
+    if section is None:
+        raise ValueError(f"Unknown engine route: {route}")
+    if route != "primary" and section not in st.secrets:
+        return get_db_engine("primary")
+
+    conf = st.secrets[section]
+    pool_opts = {
+        k: int(conf[k])
+        for k in ("pool_size", "max_overflow", "pool_recycle")
+        if k in conf
+    }
+    engine = create_engine(_connection_url(conf), pool_pre_ping=True, **pool_opts)
     return engine
 
 
-def run_query(query: str, params: dict | None = None, fetch_one: bool = False):
+def get_engine_stats():
+    """Pool statistics for every configured route (routes sharing an engine are listed once each)."""
+    stats = []
+    for route in ENGINE_ROUTES:
+        try:
+            engine = get_db_engine(route)
+        except Exception as e:
+            stats.append({"route": route, "url": None, "status": f"unavailable: {e}"})
+            continue
+        pool = engine.pool
+        entry = {
+            "route": route,
+            "url": engine.url.render_as_string(hide_password=True),
+            "shared_with_primary": route != "primary" and engine is get_db_engine("primary"),
+            "pool": type(pool).__name__,
+            "status": pool.status(),
+        }
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            fn = getattr(pool, name, None)
+            if callable(fn):
+                entry[name] = fn()
+        stats.append(entry)
+    return stats
+
+
+# -------------------------------------------------------------
+# QUERY INSTRUMENTATION
+# -------------------------------------------------------------
+_FP_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_FP_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_FP_PARAM = re.compile(r":\w+")
+_FP_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_FP_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint_query(query: str) -> str:
+    """
+    Normalize a SQL statement so that calls differing only in literals,
+    bound parameter names or whitespace are grouped together.
+    """
+    fp = _FP_STRING.sub("?", query)
+    fp = _FP_PARAM.sub("?", fp)
+    fp = _FP_NUMBER.sub("?", fp)
+    fp = _FP_IN_LIST.sub("(?+)", fp)
+    fp = _FP_SPACE.sub(" ", fp).strip()
+    return fp
+
+
+def _estimate_payload_bytes(rows) -> int:
+    """Approximate size of a result set; BLOB/str values count by length."""
+    total = 0
+    for row in rows:
+        # dict rows (run_query) or plain tuples (columnar results)
+        for value in (row.values() if isinstance(row, dict) else row):
+            if value is None:
+                continue
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                total += len(value)
+            elif isinstance(value, str):
+                total += len(value)
+            else:
+                total += 8
+    return total
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def _count_query_for_rerun():
+    """Count queries fired by the current Streamlit rerun (see start_rerun_query_count)."""
+    try:
+        # run_parallel workers share the session state of their page
+        with _stats_lock:
+            st.session_state["_rerun_query_count"] = st.session_state.get("_rerun_query_count", 0) + 1
+    except Exception:
+        # No script context (e.g. called from a worker thread or CLI)
+        pass
+
+
+def start_rerun_query_count():
+    """
+    Call once at the top of every script run. Stores the number of queries the
+    previous rerun fired and resets the counter for this one.
+    """
+    try:
+        previous = st.session_state.get("_rerun_query_count")
+        st.session_state["_rerun_query_count"] = 0
+    except Exception:
+        return
+    if previous is not None:
+        with _stats_lock:
+            _rerun_query_counts.append(previous)
+
+
+def record_query(
+    query: str,
+    elapsed: float,
+    rows: int = 0,
+    payload_bytes: int = 0,
+    error: bool = False,
+    params=None,
+    route: str = "primary",
+):
+    """
+    Add one execution of `query` to the in-process statistics, and to the
+    slow-query log if it took longer than the configured threshold.
+    """
+    if elapsed * 1000 >= _slow_query_settings()["threshold_ms"]:
+        _log_slow_query(query, params, elapsed, rows, route)
+    fp = fingerprint_query(query)
+    with _stats_lock:
+        stat = _query_stats.get(fp)
+        if stat is None:
+            stat = {
+                "calls": 0,
+                "errors": 0,
+                "total_time": 0.0,
+                "max_time": 0.0,
+                "rows": 0,
+                "bytes": 0,
+                "samples": deque(maxlen=QUERY_STATS_SAMPLES),
+            }
+            _query_stats[fp] = stat
+        stat["calls"] += 1
+        stat["errors"] += 1 if error else 0
+        stat["total_time"] += elapsed
+        stat["max_time"] = max(stat["max_time"], elapsed)
+        stat["rows"] += rows
+        stat["bytes"] += payload_bytes
+        stat["samples"].append(elapsed)
+    _count_query_for_rerun()
+
+
+def get_query_stats():
+    """
+    Return aggregated per-statement statistics as a list of dicts,
+    slowest total time first. Latencies are in milliseconds.
+    """
+    with _stats_lock:
+        snapshot = [(fp, dict(s, samples=sorted(s["samples"]))) for fp, s in _query_stats.items()]
+
+    result = []
+    for fp, s in snapshot:
+        samples = s["samples"]
+        calls = s["calls"]
+        result.append({
+            "fingerprint": fp,
+            "calls": calls,
+            "errors": s["errors"],
+            "total_ms": round(s["total_time"] * 1000, 2),
+            "p50_ms": round(_percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(_percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(_percentile(samples, 99) * 1000, 2),
+            "max_ms": round(s["max_time"] * 1000, 2),
+            "rows": s["rows"],
+            "avg_rows": round(s["rows"] / calls, 1) if calls else 0,
+            "bytes": s["bytes"],
+            "avg_bytes": int(s["bytes"] / calls) if calls else 0,
+        })
+    result.sort(key=lambda r: r["total_ms"], reverse=True)
+    return result
+
+
+def get_rerun_query_counts():
+    """Query counts of the most recent reruns (oldest first)."""
+    with _stats_lock:
+        return list(_rerun_query_counts)
+
+
+def reset_query_stats():
+    with _stats_lock:
+        _query_stats.clear()
+        _rerun_query_counts.clear()
+
+
+# -------------------------------------------------------------
+# SLOW-QUERY LOG
+# -------------------------------------------------------------
+_slow_settings = None
+_slow_logger = None
+_slow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-log")
+
+
+def _slow_query_settings():
+    global _slow_settings
+    if _slow_settings is None:
+        try:
+            conf = dict(st.secrets.get("diagnostics", {}))
+        except Exception:
+            conf = {}
+        _slow_settings = {
+            "threshold_ms": float(conf.get("slow_query_ms", SLOW_QUERY_MS)),
+            "path": conf.get("slow_query_log", SLOW_QUERY_LOG),
+            "max_bytes": int(conf.get("slow_query_log_max_bytes", SLOW_QUERY_LOG_MAX_BYTES)),
+            "backups": int(conf.get("slow_query_log_backups", SLOW_QUERY_LOG_BACKUPS)),
+        }
+    return _slow_settings
+
+
+def _get_slow_logger():
+    global _slow_logger
+    if _slow_logger is None:
+        settings = _slow_query_settings()
+        path = Path(settings["path"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        logger = logging.getLogger("premji.slow_queries")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = RotatingFileHandler(
+            path, maxBytes=settings["max_bytes"], backupCount=settings["backups"], encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        _slow_logger = logger
+    return _slow_logger
+
+
+def _redact_value(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        return value if len(value) <= 200 else value[:200] + f"... <{len(value)} chars>"
+    if isinstance(value, (date, datetime, Decimal)):
+        return str(value)
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return repr(value)[:200]
+
+
+def redact_params(params):
+    """Parameters made safe for logging: BLOBs become their size, long strings are cut, passwords hidden."""
+    if params is None:
+        return None
+    if isinstance(params, (list, tuple)):
+        # executemany: log the batch size and the first parameter set
+        return {"batch_size": len(params), "first": redact_params(params[0]) if params else None}
+    return {
+        k: "***" if "password" in k.lower() else _redact_value(v)
+        for k, v in dict(params).items()
+    }
+
+
+def _calling_site():
+    """module:function:line of the first frame outside this module (and contextlib)."""
+    frame = sys._getframe(1)
+    here = __file__
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename != here and not filename.endswith("contextlib.py"):
+            module = Path(filename).stem
+            return f"{module}:{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def _write_slow_query_entry(entry, query, params, route):
+    plan = None
+    if is_explainable(query) and not isinstance(params, (list, tuple)):
+        try:
+            plan = explain_query(query, params, route=route)
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+    entry["explain"] = plan
+    try:
+        _get_slow_logger().info(json.dumps(entry, default=str))
+    except Exception:
+        pass
+
+
+def _log_slow_query(query, params, elapsed, rows, route):
+    """Queue a slow-query log entry; EXPLAIN and the file write happen off the request thread."""
+    entry = {
+        "logged_at": datetime.now().isoformat(timespec="seconds"),
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "rows": rows,
+        "route": route,
+        "caller": _calling_site(),
+        "fingerprint": fingerprint_query(query),
+        "sql": " ".join(query.split()),
+        "params": redact_params(params),
+    }
+    try:
+        _slow_executor.submit(_write_slow_query_entry, entry, query, params, route)
+    except RuntimeError:
+        # interpreter shutting down
+        pass
+
+
+def read_slow_query_log(limit: int = 100):
+    """Most recent slow-query entries (newest first) from the current log file."""
+    path = Path(_slow_query_settings()["path"])
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        lines = deque(f, maxlen=limit)
+    entries = []
+    for line in reversed(lines):
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+# -------------------------------------------------------------
+# READ CACHE
+# -------------------------------------------------------------
+_READ_TABLES = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?", re.IGNORECASE)
+_WRITE_TABLE = re.compile(
+    r"^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+`?(\w+)`?",
+    re.IGNORECASE,
+)
+
+
+def tables_read_by(query: str) -> frozenset:
+    """Table names a SELECT reads from (used as cache tags)."""
+    return frozenset(t.lower() for t in _READ_TABLES.findall(query))
+
+
+def table_written_by(query: str):
+    """Table name an INSERT/UPDATE/DELETE/REPLACE writes to, or None."""
+    m = _WRITE_TABLE.match(query)
+    return m.group(1).lower() if m else None
+
+
+def invalidate_cache(*tags):
+    """Drop every cached entry tagged with any of `tags` (table names)."""
+    with _cache_lock:
+        for tag in tags:
+            tag = tag.lower()
+            _cache_tag_generation[tag] = _cache_tag_generation.get(tag, 0) + 1
+            for key in _cache_tag_index.pop(tag, ()):
+                entry = _cache.pop(key, None)
+                if entry is not None:
+                    _cache_stats["invalidations"] += 1
+                    _unindex_cache_key(key, entry[1], skip=tag)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        _cache_tag_index.clear()
+        for tag in list(_cache_tag_generation):
+            _cache_tag_generation[tag] += 1
+
+
+def get_cache_stats():
+    with _cache_lock:
+        return dict(_cache_stats, entries=len(_cache), max_entries=CACHE_MAX_ENTRIES)
+
+
+def _unindex_cache_key(key, tags, skip=None):
+    # caller holds _cache_lock
+    for tag in tags:
+        if tag == skip:
+            continue
+        keys = _cache_tag_index.get(tag)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del _cache_tag_index[tag]
+
+
+def _copy_result(value):
+    """Hand out copies so callers mutating rows can't corrupt the cache."""
+    if isinstance(value, list):
+        return [dict(r) for r in value]
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def run_cached_query(
+    query: str,
+    params: dict | None = None,
+    fetch_one: bool = False,
+    ttl: float | None = None,
+    tags=None,
+    reporting: bool = False,
+):
+    """
+    Same as run_query for SELECTs, but results are cached in-process keyed on
+    (query, params). Entries are tagged with the tables they read (or `tags`)
+    and are dropped whenever run_query writes to one of those tables.
+    Use only for lookups that change rarely (catalogs, employee/center details).
+    """
+    try:
+        key = (query, fetch_one, reporting, tuple(sorted((params or {}).items())))
+        hash(key)
+    except TypeError:
+        # unhashable parameter values - skip the cache
+        return run_query(query, params, fetch_one=fetch_one, reporting=reporting)
+
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _cache.move_to_end(key)
+                _cache_stats["hits"] += 1
+                return _copy_result(entry[2])
+            del _cache[key]
+            _unindex_cache_key(key, entry[1])
+        _cache_stats["misses"] += 1
+        tag_set = frozenset(t.lower() for t in tags) if tags else tables_read_by(query)
+        generations = {t: _cache_tag_generation.get(t, 0) for t in tag_set}
+
+    value = run_query(query, params, fetch_one=fetch_one, reporting=reporting)
+    if value is None:
+        # error, or no row for fetch_one - don't cache
+        return value
+
+    with _cache_lock:
+        # A write to one of our tables while we were querying: result may be stale
+        if any(_cache_tag_generation.get(t, 0) != g for t, g in generations.items()):
+            return _copy_result(value)
+        expires = time.monotonic() + (CACHE_TTL_SECONDS if ttl is None else ttl)
+        old = _cache.pop(key, None)
+        if old is not None:
+            _unindex_cache_key(key, old[1])
+        _cache[key] = (expires, tag_set, value)
+        for tag in tag_set:
+            _cache_tag_index.setdefault(tag, set()).add(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            old_key, old_entry = _cache.popitem(last=False)
+            _unindex_cache_key(old_key, old_entry[1])
+            _cache_stats["evictions"] += 1
+    return _copy_result(value)
+
+
+# -------------------------------------------------------------
+# QUERY HELPERS
+# -------------------------------------------------------------
+def run_query(query: str, params: dict | None = None, fetch_one: bool = False, reporting: bool = False):
     """
     Run a SQL query safely with optional parameters.
     - For SELECTs: returns dict (fetch_one=True) or list[dict] (fetch_one=False)
     - For non-SELECTs: returns {"rowcount": <n>} on success
     This implementation uses engine.begin() so updates/inserts/deletes are committed.
+    Every call is timed and recorded in the query statistics (see get_query_stats).
+    Writes invalidate cached reads of the written table (see run_cached_query).
+    reporting=True sends a read to the reporting engine; writes always use the primary.
     """
-    engine = get_db_engine()
+    written = table_written_by(query)
+    route = "reporting" if reporting and not written else "primary"
+    engine = get_db_engine(route)
+    started = time.perf_counter()
+    rows_out, payload = 0, 0
     try:
         # Use a transactional context for everything. SELECTs inside a transaction are fine;
         # non-SELECTs will be committed when the context exits.
@@ -32,18 +557,279 @@ def run_query(query: str, params: dict | None = None, fetch_one: bool = False):
             if result.returns_rows:
                 if fetch_one:
                     row = result.mappings().fetchone()
-                    return dict(row) if row else None
+                    out = dict(row) if row else None
+                    if out:
+                        rows_out, payload = 1, _estimate_payload_bytes([out])
                 else:
                     rows = result.mappings().all()
-                    return [dict(r) for r in rows]
+                    out = [dict(r) for r in rows]
+                    rows_out, payload = len(out), _estimate_payload_bytes(out)
             else:
                 # non-select query - return rowcount
-                return {"rowcount": result.rowcount}
+                out = {"rowcount": result.rowcount}
+        record_query(query, time.perf_counter() - started, rows_out, payload, params=params, route=route)
+        if written:
+            invalidate_cache(written)
+        return out
     except SQLAlchemyError as e:
+        record_query(query, time.perf_counter() - started, error=True, params=params, route=route)
         st.error(f"Database error: {e}")
         return None
 
 
+def stream_query(query: str, params: dict | None = None, chunk_size: int | None = None, reporting: bool = False):
+    """
+    Run a SELECT on an unbuffered server-side cursor and yield rows lazily,
+    so large reports never hold the whole result set in memory.
+    - chunk_size=None: yields one dict per row
+    - chunk_size=N:    yields lists of up to N dicts
+    The connection stays checked out until the generator is exhausted or closed,
+    so consume it fully (or close it) before running other long work.
+    reporting=True reads from the reporting engine.
+    """
+    for columns, part in _stream_partitions(query, params, chunk_size or STREAM_CHUNK_SIZE, reporting):
+        chunk = [dict(zip(columns, r)) for r in part]
+        if chunk_size:
+            yield chunk
+        else:
+            yield from chunk
+
+
+def stream_query_frames(query: str, params: dict | None = None, chunk_size: int | None = None,
+                        reporting: bool = False, arrow: bool = False):
+    """
+    Columnar stream_query: yields one DataFrame (or pyarrow Table with
+    arrow=True) per chunk of up to chunk_size rows, built straight from the
+    cursor tuples. Same connection rules as stream_query.
+    """
+    for columns, part in _stream_partitions(query, params, chunk_size or STREAM_CHUNK_SIZE, reporting):
+        yield _columnar(columns, part, arrow)
+
+
+def _stream_partitions(query, params, size, reporting):
+    """Yields (column_names, list_of_row_tuples) per fetch from a server-side cursor."""
+    route = "reporting" if reporting else "primary"
+    engine = get_db_engine(route)
+    fetch_time, rows_out, payload, error = 0.0, 0, 0, False
+    try:
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=size).execute(
+                text(query), params or {}
+            )
+            columns = list(result.keys())
+            partitions = result.partitions(size)
+            fetch_time += time.perf_counter() - started
+            while True:
+                started = time.perf_counter()
+                part = next(partitions, None)
+                fetch_time += time.perf_counter() - started
+                if part is None:
+                    break
+                rows_out += len(part)
+                payload += _estimate_payload_bytes(part)
+                yield columns, part
+    except SQLAlchemyError as e:
+        error = True
+        st.error(f"Database error: {e}")
+    finally:
+        # time spent by the consumer between chunks is not counted
+        record_query(query, fetch_time, rows_out, payload, error=error, params=params, route=route)
+
+
+class TransactionAborted(Exception):
+    """Raised by Transaction.abort(); rolls the transaction back quietly."""
+
+
+class Transaction:
+    """Handle yielded by transaction(); see there."""
+
+    def __init__(self):
+        self.ok = True
+        self.error = None
+        self._conn = None
+        self._written = set()
+
+    def execute(self, query: str, params: dict | None = None, fetch_one: bool = False):
+        """Same return shapes as run_query, but on the shared connection and without committing."""
+        if self._conn is None:
+            raise RuntimeError("Transaction is already closed.")
+        started = time.perf_counter()
+        try:
+            result = self._conn.execute(text(query), params or {})
+        except SQLAlchemyError:
+            record_query(query, time.perf_counter() - started, error=True, params=params)
+            raise
+        rows_out, payload = 0, 0
+        if result.returns_rows:
+            if fetch_one:
+                row = result.mappings().fetchone()
+                out = dict(row) if row else None
+                if out:
+                    rows_out, payload = 1, _estimate_payload_bytes([out])
+            else:
+                out = [dict(r) for r in result.mappings().all()]
+                rows_out, payload = len(out), _estimate_payload_bytes(out)
+        else:
+            out = {"rowcount": result.rowcount}
+            written = table_written_by(query)
+            if written:
+                self._written.add(written)
+        record_query(query, time.perf_counter() - started, rows_out, payload, params=params)
+        return out
+
+    def abort(self, message: str | None = None):
+        """Roll back everything done so far and leave the `with` block (tx.ok becomes False)."""
+        raise TransactionAborted(message)
+
+
+@contextmanager
+def transaction():
+    """
+    Run several statements on one connection with a single commit:
+
+        with transaction() as tx:
+            tx.execute("UPDATE ...", {...})
+            tx.execute("INSERT ...", {...})
+        if tx.ok:
+            st.success("Saved")
+
+    Everything is rolled back if a statement fails or tx.abort(message) is
+    called; the error/message is shown with st.error, tx.ok is False and
+    tx.error holds the reason. Don't call st.rerun() inside the block - it
+    raises, which would roll the transaction back.
+    """
+    engine = get_db_engine()
+    tx = Transaction()
+    try:
+        with engine.begin() as conn:
+            tx._conn = conn
+            yield tx
+    except TransactionAborted as e:
+        tx.ok = False
+        tx.error = str(e) if e.args and e.args[0] else "aborted"
+        if e.args and e.args[0]:
+            st.error(tx.error)
+    except SQLAlchemyError as e:
+        tx.ok = False
+        tx.error = str(e)
+        st.error(f"Database error: {e}")
+    finally:
+        tx._conn = None
+        # invalidate even on rollback: a concurrent reader may have cached mid-flight
+        if tx._written:
+            invalidate_cache(*tx._written)
+
+
+def run_many(query: str, params_list, batch_size: int = BULK_BATCH_SIZE):
+    """
+    Execute one write statement for many parameter sets (executemany).
+    Parameter sets are sent in chunks of `batch_size`; each chunk is one
+    commit. PyMySQL turns a chunk of INSERT ... VALUES into one multi-row
+    statement (one round trip); other statements, e.g. UPDATE, are still
+    sent once per parameter set - use run_case_update for those.
+
+    Returns a summary dict:
+        {"rowcount": <total>, "batches": [{"batch", "size", "rowcount", "seconds"}, ...],
+         "error": None or message}
+    On a database error the failing batch is rolled back, earlier batches stay
+    committed and the remaining ones are skipped.
+    """
+    params_list = list(params_list or [])
+    batch_size = max(1, int(batch_size))
+    summary = {"rowcount": 0, "batches": [], "error": None}
+    if not params_list:
+        return summary
+
+    engine = get_db_engine()
+    written = table_written_by(query)
+    stmt = text(query)
+    for batch_no, start in enumerate(range(0, len(params_list), batch_size), start=1):
+        chunk = params_list[start:start + batch_size]
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                result = conn.execute(stmt, chunk)
+                rowcount = result.rowcount
+        except SQLAlchemyError as e:
+            record_query(query, time.perf_counter() - started, error=True, params=chunk)
+            summary["error"] = f"batch {batch_no}: {e}"
+            st.error(f"Database error in batch {batch_no} (rows {start + 1}-{start + len(chunk)}): {e}")
+            break
+        finally:
+            if written:
+                invalidate_cache(written)
+
+        elapsed = time.perf_counter() - started
+        record_query(query, elapsed, params=chunk)
+        rowcount = rowcount if rowcount is not None and rowcount >= 0 else len(chunk)
+        summary["rowcount"] += rowcount
+        summary["batches"].append({
+            "batch": batch_no,
+            "size": len(chunk),
+            "rowcount": rowcount,
+            "seconds": round(elapsed, 4),
+        })
+    return summary
+
+
+def run_case_update(table: str, key: str, rows, batch_size: int = BULK_BATCH_SIZE):
+    """
+    Write different values to many rows with one statement per chunk:
+
+        UPDATE t SET c = CASE key WHEN :k0 THEN :v0_0 ... ELSE c END, ...
+        WHERE key IN (:k0, ...)
+
+    rows are dicts holding `key` and the columns to set (the same columns in
+    every row). Same summary, commits and error handling as run_many.
+    """
+    rows = list(rows or [])
+    batch_size = max(1, int(batch_size))
+    summary = {"rowcount": 0, "batches": [], "error": None}
+    if not rows:
+        return summary
+
+    columns = [c for c in rows[0] if c != key]
+    engine = get_db_engine()
+    for batch_no, start in enumerate(range(0, len(rows), batch_size), start=1):
+        chunk = rows[start:start + batch_size]
+        params = {}
+        for i, row in enumerate(chunk):
+            params[f"k{i}"] = row[key]
+            params.update({f"v{j}_{i}": row[c] for j, c in enumerate(columns)})
+        sets = ",\n    ".join(
+            f"{c} = CASE {key} "
+            + " ".join(f"WHEN :k{i} THEN :v{j}_{i}" for i in range(len(chunk)))
+            + f" ELSE {c} END"
+            for j, c in enumerate(columns)
+        )
+        keys = ", ".join(f":k{i}" for i in range(len(chunk)))
+        query = f"UPDATE {table} SET\n    {sets}\nWHERE {key} IN ({keys})"
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                rowcount = conn.execute(text(query), params).rowcount
+        except SQLAlchemyError as e:
+            record_query(query, time.perf_counter() - started, error=True, params=params)
+            summary["error"] = f"batch {batch_no}: {e}"
+            st.error(f"Database error in batch {batch_no} (rows {start + 1}-{start + len(chunk)}): {e}")
+            break
+        finally:
+            invalidate_cache(table)
+
+        elapsed = time.perf_counter() - started
+        record_query(query, elapsed, params=params)
+        rowcount = rowcount if rowcount is not None and rowcount >= 0 else len(chunk)
+        summary["rowcount"] += rowcount
+        summary["batches"].append({
+            "batch": batch_no,
+            "size": len(chunk),
+            "rowcount": rowcount,
+            "seconds": round(elapsed, 4),
+        })
+    return summary
+
+
 def fetch_employee_details(employee_code: str):
     """
     Fetch a single employee's details from the employee_details table using the project DB engine.
@@ -55,4 +841,283 @@ def fetch_employee_details(employee_code: str):
         WHERE employee_code = :emp_code
         LIMIT 1
     """
-    return run_query(query, {"emp_code": employee_code}, fetch_one=True)
+    return run_cached_query(query, {"emp_code": employee_code}, fetch_one=True)
+
+
+# -------------------------------------------------------------
+# PARALLEL READS
+# -------------------------------------------------------------
+_parallel_executor = ThreadPoolExecutor(max_workers=PARALLEL_MAX_WORKERS, thread_name_prefix="db-parallel")
+
+
+def _run_task(task, ctx):
+    # attach the page's script context so st.error / session_state / the
+    # cached engine work from the worker thread, and detach it afterwards:
+    # the pool threads are shared by all sessions
+    thread = threading.current_thread()
+    previous = get_script_run_ctx(suppress_warning=True)
+    if ctx is not None:
+        add_script_run_ctx(thread, ctx)
+    try:
+        if callable(task):
+            return task()
+        query, params, *rest = task
+        return run_query(query, params, fetch_one=bool(rest and rest[0]))
+    finally:
+        if ctx is not None:
+            setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, previous)
+
+
+def run_parallel(tasks: dict):
+    """
+    Run independent reads concurrently and return their results together,
+    so a page waits for the slowest query instead of the sum of all.
+    tasks maps a name to either
+      - a callable taking no arguments (e.g. lambda: get_vehicle_models(m)), or
+      - a (query, params) / (query, params, fetch_one) tuple for run_query.
+    Returns {name: result}. Each task runs on its own pooled connection;
+    an exception raised by a task is re-raised here.
+    Only use it for reads - no writes, no st.* widgets and no nested
+    run_parallel calls inside the tasks.
+    """
+    if len(tasks) < 2:
+        return {name: _run_task(task, None) for name, task in tasks.items()}
+    ctx = get_script_run_ctx()
+    futures = {name: _parallel_executor.submit(_run_task, task, ctx) for name, task in tasks.items()}
+    return {name: f.result() for name, f in futures.items()}
+
+
+# -------------------------------------------------------------
+# COLUMNAR RESULTS
+# -------------------------------------------------------------
+def _unique_columns(columns):
+    """
+    Positions to keep when a SELECT repeats a column label. A dict row keeps
+    the first position and the last value, so the columnar result does too.
+    """
+    last = {name: i for i, name in enumerate(columns)}
+    names = list(dict.fromkeys(columns))
+    return names, [last[n] for n in names]
+
+
+def _columnar(columns, rows, arrow=False):
+    """Build a DataFrame / pyarrow Table from row tuples without per-row dicts."""
+    names, positions = _unique_columns(columns)
+    if arrow:
+        import pyarrow as pa
+
+        data = list(zip(*rows)) if rows else [()] * len(columns)
+        return pa.table({n: pa.array(list(data[i])) for n, i in zip(names, positions)})
+
+    import pandas as pd
+
+    df = pd.DataFrame.from_records(rows, columns=range(len(columns)), coerce_float=False)
+    if len(names) != len(columns):
+        df = df.iloc[:, positions]
+    df.columns = names
+    return df
+
+
+def run_query_frame(query: str, params: dict | None = None, reporting: bool = False, arrow: bool = False):
+    """
+    Run a SELECT and return the result as a pandas DataFrame (or a pyarrow
+    Table with arrow=True), built straight from the cursor rows. Use this
+    instead of pd.DataFrame(run_query(...)) for reports and listings.
+    Returns None on error (like run_query).
+    """
+    route = "reporting" if reporting else "primary"
+    engine = get_db_engine(route)
+    started = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(text(query), params or {})
+            columns = list(result.keys())
+            rows = result.fetchall()
+        record_query(query, time.perf_counter() - started, len(rows), _estimate_payload_bytes(rows),
+                     params=params, route=route)
+        return _columnar(columns, rows, arrow)
+    except SQLAlchemyError as e:
+        record_query(query, time.perf_counter() - started, error=True, params=params, route=route)
+        st.error(f"Database error: {e}")
+        return None
+
+
+# -------------------------------------------------------------
+# BLOB COLUMNS
+# -------------------------------------------------------------
+# Per (route, table): column names in table order, BLOB column names and the
+# primary key, reflected once per process.
+_table_schemas = {}
+_schema_lock = threading.Lock()
+# Primary keys per batch query in load_blobs
+BLOB_LOAD_BATCH = 200
+
+
+def table_schema(table: str, route: str = "primary"):
+    """{"columns": [...], "blobs": {...}, "pk": name} for a table, reflected from the database."""
+    key = (route, table)
+    with _schema_lock:
+        schema = _table_schemas.get(key)
+    if schema is not None:
+        return schema
+    insp = inspect(get_db_engine(route))
+    columns = insp.get_columns(table)
+    pk = (insp.get_pk_constraint(table).get("constrained_columns") or ["id"])[0]
+    schema = {
+        "columns": [c["name"] for c in columns],
+        # BLOB / LONGBLOB / MEDIUMBLOB ...; short VARBINARY columns stay inline
+        "blobs": {
+            c["name"] for c in columns
+            if isinstance(c["type"], LargeBinary) or type(c["type"]).__name__.endswith("BLOB")
+        },
+        "pk": pk,
+    }
+    with _schema_lock:
+        _table_schemas[key] = schema
+    return schema
+
+
+def blob_projection(table: str, include=(), alias: str | None = None, route: str = "primary") -> str:
+    """
+    SELECT list for `table` with every BLOB column (except those in `include`)
+    replaced by its byte length under the same name, e.g.
+        f"SELECT {blob_projection('workorder_entry')} FROM workorder_entry WHERE ..."
+    Pass the rows through with_blob_handles() to turn the lengths into BlobHandles.
+    """
+    schema = table_schema(table, route)
+    prefix = f"{alias}." if alias else ""
+    parts = []
+    for col in schema["columns"]:
+        if col in schema["blobs"] and col not in include:
+            parts.append(f"LENGTH({prefix}{col}) AS {col}")
+        else:
+            parts.append(f"{prefix}{col}")
+    return ", ".join(parts)
+
+
+class BlobHandle:
+    """
+    One BLOB cell, fetched by primary key the first time it is needed.
+    len(handle) is the size in bytes; load() returns the bytes (cached).
+    Use load_blobs() to fetch many handles with one query per table.
+    """
+
+    __slots__ = ("table", "column", "pk", "size", "route", "_data")
+
+    def __init__(self, table: str, column: str, pk, size: int = 0, route: str = "primary"):
+        self.table = table
+        self.column = column
+        self.pk = pk
+        self.size = int(size or 0)
+        self.route = route
+        self._data = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    def load(self):
+        if self._data is None:
+            load_blobs([self])
+        return self._data
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return f"[{self.size} bytes]"
+
+    def __repr__(self):
+        return f"BlobHandle({self.table}.{self.column}, pk={self.pk!r}, size={self.size})"
+
+
+def with_blob_handles(rows, table: str, columns: dict | None = None, pk: str | None = None,
+                      route: str = "primary"):
+    """
+    Replace the BLOB lengths selected via blob_projection() with BlobHandles
+    (NULL stays None, bytes that were selected in full are left alone).
+    columns maps result keys to BLOB columns when the query aliases them,
+    e.g. {"Jobcard Photo": "jobcard_photo"}; pk is the result key of the
+    primary key if aliased. Works in place on a dict or a list of dicts.
+    """
+    if not rows:
+        return rows
+    schema = table_schema(table, route)
+    columns = columns or {c: c for c in schema["blobs"]}
+    pk = pk or schema["pk"]
+    for row in ([rows] if isinstance(rows, dict) else rows):
+        for key, col in columns.items():
+            value = row.get(key)
+            if value is not None and not isinstance(value, (bytes, bytearray, memoryview, BlobHandle)):
+                row[key] = BlobHandle(table, col, row[pk], size=value, route=route)
+    return rows
+
+
+def load_blobs(handles):
+    """Fetch the bytes of all unloaded handles, one query per table and batch of keys."""
+    groups = {}
+    for h in handles:
+        if h is not None and not h.loaded:
+            groups.setdefault((h.table, h.route), []).append(h)
+
+    for (table, route), group in groups.items():
+        pk = table_schema(table, route)["pk"]
+        cols = sorted({h.column for h in group})
+        keys = list(dict.fromkeys(h.pk for h in group))
+        found = {}
+        for i in range(0, len(keys), BLOB_LOAD_BATCH):
+            batch = keys[i:i + BLOB_LOAD_BATCH]
+            params = {f"k{n}": k for n, k in enumerate(batch)}
+            placeholders = ", ".join(f":{name}" for name in params)
+            rows = run_query(
+                f"SELECT {pk}, {', '.join(cols)} FROM {table} WHERE {pk} IN ({placeholders})",
+                params,
+                reporting=route == "reporting",
+            ) or []
+            found.update((r[pk], r) for r in rows)
+        for h in group:
+            value = (found.get(h.pk) or {}).get(h.column)
+            # b"" marks "loaded" for rows deleted (or emptied) since the listing
+            h._data = bytes(value) if value is not None else b""
+    return handles
+
+
+def blob_bytes(value):
+    """Bytes of a BLOB value that may be a BlobHandle, raw bytes or None."""
+    if isinstance(value, BlobHandle):
+        return value.load() or None
+    return value
+
+
+# -------------------------------------------------------------
+# QUERY PLANS
+# -------------------------------------------------------------
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|UPDATE|DELETE|INSERT\s+INTO\s+\w+\s*(?:\([^)]*\))?\s*SELECT)\b", re.IGNORECASE | re.DOTALL)
+
+
+def is_explainable(query: str) -> bool:
+    """EXPLAIN only makes sense for statements that read rows (INSERT ... VALUES does not)."""
+    return bool(_EXPLAINABLE.match(query))
+
+
+def explain_query(query: str, params: dict | None = None, route: str = "primary"):
+    """
+    Run EXPLAIN for a statement and return the plan rows as list[dict].
+    Raises SQLAlchemyError on failure (callers decide how to report it).
+    """
+    engine = get_db_engine(route)
+    with engine.connect() as conn:
+        result = conn.execute(text("EXPLAIN " + query.strip().rstrip(";")), params or {})
+        rows = [dict(r) for r in result.mappings().all()]
+        conn.rollback()
+    return rows
+
+
+def plan_full_scans(plan_rows):
+    """Plan rows (from explain_query on MySQL) that scan a whole table or index."""
+    scans = []
+    for r in plan_rows:
+        access = (r.get("type") or "").upper()
+        if access in ("ALL", "INDEX") and r.get("table") and not str(r["table"]).startswith("<"):
+            scans.append(r)
+    return scans
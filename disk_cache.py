@@ -0,0 +1,181 @@
+# disk_cache.py
+"""
+Size-capped, content-addressed disk cache for derived image files
+(thumbnails made from BLOBs not moved to the image store yet).
+
+Files live at <root>/entries/<aa>/<key>, where <key> is the SHA-256 of the
+source bytes plus a variant suffix, so the same image is only ever written
+once. The cache creates entries/ itself with a marker file and refuses to
+use (or evict from) an entries/ directory without it, so a misconfigured
+root never touches other files. The directory is scanned once per process
+to build an in-memory index of sizes; after that lookups, writes and
+eviction (least recently used first) never walk the directory.
+
+    [image_cache]
+    root = "/tmp/attendance_images"
+    max_mb = 256
+"""
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import streamlit as st
+
+IMAGE_CACHE_ROOT = Path(tempfile.gettempdir()) / "attendance_images"
+IMAGE_CACHE_MAX_MB = 256
+ENTRIES_DIR = "entries"
+MARKER_FILE = ".disk_cache"
+# <sha256>[.<variant>]
+_KEY_RE = re.compile(r"^[0-9a-f]{64}(\.\w+)?$")
+# the per-render temp images admin_attendance used to write into the root
+_OLD_TEMP_RE = re.compile(r"^\w+_\d{10,}\.(png|jpeg|webp|gif|octet-stream)$")
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """Files keyed by name under one directory, capped at max_bytes in total."""
+
+    def __init__(self, root, max_bytes: int):
+        self.root = Path(root)
+        self.entries = self.root / ENTRIES_DIR
+        self.max_bytes = max_bytes
+        self._index = None  # key -> size, least recently used first
+        self._bytes = 0
+        self.disabled = False
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _path(self, key: str) -> Path:
+        return self.entries / key[:2] / key
+
+    def _claim_entries(self) -> bool:
+        """Create entries/ with its marker, or check an existing one has it."""
+        marker = self.entries / MARKER_FILE
+        if marker.exists():
+            return True
+        try:
+            self.entries.mkdir(parents=True)
+        except FileExistsError:
+            _LOGGER.warning("disk cache disabled: %s exists but was not created by the cache", self.entries)
+            return False
+        except OSError as e:
+            _LOGGER.warning("disk cache disabled: %s", e)
+            return False
+        marker.touch()
+        return True
+
+    def _load_index(self):
+        # caller holds _lock; the only directory walk, once per process
+        self._index, self._bytes = OrderedDict(), 0
+        if self.root.is_dir():
+            for entry in os.scandir(self.root):
+                # the old per-render temp images were written straight into the root
+                if entry.is_file() and _OLD_TEMP_RE.match(entry.name):
+                    Path(entry.path).unlink(missing_ok=True)
+        if not self._claim_entries():
+            self.disabled = True
+            return
+        files = []
+        for entry in os.scandir(self.entries):
+            if not (entry.is_dir() and len(entry.name) == 2):
+                continue
+            for f in os.scandir(entry.path):
+                if f.is_file() and _KEY_RE.match(f.name) and f.name.startswith(entry.name):
+                    info = f.stat()
+                    files.append((info.st_atime, f.name, info.st_size))
+        self._index = OrderedDict((name, size) for _t, name, size in sorted(files))
+        self._bytes = sum(self._index.values())
+
+    def _ensure_index(self):
+        if self._index is None:
+            self._load_index()
+
+    def get(self, key: str):
+        """Bytes cached under key, or None."""
+        with self._lock:
+            self._ensure_index()
+            if self.disabled or key not in self._index:
+                self.stats["misses"] += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            data = self._path(key).read_bytes()
+        except FileNotFoundError:
+            # deleted behind our back (e.g. tmp cleaner)
+            with self._lock:
+                self._bytes -= self._index.pop(key, 0)
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Write data under key unless it is there already; evicts old files beyond max_bytes."""
+        if len(data) > self.max_bytes or not _KEY_RE.match(key):
+            return
+        with self._lock:
+            self._ensure_index()
+            if self.disabled:
+                return
+            if key in self._index:
+                self._index.move_to_end(key)
+                return
+        path = self._path(key)
+        # a cache: failing to write is not an error
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            Path(tmp).unlink(missing_ok=True)
+            return
+        with self._lock:
+            if key not in self._index:
+                self._bytes += len(data)
+                self.stats["writes"] += 1
+            self._index[key] = len(data)
+            victims = []
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                old_key, size = self._index.popitem(last=False)
+                self._bytes -= size
+                self.stats["evictions"] += 1
+                victims.append(old_key)
+        for old_key in victims:
+            self._path(old_key).unlink(missing_ok=True)
+
+    def get_stats(self):
+        with self._lock:
+            self._ensure_index()
+            return dict(self.stats, entries=len(self._index), bytes=self._bytes, max_bytes=self.max_bytes,
+                        disabled=self.disabled)
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def image_cache() -> DiskCache:
+    """The process-wide cache for derived images, configured from [image_cache] in st.secrets."""
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            try:
+                conf = dict(st.secrets.get("image_cache", {}))
+            except Exception:
+                conf = {}
+            _image_cache = DiskCache(
+                conf.get("root", IMAGE_CACHE_ROOT),
+                int(float(conf.get("max_mb", IMAGE_CACHE_MAX_MB)) * 1024 * 1024),
+            )
+        return _image_cache
@@ -0,0 +1,467 @@
+# image_archive.py
+"""
+Cold-storage tier for aged attendance pictures.
+
+`archive` moves the pictures of attendance rows older than N days out of
+the table (BLOBs) and out of the image store into append-only pack files:
+
+    <root>/pack-000001.pack    records: header + zlib-compressed (or raw) image bytes
+    <root>/pack-000001.idx     one line per record: <sha256> <offset> <length> <codec>
+
+Rows keep their <column>_sha256, and stored thumbnails stay where they are, so
+list views do not change. The full image is read from the pack through the
+index only when someone opens it (image_store.get falls back to the archive).
+Packs are never rewritten; `reindex` rebuilds an .idx from its pack.
+
+    python image_archive.py status
+    python image_archive.py archive [--days 30] [--batch 200]
+    python image_archive.py verify               # re-read every record and check its hash
+    python image_archive.py reindex
+
+Settings in st.secrets:
+
+    [image_archive]
+    root = "data/archive"
+    after_days = 30
+    pack_max_mb = 1024
+
+Back the archive up with the image store. Run `archive` before any picture
+purge (image_purge.py): the purge drops the rows' references.
+"""
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+import streamlit as st
+
+from database import run_many, run_query, stream_query
+from image_store import IMAGE_COLUMNS, INSERT_OBJECT_SQL, ensure_thumbnail, get, hash_column, object_row, path_for
+
+ARCHIVE_ROOT = "data/archive"
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_PACK_MAX_MB = 1024
+ARCHIVE_TABLE = "preamji_attendance"
+ARCHIVE_DATE_COLUMN = "attendance_date"
+# Rows read per round trip while archiving BLOBs
+ARCHIVE_BATCH_SIZE = 200
+# Only keep the zlib copy if it saves at least this much (JPEGs rarely shrink)
+ARCHIVE_MIN_SAVING = 0.05
+# A lookup miss re-reads the .idx files at most this often (misses are common:
+# every image that is not in the store asks the archive)
+ARCHIVE_REFRESH_SECONDS = 10
+
+# record header: magic, sha256 (raw), codec, payload length
+_RECORD = struct.Struct(">4s32scI")
+_MAGIC = b"PIMG"
+CODEC_RAW = "r"
+CODEC_ZLIB = "z"
+
+
+
+class PackError(Exception):
+    """A pack file is damaged (a record header is not where the previous record ended)."""
+
+
+_settings = None
+_index = {}            # sha256 -> (pack name, payload offset, length, codec)
+_index_sizes = {}      # .idx file name -> bytes already loaded
+_index_lock = threading.Lock()
+_refreshed_at = None   # time.monotonic() of the last _refresh_index
+
+
+def archive_settings():
+    global _settings
+    if _settings is None:
+        try:
+            conf = dict(st.secrets.get("image_archive", {}))
+        except Exception:
+            conf = {}
+        _settings = {
+            "root": Path(conf.get("root", ARCHIVE_ROOT)),
+            "after_days": int(conf.get("after_days", ARCHIVE_AFTER_DAYS)),
+            "pack_max_bytes": int(float(conf.get("pack_max_mb", ARCHIVE_PACK_MAX_MB)) * 1024 * 1024),
+        }
+    return _settings
+
+
+def archive_root() -> Path:
+    return archive_settings()["root"]
+
+
+# -------------------------------------------------------------
+# INDEX
+# -------------------------------------------------------------
+def _refresh_index():
+    """Load index lines appended since the last call (caller holds _index_lock)."""
+    global _refreshed_at
+    _refreshed_at = time.monotonic()
+    root = archive_root()
+    if not root.exists():
+        return
+    for idx in sorted(root.glob("pack-*.idx")):
+        done = _index_sizes.get(idx.name, 0)
+        if idx.stat().st_size <= done:
+            continue
+        pack = idx.with_suffix(".pack").name
+        with open(idx, "rb") as f:
+            f.seek(done)
+            chunk = f.read()
+        # a line still being written has no newline yet; leave it for next time
+        complete = chunk[: chunk.rfind(b"\n") + 1]
+        for line in complete.decode("ascii").splitlines():
+            sha, offset, length, codec = line.split()
+            _index[sha] = (pack, int(offset), int(length), codec)
+        _index_sizes[idx.name] = done + len(complete)
+
+
+def refresh_index():
+    """Pick up images archived by other processes now (before decisions that depend on it)."""
+    with _index_lock:
+        _refresh_index()
+
+
+def locate(sha256: str):
+    """(pack, offset, length, codec) of an archived image, or None."""
+    with _index_lock:
+        entry = _index.get(sha256)
+        # another process may have archived it since; a miss otherwise costs a dict lookup
+        if entry is None and (_refreshed_at is None or time.monotonic() - _refreshed_at >= ARCHIVE_REFRESH_SECONDS):
+            _refresh_index()
+            entry = _index.get(sha256)
+        return entry
+
+
+def is_archived(sha256: str) -> bool:
+    return locate(sha256) is not None
+
+
+def _read_record(pack: str, offset: int, length: int, codec: str) -> bytes:
+    with open(archive_root() / pack, "rb") as f:
+        f.seek(offset)
+        payload = f.read(length)
+    return zlib.decompress(payload) if codec == CODEC_ZLIB else payload
+
+
+def read_archived(sha256: str):
+    """Bytes of an archived image, or None if it is not in the archive (or damaged)."""
+    if not sha256:
+        return None
+    entry = locate(sha256)
+    if entry is None:
+        return None
+    try:
+        data = _read_record(*entry)
+    except (OSError, zlib.error):
+        return None
+    return data if hashlib.sha256(data).hexdigest() == sha256 else None
+
+
+# -------------------------------------------------------------
+# WRITING
+# -------------------------------------------------------------
+@contextmanager
+def _writer_lock():
+    """One archiver at a time (packs are append-only with a single writer)."""
+    root = archive_root()
+    root.mkdir(parents=True, exist_ok=True)
+    lock = root / "archive.lock"
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        raise RuntimeError(f"another archiver is running (remove {lock} if it crashed)")
+    try:
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        os.close(fd)
+        yield
+    finally:
+        lock.unlink(missing_ok=True)
+
+
+class PackWriter:
+    """Appends records to the newest pack (a new one once it is full) and its index."""
+
+    def __init__(self):
+        self.root = archive_root()
+        self.max_bytes = archive_settings()["pack_max_bytes"]
+        packs = sorted(self.root.glob("pack-*.pack"))
+        self.number = int(packs[-1].stem.split("-")[1]) if packs else 1
+        self._pack = self._idx = None
+        # before anything is appended (or deleted): raises PackError if the pack is damaged
+        _recover_pack(self.root / f"pack-{self.number:06d}.pack")
+
+    def _open(self):
+        name = f"pack-{self.number:06d}"
+        self._pack = open(self.root / f"{name}.pack", "ab")
+        self._idx = open(self.root / f"{name}.idx", "ab")
+
+    def append(self, sha256: str, data: bytes):
+        if self._pack is None:
+            self._open()
+        if self._pack.tell() >= self.max_bytes:
+            self.close()
+            self.number += 1
+            self._open()
+        packed = zlib.compress(data, 6)
+        codec = CODEC_ZLIB if len(packed) <= len(data) * (1 - ARCHIVE_MIN_SAVING) else CODEC_RAW
+        payload = packed if codec == CODEC_ZLIB else data
+        self._pack.write(_RECORD.pack(_MAGIC, bytes.fromhex(sha256), codec.encode("ascii"), len(payload)))
+        offset = self._pack.tell()
+        self._pack.write(payload)
+        self._idx.write(f"{sha256} {offset} {len(payload)} {codec}\n".encode("ascii"))
+        with _index_lock:
+            _index[sha256] = (Path(self._pack.name).name, offset, len(payload), codec)
+        return len(payload)
+
+    def flush(self):
+        """Make everything appended so far durable (before the originals are deleted)."""
+        for f in (self._pack, self._idx):
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close(self):
+        self.flush()
+        for f in (self._pack, self._idx):
+            if f is not None:
+                f.close()
+        self._pack = self._idx = None
+
+
+def archive_cutoff(days: int = None) -> date:
+    return date.today() - timedelta(days=archive_settings()["after_days"] if days is None else int(days))
+
+
+def _archive_blobs(writer, column, cutoff, batch_size, out):
+    """Rows still holding a BLOB: append it, then point the row at its hash and drop the BLOB."""
+    hcol = hash_column(column)
+    select_sql = f"""
+        SELECT id, {column}
+        FROM {ARCHIVE_TABLE}
+        WHERE id > :last AND {ARCHIVE_DATE_COLUMN} < :cutoff AND {column} IS NOT NULL AND {hcol} IS NULL
+        ORDER BY id
+        LIMIT {int(batch_size)}
+    """
+    update_sql = f"UPDATE {ARCHIVE_TABLE} SET {hcol} = :h, {column} = NULL WHERE id = :id AND {hcol} IS NULL"
+    last_id, moved, stored = 0, 0, 0
+    while True:
+        rows = run_query(select_sql, {"last": last_id, "cutoff": cutoff})
+        if rows is None:
+            return None
+        if not rows:
+            return moved, stored
+        objects, updates = {}, []
+        for r in rows:
+            data = bytes(r[column])
+            sha = hashlib.sha256(data).hexdigest()
+            if sha not in objects and not is_archived(sha):
+                stored += writer.append(sha, data)
+                ensure_thumbnail(sha, data)  # list views keep showing it without opening the pack
+            objects[sha] = object_row(data, sha)
+            updates.append({"id": r["id"], "h": sha})
+        writer.flush()
+        for sql, params in ((INSERT_OBJECT_SQL, list(objects.values())), (update_sql, updates)):
+            summary = run_many(sql, params, batch_size)
+            if summary["error"]:
+                out(f"{column}: stopped after {moved} row(s): {summary['error']}")
+                return None
+        last_id = rows[-1]["id"]
+        moved += len(rows)
+        out(f"{column}: {moved} BLOB(s) archived, last id {last_id}")
+
+
+def _archive_stored(writer, column, cutoff, out):
+    """Images already in the store: append them, then delete the store file (the thumbnail stays)."""
+    hcol = hash_column(column)
+    moved, stored, pending = 0, 0, []
+    for r in stream_query(
+        f"SELECT DISTINCT {hcol} AS h FROM {ARCHIVE_TABLE} "
+        f"WHERE {ARCHIVE_DATE_COLUMN} < :cutoff AND {hcol} IS NOT NULL",
+        {"cutoff": cutoff},
+    ):
+        sha = r["h"]
+        if not path_for(sha).exists():
+            continue  # archived already (or missing)
+        if not is_archived(sha):
+            data = get(sha)
+            if not data or hashlib.sha256(data).hexdigest() != sha:
+                out(f"{column}: skipping damaged store file {sha}")
+                continue
+            stored += writer.append(sha, data)
+        pending.append(sha)
+        if len(pending) >= ARCHIVE_BATCH_SIZE:
+            moved += _drop_store_files(writer, pending)
+            out(f"{column}: {moved} stored image(s) archived")
+    moved += _drop_store_files(writer, pending)
+    return moved, stored
+
+
+def _drop_store_files(writer, hashes):
+    writer.flush()
+    for sha in hashes:
+        path_for(sha).unlink(missing_ok=True)
+    n = len(hashes)
+    hashes.clear()
+    return n
+
+
+def archive(days: int = None, batch_size: int = ARCHIVE_BATCH_SIZE, out=print):
+    """Move the pictures of attendance rows older than `days` into the archive. Safe to re-run."""
+    cutoff = archive_cutoff(days)
+    out(f"Archiving {ARCHIVE_TABLE} pictures dated before {cutoff}.")
+    try:
+        with _writer_lock():
+            writer = PackWriter()
+            try:
+                total, total_bytes = 0, 0
+                for column in IMAGE_COLUMNS[ARCHIVE_TABLE]:
+                    for step in (
+                        lambda: _archive_blobs(writer, column, cutoff, batch_size, out),
+                        lambda: _archive_stored(writer, column, cutoff, out),
+                    ):
+                        result = step()
+                        if result is None:
+                            return 1
+                        total += result[0]
+                        total_bytes += result[1]
+            finally:
+                writer.close()
+    except RuntimeError as e:
+        out(f"Not started: {e}")
+        return 1
+    except PackError as e:
+        out(f"Stopped: {e}. Nothing more was deleted; run `python image_archive.py verify` and move the damaged pack aside.")
+        return 1
+    out(f"Archived {total} image(s), {total_bytes / 1024 / 1024:.1f} MB written to packs.")
+    if total:
+        out("Run OPTIMIZE TABLE preamji_attendance to give the freed space back to the OS.")
+    return 0
+
+
+# -------------------------------------------------------------
+# MAINTENANCE
+# -------------------------------------------------------------
+def _scan_pack(pack: Path):
+    """(sha256, payload offset, length, codec) of every complete record in a pack."""
+    with open(pack, "rb") as f:
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            magic, raw_sha, codec, length = _RECORD.unpack(header)
+            if magic != _MAGIC:
+                raise PackError(f"{pack.name}: bad record at {f.tell() - _RECORD.size}")
+            offset = f.tell()
+            f.seek(length, os.SEEK_CUR)
+            if f.tell() > pack.stat().st_size:
+                return  # torn last record (crash while appending)
+            yield raw_sha.hex(), offset, length, codec.decode("ascii")
+
+
+def _index_text(records) -> str:
+    return "".join(f"{s} {o} {n} {c}\n" for s, o, n, c in records)
+
+
+def _write_index(pack: Path, text: str):
+    tmp = pack.with_suffix(".idx.tmp")
+    tmp.write_text(text, encoding="ascii")
+    os.replace(tmp, pack.with_suffix(".idx"))
+    with _index_lock:
+        _index_sizes.pop(pack.with_suffix(".idx").name, None)  # reload it from the start
+
+
+def _recover_pack(pack: Path):
+    """
+    Before appending (caller holds the writer lock): cut a record torn by a
+    crash off the end of the pack, and rebuild the .idx if it does not list
+    exactly the complete records.
+    """
+    if not pack.exists():
+        return
+    records = list(_scan_pack(pack))
+    end = records[-1][1] + records[-1][2] if records else 0
+    if pack.stat().st_size > end:
+        with open(pack, "r+b") as f:
+            f.truncate(end)
+    idx = pack.with_suffix(".idx")
+    text = _index_text(records)
+    if not idx.exists() or idx.read_text(encoding="ascii") != text:
+        _write_index(pack, text)
+
+
+def reindex(out=print):
+    """Rebuild every .idx from its pack (e.g. after copying packs without their index)."""
+    damaged = 0
+    try:
+        with _writer_lock():
+            for pack in sorted(archive_root().glob("pack-*.pack")):
+                try:
+                    records = list(_scan_pack(pack))
+                except PackError as e:
+                    damaged += 1
+                    out(f"{e}; its index was left as it is")
+                    continue
+                _write_index(pack, _index_text(records))
+                out(f"{pack.name}: {len(records)} record(s)")
+    except RuntimeError as e:
+        out(f"Not started: {e}")
+        return 1
+    with _index_lock:
+        _index.clear()
+        _index_sizes.clear()
+        _refresh_index()
+    return 1 if damaged else 0
+
+
+def verify(out=print):
+    with _index_lock:
+        _refresh_index()
+        entries = dict(_index)
+    bad = [sha for sha in entries if read_archived(sha) is None]
+    for sha in bad:
+        out(f"damaged: {sha} in {entries[sha][0]}")
+    out(f"{len(entries)} archived image(s), {len(bad)} damaged.")
+    return 1 if bad else 0
+
+
+def status(out=print):
+    packs = sorted(archive_root().glob("pack-*.pack"))
+    with _index_lock:
+        _refresh_index()
+        count = len(_index)
+    size = sum(p.stat().st_size for p in packs)
+    out(f"{count} image(s) in {len(packs)} pack(s), {size / 1024 / 1024:.1f} MB ({archive_root()})")
+    row = run_query(
+        f"SELECT COUNT(*) AS n FROM {ARCHIVE_TABLE} WHERE {ARCHIVE_DATE_COLUMN} < :cutoff",
+        {"cutoff": archive_cutoff()},
+        fetch_one=True,
+    ) or {}
+    out(f"{int(row.get('n') or 0)} attendance row(s) are older than {archive_settings()['after_days']} days.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["status", "archive", "verify", "reindex"])
+    parser.add_argument("--days", type=int, default=None, help="archive: pictures older than N days")
+    parser.add_argument("--batch", type=int, default=ARCHIVE_BATCH_SIZE, help="archive: BLOB rows per batch")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        status()
+        return 0
+    if args.command == "archive":
+        return archive(args.days, args.batch)
+    if args.command == "verify":
+        return verify()
+    return reindex()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
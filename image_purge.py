@@ -0,0 +1,282 @@
+# image_purge.py
+"""
+Clear the pictures of old attendance rows in small primary-key ranges, with
+a pause between ranges, so the purge never holds long row locks.
+
+    python image_purge.py count [--days 31]              # dry run: rows that would be cleared
+    python image_purge.py run [--days 31] [--batch 500] [--sleep 0.5]
+    python image_purge.py status
+
+Progress (last id done, rows cleared) is saved in maintenance_jobs after
+every range (migration 6), so an interrupted or stopped purge resumes where
+it left off. The admin attendance page runs the same job in a background
+thread. Cleared images are deleted from the image store by
+`python image_store.py gc`. Pictures already in the cold-storage archive
+(`python image_archive.py archive`) keep their <column>_sha256, so they can
+still be opened for disputes; only BLOBs and references to unarchived
+images are cleared.
+"""
+import argparse
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from database import run_many, run_query
+from image_archive import is_archived, refresh_index
+from image_store import IMAGE_COLUMNS, VERSION_COLUMN, hash_column
+
+PURGE_JOB = "attendance_image_purge"
+PURGE_TABLE = "preamji_attendance"
+PURGE_RETENTION_DAYS = 31
+# Width of each primary-key range; one short UPDATE transaction per range
+PURGE_BATCH_SIZE = 500
+# Pause between ranges, so other sessions get the rows and the server
+PURGE_SLEEP_SECONDS = 0.5
+# A 'running' job whose state was not updated for this long has died
+PURGE_STALE_SECONDS = 300
+
+_BLOB_COLUMNS = list(IMAGE_COLUMNS[PURGE_TABLE])
+_HASH_COLUMNS = [hash_column(c) for c in _BLOB_COLUMNS]
+_HAS_IMAGE = "(" + " OR ".join(f"{c} IS NOT NULL" for c in _BLOB_COLUMNS + _HASH_COLUMNS) + ")"
+# what each row of a range still holds (BLOBs are not read)
+_RANGE_SQL = f"""
+    SELECT id, {", ".join(f"{c} IS NOT NULL AS {c}" for c in _BLOB_COLUMNS)}, {", ".join(_HASH_COLUMNS)}
+    FROM {PURGE_TABLE}
+    WHERE id > :lo AND id <= :hi
+      AND attendance_date < :cutoff
+      AND {_HAS_IMAGE}
+"""
+
+_thread = None
+_thread_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def purge_cutoff(days: int = PURGE_RETENTION_DAYS) -> date:
+    return date.today() - timedelta(days=int(days))
+
+
+def count_purgeable(cutoff: date):
+    """
+    Dry run: {"rows", "min_id", "max_id"} of rows before cutoff that still
+    have pictures (archived ones included), or None on error.
+    """
+    row = run_query(
+        f"""
+        SELECT COUNT(*) AS rows_found, MIN(id) AS min_id, MAX(id) AS max_id
+        FROM {PURGE_TABLE}
+        WHERE attendance_date < :cutoff AND {_HAS_IMAGE}
+        """,
+        {"cutoff": cutoff},
+        fetch_one=True,
+    )
+    if row is None:
+        return None
+    return {"rows": int(row["rows_found"] or 0), "min_id": row["min_id"], "max_id": row["max_id"]}
+
+
+# -------------------------------------------------------------
+# JOB STATE
+# -------------------------------------------------------------
+def job_state():
+    """The saved state of the purge job (dict), or None if it never ran."""
+    return run_query("SELECT * FROM maintenance_jobs WHERE job = :job", {"job": PURGE_JOB}, fetch_one=True)
+
+
+def _save_state(**fields):
+    fields["updated_at"] = datetime.now()
+    sets = ", ".join(f"{k} = :{k}" for k in fields)
+    return run_query(f"UPDATE maintenance_jobs SET {sets} WHERE job = :job", {**fields, "job": PURGE_JOB})
+
+
+def _new_state(cutoff: date, counts: dict):
+    now = datetime.now()
+    run_query("DELETE FROM maintenance_jobs WHERE job = :job", {"job": PURGE_JOB})
+    return run_query(
+        """
+        INSERT INTO maintenance_jobs
+            (job, status, cutoff, last_id, max_id, rows_done, rows_total, started_at, updated_at, message)
+        VALUES (:job, 'running', :cutoff, :last_id, :max_id, 0, :rows_total, :now, :now, NULL)
+        """,
+        {
+            "job": PURGE_JOB,
+            "cutoff": cutoff,
+            "last_id": int(counts["min_id"]) - 1,
+            "max_id": int(counts["max_id"]),
+            "rows_total": counts["rows"],
+            "now": now,
+        },
+    )
+
+
+def is_resumable(state) -> bool:
+    return bool(state) and state["status"] in ("running", "stopped", "failed")
+
+
+def is_alive(state) -> bool:
+    """True if some process is working on the job right now."""
+    if not state or state["status"] != "running":
+        return False
+    updated = state["updated_at"]
+    if isinstance(updated, str):
+        updated = datetime.fromisoformat(updated)
+    return (datetime.now() - updated).total_seconds() < PURGE_STALE_SECONDS
+
+
+# -------------------------------------------------------------
+# RUNNING
+# -------------------------------------------------------------
+def _clear_range(lo: int, hi: int, cutoff: date):
+    """
+    Clear the BLOBs and the references to unarchived images of one id range.
+    The row version is bumped too: it is part of the row-thumbnail cache key
+    and of the row image URLs, so pages stop serving the cleared pictures.
+    Returns the number of rows changed, or None on error.
+    """
+    rows = run_query(_RANGE_SQL, {"lo": lo, "hi": hi, "cutoff": cutoff})
+    if rows is None:
+        return None
+    refresh_index()  # an archive run may be going on in another process
+    groups = {}
+    for r in rows:
+        columns = tuple(c for c in _BLOB_COLUMNS if r[c]) + tuple(
+            c for c in _HASH_COLUMNS if r[c] and not is_archived(r[c])
+        )
+        if columns:
+            groups.setdefault(columns, []).append({"id": r["id"], "now": datetime.now()})
+    changed = 0
+    for columns, params in groups.items():
+        sets = ", ".join(f"{c} = NULL" for c in columns)
+        summary = run_many(f"UPDATE {PURGE_TABLE} SET {sets}, {VERSION_COLUMN} = :now WHERE id = :id", params)
+        if summary["error"]:
+            return None
+        changed += len(params)
+    return changed
+
+
+def run_purge(
+    cutoff: date = None,
+    batch_size: int = PURGE_BATCH_SIZE,
+    sleep_seconds: float = PURGE_SLEEP_SECONDS,
+    stop_event: threading.Event = None,
+    out=print,
+):
+    """
+    Clear pictures older than cutoff, one primary-key range at a time.
+    Resumes the saved job if it did not finish (with its own cutoff);
+    otherwise starts a new one for `cutoff`. Returns 0 when done, 1 on
+    error or when stopped.
+    """
+    state = job_state()
+    if is_resumable(state):
+        cutoff = state["cutoff"]
+        if isinstance(cutoff, str):
+            cutoff = date.fromisoformat(cutoff)
+        out(f"Resuming purge of pictures before {cutoff} after id {state['last_id']}.")
+    else:
+        cutoff = cutoff or purge_cutoff()
+        counts = count_purgeable(cutoff)
+        if counts is None:
+            out("Could not count the rows to clear.")
+            return 1
+        if not counts["rows"]:
+            out(f"No pictures before {cutoff} to clear.")
+            return 0
+        if _new_state(cutoff, counts) is None:
+            out("Could not save the job state (run `python migrations.py migrate`).")
+            return 1
+        state = job_state()
+        out(f"Clearing pictures of {counts['rows']} row(s) before {cutoff}.")
+
+    lo, max_id, done = int(state["last_id"]), int(state["max_id"]), int(state["rows_done"])
+    _save_state(status="running", message=None)
+    batch_size = max(1, int(batch_size))
+    while lo < max_id:
+        if stop_event is not None and stop_event.is_set():
+            _save_state(status="stopped", message="Stopped by user")
+            out(f"Stopped after id {lo}; {done} row(s) cleared so far.")
+            return 1
+        hi = min(lo + batch_size, max_id)
+        changed = _clear_range(lo, hi, cutoff)
+        if changed is None:
+            _save_state(status="failed", message=f"UPDATE failed for ids {lo + 1}-{hi}")
+            out(f"Failed at ids {lo + 1}-{hi}; run again to resume.")
+            return 1
+        lo, done = hi, done + changed
+        _save_state(last_id=lo, rows_done=done)
+        out(f"ids up to {lo} of {max_id}: {done} row(s) cleared")
+        if lo < max_id and sleep_seconds:
+            time.sleep(sleep_seconds)
+
+    _save_state(status="done", finished_at=datetime.now())
+    out(f"Done: pictures of {done} row(s) before {cutoff} cleared.")
+    return 0
+
+
+def start_purge_thread(cutoff: date = None, batch_size: int = PURGE_BATCH_SIZE,
+                       sleep_seconds: float = PURGE_SLEEP_SECONDS) -> bool:
+    """
+    Run the purge in a background thread of this process (the page keeps
+    rendering). Returns False if one is already running here or elsewhere.
+    """
+    global _thread
+    with _thread_lock:
+        if _thread is not None and _thread.is_alive():
+            return False
+        if is_alive(job_state()):
+            return False
+        _stop.clear()
+        _thread = threading.Thread(
+            target=run_purge,
+            kwargs={
+                "cutoff": cutoff,
+                "batch_size": batch_size,
+                "sleep_seconds": sleep_seconds,
+                "stop_event": _stop,
+                "out": lambda _msg: None,  # progress is read from maintenance_jobs
+            },
+            name="attendance-image-purge",
+            daemon=True,
+        )
+        _thread.start()
+        return True
+
+
+def stop_purge_thread():
+    """Ask the background purge to stop after the current range."""
+    _stop.set()
+
+
+def purge_thread_running() -> bool:
+    return _thread is not None and _thread.is_alive()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["count", "run", "status"])
+    parser.add_argument("--days", type=int, default=PURGE_RETENTION_DAYS, help="keep pictures of the last N days")
+    parser.add_argument("--batch", type=int, default=PURGE_BATCH_SIZE, help="ids per UPDATE")
+    parser.add_argument("--sleep", type=float, default=PURGE_SLEEP_SECONDS, help="seconds between UPDATEs")
+    args = parser.parse_args(argv)
+
+    if args.command == "count":
+        cutoff = purge_cutoff(args.days)
+        counts = count_purgeable(cutoff)
+        if counts is None:
+            return 1
+        print(f"{counts['rows']} row(s) with pictures before {cutoff} (ids {counts['min_id']}-{counts['max_id']}).")
+        return 0
+    if args.command == "status":
+        state = job_state()
+        print(state if state else "The purge has not run yet.")
+        return 0
+    state = job_state()
+    if is_alive(state):
+        print("The purge is already running in another process.")
+        return 1
+    return run_purge(purge_cutoff(args.days), args.batch, args.sleep)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+# image_server.py
+"""
+HTTP route for images, served by the Tornado app Streamlit runs on, so pages
+can emit <img src="..."> links instead of inline base64 data URLs. The
+browser then caches the bytes and the page HTML stays small.
+
+    /app_images/h/<sha256>?s=<sig>&e=<expiry>[&w=<px>]                  # stored image (immutable)
+    /app_images/r/<table>/<column>/<id>?s=<sig>&e=<expiry>[&w=<px>][&v=<last edit>]   # image column of a row
+
+`w` at or below image_store.THUMB_MAX_PX returns the stored JPEG thumbnail
+instead of the full image; row thumbnails with a version `v` are served
+from image_store's thumbnail cache without a database round trip. Every URL carries an HMAC signature made by
+image_url() over the path, the expiry `e` and `v`, so only links rendered
+for a logged-in page can be fetched, a leaked link stops working after
+URL_TTL_SECONDS, and `v` cannot be made up to fill the cache.
+Responses have strong ETags (the content hash) and answer If-None-Match
+with 304.
+
+The signing key is [image_server] secret in st.secrets. Without it a random
+key is used per process, which means cached URLs change on every restart.
+The Tornado app is the one whose routes include Streamlit's _stcore
+endpoints; if there is not exactly one (other Streamlit server), a warning
+is logged and image_url() falls back to data URLs.
+"""
+import gc
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from functools import partial
+import threading
+from urllib.parse import quote
+
+import streamlit as st
+
+import image_store
+from database import run_query
+from imaging import browser_image
+
+try:
+    import tornado.web
+    from tornado.ioloop import IOLoop
+    TORNADO_AVAILABLE = True
+except Exception:
+    TORNADO_AVAILABLE = False
+
+ROUTE_PREFIX = "app_images"
+# Hash URLs never change content; row URLs may (pictures can be cleared)
+HASH_CACHE_CONTROL = "private, max-age={max_age}, immutable"  # max-age: until the URL expires
+ROW_CACHE_CONTROL = "private, max-age=300"
+# Signed URLs stop working after this long. The expiry is rounded up to
+# URL_EXPIRY_STEP, so a URL stays the same (and browser-cached) within a step.
+URL_TTL_SECONDS = 12 * 3600
+URL_EXPIRY_STEP = 3600
+# The Streamlit release the app lookup was checked against (see _find_app)
+TESTED_STREAMLIT = "1.51"
+
+_LOGGER = logging.getLogger(__name__)
+_install_lock = threading.Lock()
+_installed = None  # None: not tried yet, then True / False
+_base_path = ""
+_key = None
+
+
+def _signing_key() -> bytes:
+    global _key
+    if _key is None:
+        try:
+            conf = dict(st.secrets.get("image_server", {}))
+        except Exception:
+            conf = {}
+        secret = conf.get("secret")
+        _key = secret.encode("utf-8") if secret else secrets.token_bytes(32)
+    return _key
+
+
+def _sign(path: str) -> str:
+    return hmac.new(_signing_key(), path.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def _expiry() -> int:
+    return -(-(int(time.time()) + URL_TTL_SECONDS) // URL_EXPIRY_STEP) * URL_EXPIRY_STEP
+
+
+def _signed_part(path: str, expires: int, version=None) -> str:
+    # the row version is signed too: it is part of the thumbnail cache key
+    part = f"{path}?e={expires}"
+    return f"{part}&v={version}" if version else part
+
+
+def _valid_signature(path: str, sig: str) -> bool:
+    return bool(sig) and hmac.compare_digest(_sign(path), sig)
+
+
+# -------------------------------------------------------------
+# HANDLER
+# -------------------------------------------------------------
+def _load_hash(sha256: str, thumb: bool):
+    return image_store.get_thumbnail(sha256) if thumb else image_store.get(sha256)
+
+
+def _load_row(table: str, column: str, row_id: int):
+    """(sha256, bytes) of an image column of a row - bytes None if it is in the store; None if no image."""
+    hcol = image_store.hash_column(column)
+    # the BLOB is only read for rows not moved to the store yet
+    row = run_query(
+        f"SELECT {hcol} AS h, CASE WHEN {hcol} IS NULL THEN {column} END AS b FROM {table} WHERE id = :id",
+        {"id": row_id},
+        fetch_one=True,
+    )
+    if not row:
+        return None
+    if row["h"]:
+        return row["h"], None
+    if row["b"] is None:
+        return None
+    data = bytes(row["b"])
+    return hashlib.sha256(data).hexdigest(), data
+
+
+def _load_row_thumbnail(table: str, column: str, row_id: int):
+    """(sha256, thumbnail) of an image column of a row, or None."""
+    found = _load_row(table, column, row_id)
+    if found is None:
+        return None
+    sha, data = found
+    if data is not None:
+        return image_store.blob_thumbnail(data)
+    thumb = image_store.get_thumbnail(sha)
+    return (sha, thumb) if thumb else None
+
+
+if TORNADO_AVAILABLE:
+
+    class ImageHandler(tornado.web.RequestHandler):
+        """GET handler for the image routes (see module docstring)."""
+
+        def compute_etag(self):
+            return None  # set explicitly from the content hash
+
+        def _wants_thumb(self) -> bool:
+            try:
+                return 0 < int(self.get_query_argument("w", "0")) <= image_store.THUMB_MAX_PX
+            except ValueError:
+                return False
+
+        def _not_modified(self, etag: str) -> bool:
+            self.set_header("Etag", f'"{etag}"')
+            if self.check_etag_header():
+                self.set_status(304)
+                return True
+            return False
+
+        def _send(self, data):
+            if not data:
+                raise tornado.web.HTTPError(404)
+            data, mime = browser_image(data)
+            self.set_header("Content-Type", mime)
+            self.set_header("X-Content-Type-Options", "nosniff")
+            self.write(data)
+
+        async def get(self, kind, *key):
+            path = "/".join((kind,) + key)
+            version = self.get_query_argument("v", None) if kind == "r" else None
+            try:
+                expires = int(self.get_query_argument("e", ""))
+            except ValueError:
+                raise tornado.web.HTTPError(403)
+            if not _valid_signature(_signed_part(path, expires, version), self.get_query_argument("s", "")):
+                raise tornado.web.HTTPError(403)
+            if expires < time.time():
+                raise tornado.web.HTTPError(403, "link expired")
+            thumb = self._wants_thumb()
+            suffix = "-t" if thumb else ""
+            loop = IOLoop.current()
+
+            if kind == "h":
+                sha = key[0]
+                self.set_header("Cache-Control", HASH_CACHE_CONTROL.format(max_age=max(0, int(expires - time.time()))))
+                if self._not_modified(sha + suffix):
+                    return
+                self._send(await loop.run_in_executor(None, _load_hash, sha, thumb))
+                return
+
+            table, column, row_id = key
+            if column not in image_store.IMAGE_COLUMNS.get(table, ()):
+                raise tornado.web.HTTPError(404)
+            if thumb and version:
+                cache_key = image_store.thumbnail_key(table, column, row_id, version)
+                found = await loop.run_in_executor(
+                    None, image_store.cached_thumbnail, cache_key,
+                    partial(_load_row_thumbnail, table, column, int(row_id)),
+                )
+                if found is None:
+                    raise tornado.web.HTTPError(404)
+                self.set_header("Cache-Control", ROW_CACHE_CONTROL)
+                if not self._not_modified(found[0] + suffix):
+                    self._send(found[1])
+                return
+
+            found = await loop.run_in_executor(None, _load_row, table, column, int(row_id))
+            if found is None:
+                raise tornado.web.HTTPError(404)
+            sha, data = found
+            self.set_header("Cache-Control", ROW_CACHE_CONTROL)
+            if self._not_modified(sha + suffix):
+                return
+            if data is None:
+                data = await loop.run_in_executor(None, _load_hash, sha, thumb)
+            elif thumb:
+                found = await loop.run_in_executor(None, image_store.blob_thumbnail, data)
+                data = found[1] if found else None
+            self._send(data)
+
+
+def _route_patterns(app):
+    return [getattr(getattr(rule.matcher, "regex", None), "pattern", "") for rule in app.wildcard_router.rules]
+
+
+def _find_app():
+    """Streamlit's Tornado app: the Application serving the _stcore endpoints (walks the heap once)."""
+    apps = [obj for obj in gc.get_objects() if isinstance(obj, tornado.web.Application)]
+    streamlit_apps = [a for a in apps if any("_stcore" in p for p in _route_patterns(a))]
+    if len(streamlit_apps) != 1:
+        _LOGGER.warning(
+            "image_server: %d Tornado app(s), %d serving _stcore; expected exactly one",
+            len(apps), len(streamlit_apps),
+        )
+        return None
+    if not st.__version__.startswith(TESTED_STREAMLIT):
+        _LOGGER.warning("image_server: Streamlit %s, app lookup checked on %s", st.__version__, TESTED_STREAMLIT)
+    return streamlit_apps[0]
+
+
+def install_image_route() -> bool:
+    """
+    Add the image routes to Streamlit's Tornado app (once per process).
+    Returns True if the routes are available.
+    """
+    global _installed, _base_path
+    if _installed is not None:
+        return _installed
+    with _install_lock:
+        if _installed is not None:
+            return _installed
+        _installed = False
+        if not TORNADO_AVAILABLE:
+            return False
+        app = _find_app()
+        if app is None:
+            _LOGGER.warning("image_server: Tornado app not found, images are sent inline")
+            return False
+        try:
+            base = (st.get_option("server.baseUrlPath") or "").strip("/")
+        except Exception:
+            base = ""
+        _base_path = f"/{base}" if base else ""
+        prefix = f"^{_base_path}/{ROUTE_PREFIX}"
+        # add_handlers puts new host rules in front of the app's own routes,
+        # so Streamlit's catch-all static handler does not shadow them
+        app.add_handlers(r".*", [
+            (prefix + r"/(h)/([0-9a-f]{64})$", ImageHandler),
+            (prefix + r"/(r)/(\w+)/(\w+)/(\d+)$", ImageHandler),
+        ])
+        _LOGGER.info(
+            "image_server: routes added to the Streamlit %s app (%d routes) under %s/",
+            st.__version__, len(_route_patterns(app)), prefix[1:],
+        )
+        _installed = True
+        return True
+
+
+# -------------------------------------------------------------
+# URLS
+# -------------------------------------------------------------
+def _url(path: str, thumb: bool, version=None) -> str:
+    expires = _expiry()
+    url = f"{_base_path}/{ROUTE_PREFIX}/{path}?s={_sign(_signed_part(path, expires, version))}&e={expires}"
+    if thumb:
+        url = f"{url}&w={image_store.THUMB_MAX_PX}"
+    return f"{url}&v={quote(version)}" if version else url
+
+
+def image_url(table: str, column: str, row: dict, thumb: bool = False):
+    """
+    URL of a row's image (or its thumbnail) for <img src> / <a href>.
+    The row needs `id` and the image column and/or its _sha256 column; BLOB
+    values may be BlobHandles, which are not loaded. None if the row has no
+    image. Falls back to a data URL when the image route is not installed.
+    """
+    if not image_store.has_image(row, column):
+        return None
+    if not install_image_route():
+        if thumb:
+            data = image_store.read_thumbnail(row, column, table if row.get("id") is not None else None)
+        else:
+            data = image_store.read_image(row, column)
+        return image_store.data_url(data) if data else None
+    sha = row.get(image_store.hash_column(column))
+    if sha:
+        return _url(f"h/{sha}", thumb)
+    # a new picture changes the row version, and so the URL
+    return _url(f"r/{table}/{column}/{int(row['id'])}", thumb, image_store.row_version(row))
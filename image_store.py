@@ -0,0 +1,608 @@
+# image_store.py
+"""
+Content-addressed image store.
+
+Every image is written once to <root>/<aa>/<bb>/<sha256>, where <sha256> is
+the SHA-256 of its bytes, with a small JPEG thumbnail next to it
+(<sha256>.thumb) so list views never decode the full image. The row keeps only the hash (<image column>_sha256)
+and image_objects keeps size and dimensions per hash. The old BLOB columns
+are still read for rows that have not been moved yet.
+
+    python image_store.py status                # rows still holding BLOBs vs moved rows
+    python image_store.py move [--batch 200]    # move BLOBs into the store (resumable)
+    python image_store.py dedupe                # store duplicated jobcard photos once (resumable)
+    python image_store.py thumbs                # create missing thumbnails
+    python image_store.py recompress [--dry-run]  # re-encode stored jobcard photos (see imaging.py)
+    python image_store.py gc [--dry-run]        # delete stored images no row refers to
+
+The root directory is [image_store] root in st.secrets (default data/images).
+Back it up together with the database: after `move` the bytes only live there.
+"""
+import argparse
+import base64
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from io import BytesIO
+from pathlib import Path
+
+import streamlit as st
+from PIL import Image
+
+from database import blob_bytes, run_many, run_query, stream_query
+from disk_cache import image_cache
+from imaging import BROWSER_FORMATS, browser_image, normalize_image, sniff_format
+
+IMAGE_STORE_ROOT = "data/images"
+# Image columns whose bytes belong in the store; the row keeps <column>_sha256
+IMAGE_COLUMNS = {
+    "preamji_attendance": (
+        "on_duty_in_image",
+        "on_duty_out_image",
+        "intermidiate_off_out_image",
+        "intermidiate_off_in_image",
+    ),
+    "workorder_entry": ("jobcard_photo",),
+}
+# Rows read per round trip by `move`
+MOVE_BATCH_SIZE = 200
+# gc leaves objects younger than this alone: their row may not be written yet
+GC_GRACE_HOURS = 24
+# recompress only replaces an image if the new encoding is at least this much smaller
+RECOMPRESS_MIN_SAVING = 0.10
+# Longest edge of stored thumbnails (list views show them at 80-180px)
+THUMB_MAX_PX = 200
+THUMB_QUALITY = 75
+# Process-wide LRU of row thumbnails (see cached_thumbnail), bounded by total bytes
+THUMB_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Column whose change means a row's images may have changed
+VERSION_COLUMN = "last_edit_timestamp"
+
+INSERT_OBJECT_SQL = """
+    INSERT IGNORE INTO image_objects (sha256, size_bytes, width, height, created_at)
+    VALUES (:sha256, :size_bytes, :width, :height, :created_at)
+"""
+
+_root = None
+
+_thumb_cache = OrderedDict()  # key -> (sha256, thumbnail bytes)
+_thumb_cache_bytes = 0
+_thumb_cache_lock = threading.Lock()
+_thumb_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def store_root() -> Path:
+    global _root
+    if _root is None:
+        try:
+            conf = dict(st.secrets.get("image_store", {}))
+        except Exception:
+            conf = {}
+        _root = Path(conf.get("root", IMAGE_STORE_ROOT))
+    return _root
+
+
+def hash_column(column: str) -> str:
+    """Name of the column holding the store hash for an image column."""
+    return f"{column}_sha256"
+
+
+def path_for(sha256: str) -> Path:
+    return store_root() / sha256[:2] / sha256[2:4] / sha256
+
+
+def thumb_path_for(sha256: str) -> Path:
+    return path_for(sha256).with_name(f"{sha256}.thumb")
+
+
+def mime_type(data: bytes) -> str:
+    """Image MIME type from the leading bytes (no decoding)."""
+    return BROWSER_FORMATS.get(sniff_format(data), "application/octet-stream")
+
+
+def data_url(data: bytes) -> str:
+    """data: URL of image bytes; browser formats are sent as they are (see imaging.browser_image)."""
+    data, mime = browser_image(data)
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+# -------------------------------------------------------------
+# WRITE / READ
+# -------------------------------------------------------------
+def _dimensions(data: bytes):
+    try:
+        with Image.open(BytesIO(data)) as img:
+            return img.size
+    except Exception:
+        return None, None
+
+
+def make_thumbnail(data: bytes):
+    """JPEG thumbnail (longest edge THUMB_MAX_PX) of image bytes, or None if they are not an image."""
+    try:
+        with Image.open(BytesIO(data)) as img:
+            img.draft("RGB", (THUMB_MAX_PX, THUMB_MAX_PX))  # JPEG: decode at reduced scale
+            img = img.convert("RGB")
+            img.thumbnail((THUMB_MAX_PX, THUMB_MAX_PX))
+            buf = BytesIO()
+            img.save(buf, format="JPEG", quality=THUMB_QUALITY, optimize=True)
+            return buf.getvalue()
+    except Exception:
+        return None
+
+
+def _write_file(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temp file first so readers never see a partial image
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def blob_thumbnail(data: bytes):
+    """
+    (sha256, thumbnail) of image bytes that are not in the store (legacy
+    BLOBs). Thumbnails are kept in the disk cache under the hash of the
+    bytes, so each image is only decoded once. None if not an image.
+    """
+    sha = hashlib.sha256(data).hexdigest()
+    key = f"{sha}.thumb"
+    thumb = image_cache().get(key)
+    if thumb is None:
+        thumb = make_thumbnail(data)
+        if not thumb:
+            return None
+        image_cache().put(key, thumb)
+    return sha, thumb
+
+
+def ensure_thumbnail(sha256: str, data: bytes):
+    """Thumbnail bytes for a stored image, created from `data` if missing."""
+    path = thumb_path_for(sha256)
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+    thumb = make_thumbnail(data)
+    if thumb:
+        _write_file(path, thumb)
+    return thumb
+
+
+def object_row(data: bytes, sha256: str = None) -> dict:
+    """The image_objects row of image bytes."""
+    width, height = _dimensions(data)
+    return {
+        "sha256": sha256 or hashlib.sha256(data).hexdigest(),
+        "size_bytes": len(data),
+        "width": width,
+        "height": height,
+        "created_at": datetime.now(),
+    }
+
+
+def _write_object(data: bytes) -> dict:
+    """
+    Write the bytes and their thumbnail under their hash (if not there yet);
+    returns the image_objects row.
+    """
+    sha = hashlib.sha256(data).hexdigest()
+    path = path_for(sha)
+    if not path.exists():
+        _write_file(path, data)
+    ensure_thumbnail(sha, data)
+    return object_row(data, sha)
+
+
+def put(data: bytes):
+    """
+    Store image bytes and return their SHA-256 (None for empty input).
+    Storing the same bytes again is a no-op, so callers never need to check.
+    """
+    if not data:
+        return None
+    obj = _write_object(bytes(data))
+    run_query(INSERT_OBJECT_SQL, obj)
+    return obj["sha256"]
+
+
+def get(sha256: str):
+    """Bytes of a stored image (from the archive if it was moved there), or None if the hash is unknown."""
+    if not sha256:
+        return None
+    try:
+        return path_for(sha256).read_bytes()
+    except FileNotFoundError:
+        from image_archive import read_archived
+        return read_archived(sha256)
+
+
+def get_thumbnail(sha256: str):
+    """Thumbnail of a stored image (created on first use for images stored without one)."""
+    if not sha256:
+        return None
+    try:
+        return thumb_path_for(sha256).read_bytes()
+    except FileNotFoundError:
+        data = get(sha256)
+        return ensure_thumbnail(sha256, data) if data else None
+
+
+def has_image(row: dict, column: str) -> bool:
+    return bool(row.get(hash_column(column)) or row.get(column))
+
+
+def read_image(row: dict, column: str):
+    """
+    Bytes of an image column of a row: from the store if the row has a
+    hash, else from the legacy BLOB value (bytes or BlobHandle).
+    """
+    data = get(row.get(hash_column(column)))
+    if data is not None:
+        return data
+    return blob_bytes(row.get(column))
+
+
+def _row_thumbnail(row: dict, column: str):
+    """(sha256, thumbnail) of an image column of a row, or None."""
+    sha = row.get(hash_column(column))
+    thumb = get_thumbnail(sha)
+    if thumb is not None:
+        return sha, thumb
+    data = blob_bytes(row.get(column))
+    return blob_thumbnail(data) if data else None
+
+
+def read_thumbnail(row: dict, column: str, table: str = None):
+    """
+    JPEG thumbnail of an image column of a row. Rows not moved to the store
+    yet have no stored thumbnail, so theirs is made from the BLOB.
+    With `table` (and an `id` in the row) the result goes through the
+    thumbnail cache, so BlobHandles are only loaded on a cache miss.
+    """
+    if table and row.get("id") is not None:
+        key = thumbnail_key(table, column, row["id"], row_version(row), row.get(hash_column(column)))
+        found = cached_thumbnail(key, lambda: _row_thumbnail(row, column))
+    else:
+        found = _row_thumbnail(row, column)
+    return found[1] if found else None
+
+
+def ensure_stored(table: str, column: str, row: dict):
+    """
+    Hash of a row's image, moving its BLOB into the store first if the row
+    has none yet (the row dict is updated too). None if there is no image
+    or the update failed.
+    """
+    hcol = hash_column(column)
+    if row.get(hcol):
+        return row[hcol]
+    data = blob_bytes(row.get(column))
+    if not data:
+        return None
+    sha = put(data)
+    result = run_query(
+        f"UPDATE {table} SET {hcol} = :h, {column} = NULL WHERE id = :id AND {hcol} IS NULL",
+        {"h": sha, "id": row["id"]},
+    )
+    if result is None:
+        return None
+    row[hcol], row[column] = sha, None
+    return sha
+
+
+# -------------------------------------------------------------
+# THUMBNAIL CACHE
+# -------------------------------------------------------------
+def row_version(row: dict):
+    """The row's last edit time as a string (part of the cache key), or None if the table has none."""
+    value = row.get(VERSION_COLUMN)
+    return None if value is None else str(value)
+
+
+def thumbnail_key(table: str, column: str, row_id, version=None, sha256=None):
+    """
+    Cache key of a row's thumbnail. The version (last_edit_timestamp) changes
+    when the row gets a new picture, the hash when its stored image is replaced.
+    """
+    return (table, int(row_id), column, version, sha256)
+
+
+def cached_thumbnail(key, load):
+    """
+    (sha256, thumbnail) for `key` from the cache; on a miss from load()
+    (which returns the same pair, or None - not cached). Least recently
+    used entries are dropped beyond THUMB_CACHE_MAX_BYTES.
+    """
+    global _thumb_cache_bytes
+    with _thumb_cache_lock:
+        entry = _thumb_cache.get(key)
+        if entry is not None:
+            _thumb_cache.move_to_end(key)
+            _thumb_cache_stats["hits"] += 1
+            return entry
+        _thumb_cache_stats["misses"] += 1
+
+    entry = load()
+    if entry is None or len(entry[1]) > THUMB_CACHE_MAX_BYTES:
+        return entry
+
+    with _thumb_cache_lock:
+        old = _thumb_cache.pop(key, None)
+        if old is not None:
+            _thumb_cache_bytes -= len(old[1])
+        _thumb_cache[key] = entry
+        _thumb_cache_bytes += len(entry[1])
+        while _thumb_cache_bytes > THUMB_CACHE_MAX_BYTES:
+            _old_key, old = _thumb_cache.popitem(last=False)
+            _thumb_cache_bytes -= len(old[1])
+            _thumb_cache_stats["evictions"] += 1
+    return entry
+
+
+def get_thumbnail_cache_stats():
+    with _thumb_cache_lock:
+        return dict(
+            _thumb_cache_stats,
+            entries=len(_thumb_cache),
+            bytes=_thumb_cache_bytes,
+            max_bytes=THUMB_CACHE_MAX_BYTES,
+        )
+
+
+def clear_thumbnail_cache():
+    global _thumb_cache_bytes
+    with _thumb_cache_lock:
+        _thumb_cache.clear()
+        _thumb_cache_bytes = 0
+
+
+# -------------------------------------------------------------
+# MOVING EXISTING BLOBS
+# -------------------------------------------------------------
+def move_column(table: str, column: str, batch_size: int = MOVE_BATCH_SIZE, keep_blobs: bool = False, out=print):
+    """
+    Move one BLOB column into the store, one committed batch at a time.
+    Only rows without a hash are picked up, so an interrupted run simply
+    continues where it stopped when started again.
+    keep_blobs=True fills the hash but leaves the BLOB in place.
+    Returns (rows_moved, bytes_moved), or None on a database error.
+    """
+    hcol = hash_column(column)
+    clear = "" if keep_blobs else f", {column} = NULL"
+    update_sql = f"UPDATE {table} SET {hcol} = :h{clear} WHERE id = :id AND {hcol} IS NULL"
+    select_sql = f"""
+        SELECT id, {column}
+        FROM {table}
+        WHERE id > :last AND {column} IS NOT NULL AND {hcol} IS NULL
+        ORDER BY id
+        LIMIT {int(batch_size)}
+    """
+    last_id, moved, moved_bytes = 0, 0, 0
+    while True:
+        rows = run_query(select_sql, {"last": last_id})
+        if rows is None:
+            return None
+        if not rows:
+            break
+        objects, updates = {}, []
+        for r in rows:
+            obj = _write_object(bytes(r[column]))
+            objects[obj["sha256"]] = obj
+            updates.append({"id": r["id"], "h": obj["sha256"]})
+            moved_bytes += obj["size_bytes"]
+        # object rows first: a row must never point at an unknown hash
+        for sql, params in ((INSERT_OBJECT_SQL, list(objects.values())), (update_sql, updates)):
+            summary = run_many(sql, params, batch_size)
+            if summary["error"]:
+                out(f"{table}.{column}: stopped after {moved} row(s): {summary['error']}")
+                return None
+        last_id = rows[-1]["id"]
+        moved += len(rows)
+        out(f"{table}.{column}: {moved} row(s) moved, last id {last_id}")
+    return moved, moved_bytes
+
+
+def dedupe_column(table: str, column: str, batch_size: int = MOVE_BATCH_SIZE, out=print):
+    """
+    Collapse BLOBs that hold the same bytes (e.g. jobcard photos copied by
+    re-assign / repeat repair) into one stored image. The database computes
+    SHA2 of every BLOB not moved yet, so each duplicated image is downloaded
+    only once; all rows holding a copy then get its hash and drop the BLOB.
+    Images that occur once are left for `move`. Safe to re-run.
+    Returns (rows_updated, bytes_saved), or None on a database error.
+    """
+    hcol = hash_column(column)
+    groups = {}
+    for r in stream_query(
+        f"SELECT id, SHA2({column}, 256) AS h FROM {table} WHERE {column} IS NOT NULL AND {hcol} IS NULL"
+    ):
+        groups.setdefault(r["h"], []).append(r["id"])
+    dupes = {h: ids for h, ids in groups.items() if len(ids) > 1}
+    out(f"{table}.{column}: {sum(len(ids) for ids in dupes.values())} row(s) share {len(dupes)} image(s)")
+
+    update_sql = f"UPDATE {table} SET {hcol} = :h, {column} = NULL WHERE id = :id AND {hcol} IS NULL"
+    updated, saved = 0, 0
+    for n, (sha, ids) in enumerate(dupes.items(), start=1):
+        row = run_query(f"SELECT {column} FROM {table} WHERE id = :id", {"id": ids[0]}, fetch_one=True)
+        if not row or row[column] is None:
+            continue  # changed since the scan; the next run picks it up
+        obj = _write_object(bytes(row[column]))
+        if obj["sha256"] != sha:
+            continue
+        run_query(INSERT_OBJECT_SQL, obj)
+        summary = run_many(update_sql, [{"h": sha, "id": i} for i in ids], batch_size)
+        if summary["error"]:
+            out(f"{table}.{column}: stopped after {updated} row(s): {summary['error']}")
+            return None
+        updated += summary["rowcount"]
+        saved += obj["size_bytes"] * (len(ids) - 1)
+        if n % 100 == 0:
+            out(f"{table}.{column}: {n}/{len(dupes)} image(s) done")
+    out(f"{table}.{column}: {updated} row(s) now reference {len(dupes)} stored image(s), "
+        f"{saved / 1024 / 1024:.1f} MB of copies removed.")
+    return updated, saved
+
+
+def move_all(batch_size: int = MOVE_BATCH_SIZE, keep_blobs: bool = False, out=print):
+    total_rows, total_bytes = 0, 0
+    for table, columns in IMAGE_COLUMNS.items():
+        for column in columns:
+            result = move_column(table, column, batch_size, keep_blobs, out)
+            if result is None:
+                return 1
+            total_rows += result[0]
+            total_bytes += result[1]
+    out(f"Moved {total_rows} image(s), {total_bytes / 1024 / 1024:.1f} MB.")
+    if total_rows and not keep_blobs:
+        out("Run OPTIMIZE TABLE on the tables above to give the freed space back to the OS.")
+    return 0
+
+
+def status(out=print):
+    for table, columns in IMAGE_COLUMNS.items():
+        for column in columns:
+            row = run_query(
+                f"""
+                SELECT
+                    SUM({column} IS NOT NULL AND {hash_column(column)} IS NULL) AS pending,
+                    SUM({hash_column(column)} IS NOT NULL) AS stored
+                FROM {table}
+                """,
+                fetch_one=True,
+            ) or {}
+            out(f"{table}.{column}: {int(row.get('pending') or 0)} BLOB(s) to move, "
+                f"{int(row.get('stored') or 0)} in the store")
+
+
+# -------------------------------------------------------------
+# GARBAGE COLLECTION
+# -------------------------------------------------------------
+def referenced_hashes():
+    refs = set()
+    for table, columns in IMAGE_COLUMNS.items():
+        for column in columns:
+            hcol = hash_column(column)
+            for row in stream_query(f"SELECT DISTINCT {hcol} AS h FROM {table} WHERE {hcol} IS NOT NULL"):
+                refs.add(row["h"])
+    return refs
+
+
+def gc(dry_run: bool = False, out=print):
+    """
+    Delete stored images that no row refers to any more (e.g. after old
+    pictures were cleared). Images in the cold-storage archive are kept,
+    with their thumbnails.
+    """
+    from image_archive import is_archived, refresh_index
+
+    refs = referenced_hashes()
+    refresh_index()
+    cutoff = datetime.now() - timedelta(hours=GC_GRACE_HOURS)
+    unused = [
+        r for r in stream_query(
+            "SELECT sha256, size_bytes FROM image_objects WHERE created_at < :cutoff", {"cutoff": cutoff}
+        )
+        if r["sha256"] not in refs and not is_archived(r["sha256"])
+    ]
+    freed = sum(r["size_bytes"] for r in unused)
+    if dry_run:
+        out(f"{len(unused)} unreferenced image(s), {freed / 1024 / 1024:.1f} MB would be freed.")
+        return 0
+    # rows first: a leftover file is harmless, a row without its file is not
+    summary = run_many("DELETE FROM image_objects WHERE sha256 = :sha256", [{"sha256": r["sha256"]} for r in unused])
+    if summary["error"]:
+        out(f"Stopped: {summary['error']}")
+        return 1
+    for r in unused:
+        path_for(r["sha256"]).unlink(missing_ok=True)
+        thumb_path_for(r["sha256"]).unlink(missing_ok=True)
+    out(f"Deleted {len(unused)} unreferenced image(s), {freed / 1024 / 1024:.1f} MB freed.")
+    return 0
+
+
+def recompress(table: str = "workorder_entry", column: str = "jobcard_photo", dry_run: bool = False, out=print):
+    """
+    Re-encode the stored images of one column with the imaging settings and
+    point the rows at the smaller copy. Images that would not shrink by at
+    least RECOMPRESS_MIN_SAVING are left alone, so re-runs only touch new
+    uploads. Replaced originals are deleted later by `gc`.
+    Rows whose image is still a BLOB are skipped; run `move` first.
+    """
+    hcol = hash_column(column)
+    hashes = [r["h"] for r in stream_query(f"SELECT DISTINCT {hcol} AS h FROM {table} WHERE {hcol} IS NOT NULL")]
+    update_sql = f"UPDATE {table} SET {hcol} = :new WHERE {hcol} = :old"
+    before, after, replaced = 0, 0, 0
+    for n, sha in enumerate(hashes, start=1):
+        if n % 100 == 0:
+            out(f"{table}.{column}: {n}/{len(hashes)} image(s) checked")
+        data = get(sha)
+        if not data:
+            continue
+        try:
+            smaller = normalize_image(data)
+        except Exception:
+            continue
+        if len(smaller) > len(data) * (1 - RECOMPRESS_MIN_SAVING):
+            continue
+        before += len(data)
+        after += len(smaller)
+        replaced += 1
+        if not dry_run:
+            if run_query(update_sql, {"new": put(smaller), "old": sha}) is None:
+                out(f"{table}.{column}: stopped after {replaced - 1} image(s).")
+                return 1
+    verb = "would shrink" if dry_run else "shrunk"
+    out(f"{table}.{column}: {replaced} of {len(hashes)} image(s) {verb} from "
+        f"{before / 1024 / 1024:.1f} MB to {after / 1024 / 1024:.1f} MB "
+        f"({(before - after) / 1024 / 1024:.1f} MB saved).")
+    return 0
+
+
+def create_thumbnails(out=print):
+    """Create the thumbnails missing for stored images (e.g. stored before thumbnails existed)."""
+    created = 0
+    for r in stream_query("SELECT sha256 FROM image_objects"):
+        sha = r["sha256"]
+        if thumb_path_for(sha).exists():
+            continue
+        data = get(sha)
+        if data and ensure_thumbnail(sha, data):
+            created += 1
+    out(f"Created {created} thumbnail(s).")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["status", "move", "dedupe", "thumbs", "recompress", "gc"])
+    parser.add_argument("--batch", type=int, default=MOVE_BATCH_SIZE, help="move: rows per batch")
+    parser.add_argument("--keep-blobs", action="store_true", help="move: fill hashes but keep the BLOBs")
+    parser.add_argument("--dry-run", action="store_true", help="gc / recompress: only report, change nothing")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        status()
+        return 0
+    if args.command == "move":
+        return move_all(args.batch, args.keep_blobs)
+    if args.command == "thumbs":
+        return create_thumbnails()
+    if args.command == "recompress":
+        return recompress(dry_run=args.dry_run)
+    if args.command == "dedupe":
+        return 0 if dedupe_column("workorder_entry", "jobcard_photo", args.batch) else 1
+    return gc(dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
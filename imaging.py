@@ -0,0 +1,133 @@
+# imaging.py
+"""
+Image normalization shared by the capture paths: fix the camera orientation,
+shrink to a maximum resolution and re-encode as JPEG or WebP.
+
+Defaults can be overridden in st.secrets:
+
+    [imaging]
+    max_width = 1600
+    max_height = 1600
+    quality = 80
+    format = "JPEG"     # or "WEBP"
+"""
+from io import BytesIO
+
+import streamlit as st
+from PIL import Image, ImageOps
+
+NORMALIZE_MAX_SIZE = (1600, 1600)
+NORMALIZE_QUALITY = 80
+NORMALIZE_FORMAT = "JPEG"
+SUPPORTED_FORMATS = ("JPEG", "WEBP")
+# Formats every browser displays, sent as stored; others are converted for display
+BROWSER_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+_settings = None
+
+
+def normalize_settings():
+    global _settings
+    if _settings is None:
+        try:
+            conf = dict(st.secrets.get("imaging", {}))
+        except Exception:
+            conf = {}
+        fmt = str(conf.get("format", NORMALIZE_FORMAT)).upper()
+        _settings = {
+            "max_size": (
+                int(conf.get("max_width", NORMALIZE_MAX_SIZE[0])),
+                int(conf.get("max_height", NORMALIZE_MAX_SIZE[1])),
+            ),
+            "quality": int(conf.get("quality", NORMALIZE_QUALITY)),
+            "format": fmt if fmt in SUPPORTED_FORMATS else NORMALIZE_FORMAT,
+        }
+    return _settings
+
+
+def decode_image(data: bytes, max_size, keep_alpha: bool = False) -> Image.Image:
+    """
+    Decode `data` into an upright RGB image (RGBA if keep_alpha and it has
+    transparency) no larger than max_size. Raises if the bytes are not a
+    readable image.
+    """
+    with Image.open(BytesIO(data)) as img:
+        # JPEG: let the decoder scale down while decoding
+        img.draft("RGB", max_size)
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha and keep_alpha else "RGB")
+        img.thumbnail(max_size)
+        return img
+
+
+def encode_image(img: Image.Image, quality: int, fmt: str = "JPEG") -> bytes:
+    """Encode a decoded image as fmt ("JPEG" or "WEBP")."""
+    out = BytesIO()
+    if fmt.upper() == "WEBP":
+        img.save(out, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def normalize_image(data: bytes, max_size=None, quality=None, fmt=None) -> bytes:
+    """
+    Decode `data`, apply the EXIF orientation, shrink it to fit max_size
+    and encode it as fmt ("JPEG" or "WEBP") at the given quality.
+    Arguments left as None come from normalize_settings().
+    Raises if the bytes are not a readable image.
+    """
+    settings = normalize_settings()
+    max_size = max_size or settings["max_size"]
+    quality = quality or settings["quality"]
+    fmt = (fmt or settings["format"]).upper()
+    return encode_image(decode_image(data, max_size, keep_alpha=fmt == "WEBP"), quality, fmt)
+
+
+def sniff_format(data: bytes):
+    """Image format from the leading bytes, without decoding ("JPEG", "PNG", ...); None if unknown."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "JPEG"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "PNG"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    if data[:2] == b"BM":
+        return "BMP"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "TIFF"
+    return None
+
+
+def browser_image(data: bytes):
+    """
+    (bytes, mime type) to send image bytes to a browser. JPEG, PNG, WebP
+    and GIF pass through untouched; anything else is decoded and encoded
+    as JPEG (PNG if it has transparency). Bytes that cannot be decoded are
+    returned as they are.
+    """
+    fmt = sniff_format(data)
+    if fmt in BROWSER_FORMATS:
+        return data, BROWSER_FORMATS[fmt]
+    try:
+        with Image.open(BytesIO(data)) as img:
+            has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+            out = BytesIO()
+            if has_alpha:
+                img.convert("RGBA").save(out, format="PNG")
+                return out.getvalue(), "image/png"
+            img.convert("RGB").save(out, format="JPEG", quality=NORMALIZE_QUALITY)
+            return out.getvalue(), "image/jpeg"
+    except Exception:
+        return data, "application/octet-stream"
+
+
+def normalize_capture(data: bytes) -> bytes:
+    """normalize_image with the configured settings; the original bytes if they cannot be decoded."""
+    try:
+        return normalize_image(data)
+    except Exception:
+        return data
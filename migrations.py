@@ -0,0 +1,334 @@
+# migrations.py
+"""
+Versioned schema migrations (indexes for the hot lookups) and an EXPLAIN check.
+
+    python migrations.py status     # applied / pending versions
+    python migrations.py migrate    # apply pending versions in order
+    python migrations.py check      # EXPLAIN every SQL statement in the app, report full scans
+
+Uses the same st.secrets connection settings as the app (.streamlit/secrets.toml).
+"""
+import argparse
+import ast
+import re
+import sys
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import explain_query, get_db_engine, is_explainable, plan_full_scans
+
+APP_DIR = Path(__file__).resolve().parent
+
+# MySQL cannot index TEXT/BLOB columns without a prefix length
+TEXT_TYPES = {"text", "tinytext", "mediumtext", "longtext", "blob", "tinyblob", "mediumblob", "longblob"}
+TEXT_INDEX_PREFIX = 64
+
+
+class Index:
+    """A (non-unique) index step; created only if an index with that name does not exist."""
+
+    def __init__(self, table: str, name: str, columns):
+        self.table = table
+        self.name = name
+        self.columns = list(columns)
+
+    def describe(self):
+        return f"INDEX {self.name} ON {self.table} ({', '.join(self.columns)})"
+
+
+class Column:
+    """An added column; created only if the table does not have it yet."""
+
+    def __init__(self, table: str, name: str, ddl: str):
+        self.table = table
+        self.name = name
+        self.ddl = ddl
+
+    def describe(self):
+        return f"COLUMN {self.table}.{self.name} {self.ddl}"
+
+
+# (version, description, steps). Steps are Index / Column objects or plain SQL strings.
+# Never edit an applied version - add a new one.
+MIGRATIONS = [
+    (1, "attendance: per-employee day lookup and date range reports", [
+        Index("preamji_attendance", "idx_att_emp_date", ["emp_code_of_thetechnician", "attendance_date"]),
+        Index("preamji_attendance", "idx_att_date", ["attendance_date"]),
+    ]),
+    (2, "workorder_entry: open/closed jobs per center, jobcard checks, date listings", [
+        # center_code + job_status (open jobs), + jobcard_date (recent closed jobs)
+        Index("workorder_entry", "idx_wo_center_status_jcdate", ["center_code", "job_status", "jobcard_date"]),
+        # duplicate / re-assign checks
+        Index("workorder_entry", "idx_wo_jobcard_center_status", ["jobcard_no", "center_code", "job_status"]),
+        # view work orders (admin: date range; team lead: center + date range)
+        Index("workorder_entry", "idx_wo_assign_date", ["job_assign_date"]),
+        Index("workorder_entry", "idx_wo_center_assign_date", ["center_code", "job_assign_date"]),
+        # admin edit list (WHERE delete_flag = 0 ORDER BY id DESC)
+        Index("workorder_entry", "idx_wo_delete_flag_id", ["delete_flag", "id"]),
+    ]),
+    (3, "lookup tables: technicians per center, models per manufacturer", [
+        Index("employee_details", "idx_emp_center_role", ["center_code", "user_role"]),
+        Index("vehicle_model", "idx_vm_manufacturer_model", ["vehicle_manufacturer", "vehicle_model"]),
+    ]),
+    (4, "image store: image_objects table and <image column>_sha256 references", [
+        """
+        CREATE TABLE IF NOT EXISTS image_objects (
+            sha256 CHAR(64) NOT NULL PRIMARY KEY,
+            size_bytes INT NOT NULL,
+            width INT NULL,
+            height INT NULL,
+            created_at DATETIME NOT NULL
+        )
+        """,
+        Column("preamji_attendance", "on_duty_in_image_sha256", "CHAR(64) NULL"),
+        Column("preamji_attendance", "on_duty_out_image_sha256", "CHAR(64) NULL"),
+        Column("preamji_attendance", "intermidiate_off_out_image_sha256", "CHAR(64) NULL"),
+        Column("preamji_attendance", "intermidiate_off_in_image_sha256", "CHAR(64) NULL"),
+        Column("workorder_entry", "jobcard_photo_sha256", "CHAR(64) NULL"),
+    ]),
+    (5, "workorder_entry: rows sharing a stored photo (recompress / dedupe)", [
+        Index("workorder_entry", "idx_wo_photo_sha256", ["jobcard_photo_sha256"]),
+    ]),
+    (6, "maintenance_jobs: progress of resumable background jobs (image purge)", [
+        """
+        CREATE TABLE IF NOT EXISTS maintenance_jobs (
+            job VARCHAR(64) NOT NULL PRIMARY KEY,
+            status VARCHAR(16) NOT NULL,
+            cutoff DATE NULL,
+            last_id BIGINT NOT NULL DEFAULT 0,
+            max_id BIGINT NOT NULL DEFAULT 0,
+            rows_done INT NOT NULL DEFAULT 0,
+            rows_total INT NOT NULL DEFAULT 0,
+            started_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL,
+            finished_at DATETIME NULL,
+            message VARCHAR(255) NULL
+        )
+        """,
+    ]),
+]
+
+
+# -------------------------------------------------------------
+# APPLYING
+# -------------------------------------------------------------
+def _ensure_version_table(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL
+        )
+        """
+    ))
+
+
+def applied_versions(conn):
+    _ensure_version_table(conn)
+    rows = conn.execute(text("SELECT version FROM schema_migrations")).fetchall()
+    return {r[0] for r in rows}
+
+
+def _index_exists(conn, table, name):
+    row = conn.execute(
+        text(
+            """
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = :t AND index_name = :i
+            LIMIT 1
+            """
+        ),
+        {"t": table, "i": name},
+    ).fetchone()
+    return row is not None
+
+
+def _column_types(conn, table):
+    rows = conn.execute(
+        text(
+            """
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = :t
+            """
+        ),
+        {"t": table},
+    ).fetchall()
+    return {r[0].lower(): r[1].lower() for r in rows}
+
+
+def _apply_step(conn, step):
+    if isinstance(step, str):
+        conn.execute(text(step))
+        return f"ran: {step.strip().splitlines()[0]}"
+
+    if isinstance(step, Column):
+        if step.name.lower() in _column_types(conn, step.table):
+            return f"exists: {step.describe()}"
+        conn.execute(text(f"ALTER TABLE `{step.table}` ADD COLUMN `{step.name}` {step.ddl}"))
+        return f"added: {step.describe()}"
+
+    if _index_exists(conn, step.table, step.name):
+        return f"exists: {step.describe()}"
+    types = _column_types(conn, step.table)
+    cols = []
+    for col in step.columns:
+        if types.get(col.lower()) in TEXT_TYPES:
+            cols.append(f"`{col}`({TEXT_INDEX_PREFIX})")
+        else:
+            cols.append(f"`{col}`")
+    conn.execute(text(f"CREATE INDEX `{step.name}` ON `{step.table}` ({', '.join(cols)})"))
+    return f"created: {step.describe()}"
+
+
+def migrate(out=print):
+    """Apply pending migrations in version order. Returns the versions applied."""
+    engine = get_db_engine()
+    done = []
+    with engine.connect() as conn:
+        already = applied_versions(conn)
+        conn.commit()
+        for version, description, steps in MIGRATIONS:
+            if version in already:
+                continue
+            out(f"-> {version}: {description}")
+            # DDL commits implicitly in MySQL; steps are idempotent so a
+            # failed version can simply be re-run.
+            for step in steps:
+                out("   " + _apply_step(conn, step))
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :ts)"),
+                {"v": version, "d": description, "ts": datetime.now()},
+            )
+            conn.commit()
+            done.append(version)
+    if not done:
+        out("Schema is up to date.")
+    return done
+
+
+def status(out=print):
+    engine = get_db_engine()
+    with engine.connect() as conn:
+        already = applied_versions(conn)
+        conn.commit()
+    for version, description, _steps in MIGRATIONS:
+        mark = "applied" if version in already else "PENDING"
+        out(f"{version:>3}  {mark:<8} {description}")
+
+
+# -------------------------------------------------------------
+# EXPLAIN CHECK
+# -------------------------------------------------------------
+_SQL_SHAPE = re.compile(r"\b(FROM|SET)\b", re.IGNORECASE)
+_OTHER_PLACEHOLDERS = re.compile(r"%s|\?")
+
+
+def _sql_literals(path: Path):
+    """(line, sql) for every plain string literal in a module that looks like a SQL statement."""
+    tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+    # pieces of f-strings are Constants too, but not complete statements
+    fstring_parts = {
+        id(part)
+        for node in ast.walk(tree) if isinstance(node, ast.JoinedStr)
+        for part in node.values
+    }
+    found = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in fstring_parts:
+            sql = node.value.strip()
+            # skip UI labels ("Select ...", "Update ...") and other drivers' placeholders
+            if is_explainable(sql) and _SQL_SHAPE.search(sql) and not _OTHER_PLACEHOLDERS.search(sql):
+                found.append((node.lineno, sql))
+    return found
+
+
+def _dynamic_statements():
+    """Statements assembled at runtime that the literal scan only sees in pieces."""
+    found = []
+    try:
+        from admin_attendance import _build_search_query
+        q, _ = _build_search_query("X", date.today(), date.today())
+        found.append(("admin_attendance._build_search_query", q))
+        q, _ = _build_search_query(None, date.today(), date.today())
+        found.append(("admin_attendance._build_search_query (no employee)", q))
+    except Exception as e:
+        print(f"warning: could not build admin_attendance search query: {e}", file=sys.stderr)
+    return found
+
+
+def _dummy_value(name: str):
+    """Placeholder values so EXPLAIN can plan a parameterized statement."""
+    n = name.lower()
+    if n.endswith("date") or n.startswith("date") or n in ("dt", "start", "end", "today"):
+        return date.today()
+    if n in ("ts", "t", "first") or "time" in n or n.endswith("update"):
+        return datetime.now()
+    if n == "id" or n.endswith("_id") or n in ("tw", "tb", "ew", "kilometres", "v"):
+        return 1
+    return "x"
+
+
+_BIND_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+
+
+def _bind_dummies(sql: str):
+    return {n: _dummy_value(n) for n in set(_BIND_PARAM.findall(sql))}
+
+
+def check(out=print, fail_on_scan=False):
+    """EXPLAIN every statement in the app and report full table/index scans."""
+    statements = []
+    for path in sorted(APP_DIR.glob("*.py")):
+        if path.name == Path(__file__).name:
+            continue
+        statements += [(f"{path.name}:{line}", sql) for line, sql in _sql_literals(path)]
+    statements += _dynamic_statements()
+
+    scans, failures = 0, 0
+    for where, sql in statements:
+        first_line = " ".join(sql.split())[:100]
+        try:
+            plan = explain_query(sql, _bind_dummies(sql))
+        except SQLAlchemyError as e:
+            failures += 1
+            out(f"[ERR ] {where}: {first_line}\n       {str(e).splitlines()[0]}")
+            continue
+        full = plan_full_scans(plan)
+        if full:
+            scans += 1
+            for r in full:
+                out(
+                    f"[SCAN] {where}: table={r.get('table')} type={r.get('type')} "
+                    f"key={r.get('key')} rows={r.get('rows')} extra={r.get('Extra')}\n       {first_line}"
+                )
+        else:
+            keys = ", ".join(f"{r.get('table')}:{r.get('key')}" for r in plan if r.get("table"))
+            out(f"[ ok ] {where}: {keys}")
+
+    out(f"\n{len(statements)} statements, {scans} with full scans, {failures} could not be explained.")
+    if fail_on_scan and (scans or failures):
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["status", "migrate", "check"])
+    parser.add_argument("--fail-on-scan", action="store_true", help="check: exit 1 if any statement scans")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        status()
+        return 0
+    if args.command == "migrate":
+        migrate()
+        return 0
+    return check(fail_on_scan=args.fail_on_scan)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,13 @@
 # new_wo_entry.py
 import streamlit as st
 from datetime import timedelta,datetime
-from database import run_query, fetch_employee_details
+from database import (
+    run_query, run_cached_query, run_parallel, fetch_employee_details, transaction,
+    blob_projection, with_blob_handles,
+)
+import image_store
+from image_server import image_url
+from imaging import normalize_capture
 from zoneinfo import ZoneInfo
 # Reuse TRUE IST time from attendance module
 from attendance import get_current_ist
@@ -31,12 +37,12 @@ def get_technicians_by_center(center_code):
           AND employee_status = 'Active'
         ORDER BY employee_name
     """
-    return run_query(sql, {"cc": center_code}, fetch_one=False) or []
+    return run_cached_query(sql, {"cc": center_code}, fetch_one=False) or []
 
 
 def get_vehicle_manufacturers():
     sql = "SELECT DISTINCT vehicle_manufacturer FROM vehicle_model ORDER BY vehicle_manufacturer"
-    rows = run_query(sql, fetch_one=False)
+    rows = run_cached_query(sql, fetch_one=False)
     return [r["vehicle_manufacturer"] for r in rows] if rows else []
 
 
@@ -47,10 +53,38 @@ def get_vehicle_models(manufacturer):
         WHERE vehicle_manufacturer = :vm
         ORDER BY vehicle_model
     """
-    rows = run_query(sql, {"vm": manufacturer}, fetch_one=False)
+    rows = run_cached_query(sql, {"vm": manufacturer}, fetch_one=False)
     return [r["vehicle_model"] for r in rows] if rows else []
 
 
+def _share_photo(data):
+    """
+    Make sure the workorder's photo is in the image store, so a derived
+    workorder can reference it by hash instead of copying the bytes.
+    Returns False (after showing an error) if that failed.
+    """
+    if not image_store.has_image(data, "jobcard_photo"):
+        return True
+    if image_store.ensure_stored("workorder_entry", "jobcard_photo", data):
+        return True
+    st.error("❌ Could not store the jobcard photo. Please try again.")
+    return False
+
+
+def _jobcard_photo_html(data):
+    """Thumbnail of the jobcard photo, linking to the full photo."""
+    thumb_url = image_url("workorder_entry", "jobcard_photo", data, thumb=True)
+    full_url = image_url("workorder_entry", "jobcard_photo", data)
+    if not thumb_url or not full_url:
+        return ""
+    return f"""
+        <a href="{full_url}" target="_blank">
+            <img src="{thumb_url}"
+                 style="max-width:180px;border-radius:6px;cursor:pointer;" />
+        </a>
+    """
+
+
 def get_open_jobcards(center_code):
     sql = """
         SELECT id, jobcard_no
@@ -63,8 +97,13 @@ def get_open_jobcards(center_code):
 
 
 def get_workorder_details(workorder_id):
-    sql = "SELECT * FROM workorder_entry WHERE id = :id"
-    return run_query(sql, {"id": workorder_id}, fetch_one=True)
+    """
+    One workorder row. Read the photo with image_store.read_image(row, "jobcard_photo"):
+    jobcard_photo_sha256 points into the image store; rows not moved there yet
+    carry a BlobHandle in jobcard_photo that is only fetched when read.
+    """
+    sql = f"SELECT {blob_projection('workorder_entry')} FROM workorder_entry WHERE id = :id"
+    return with_blob_handles(run_query(sql, {"id": workorder_id}, fetch_one=True), "workorder_entry")
 # ---------------------------------------------------------
     # Check for new workorder
     # ---------------------------------------------------------
@@ -90,7 +129,7 @@ def get_recent_closed_jobcards(center_code, from_date):
         WHERE job_status = 'Closed'
           AND center_code = :cc
           AND jobcard_date >= :from_date
-          AND jobcard_photo IS NOT NULL
+          AND (jobcard_photo_sha256 IS NOT NULL OR jobcard_photo IS NOT NULL)
         ORDER BY jobcard_date DESC
     """
     return run_query(
@@ -184,8 +223,18 @@ def new_workorder_entry_page():
     now_ist = get_current_ist()
     today = now_ist.date()
 
-    center = get_teamlead_center(user)
-    technicians = get_technicians_by_center(center["center_code"])
+    # Independent lookups run concurrently; models for the default
+    # manufacturer are prefetched so the first render hits the cache.
+    first = run_parallel({
+        "center": lambda: get_teamlead_center(user),
+        "manufacturers": get_vehicle_manufacturers,
+    })
+    center, manufacturers = first["center"], first["manufacturers"]
+    second = run_parallel({
+        "technicians": lambda: get_technicians_by_center(center["center_code"]),
+        "models": lambda: get_vehicle_models(manufacturers[0]) if manufacturers else [],
+    })
+    technicians = second["technicians"]
 
     if not technicians:
         st.warning("No technicians found for your center.")
@@ -220,7 +269,7 @@ def new_workorder_entry_page():
 
             vehicle_manufacturer = st.selectbox(
                 "Vehicle Manufacturer",
-                get_vehicle_manufacturers()
+                manufacturers
             )
 
             vehicle_model = st.selectbox(
@@ -288,7 +337,8 @@ def new_workorder_entry_page():
         #         st.error("Job Assign Date cannot be before Jobcard Date.")
         #         return
 
-        photo_bytes = jobcard_photo.getvalue()
+        # resize / re-encode the raw camera frame before it is stored
+        photo_hash = image_store.put(normalize_capture(jobcard_photo.getvalue()))
 
 
         insert_sql = """
@@ -296,7 +346,7 @@ def new_workorder_entry_page():
                 jobcard_type,
                 technician_code,
                 name_of_technician,
-                jobcard_photo,
+                jobcard_photo_sha256,
                 
                 vehicle_registration_no,
                 vehicle_manufacturer,
@@ -320,7 +370,7 @@ def new_workorder_entry_page():
                 :jobcard_type,
                 :technician_code,
                 :name_of_technician,
-                :jobcard_photo,
+                :jobcard_photo_sha256,
                 
                 :vehicle_registration_no,
                 :vehicle_manufacturer,
@@ -346,7 +396,7 @@ def new_workorder_entry_page():
             "jobcard_type": jobcard_type,
             "technician_code": tech["employee_code"],
             "name_of_technician": tech["employee_name"],
-            "jobcard_photo": photo_bytes,
+            "jobcard_photo_sha256": photo_hash,
             
             "vehicle_registration_no": vehicle_registration_no,
             "vehicle_manufacturer": vehicle_manufacturer,
@@ -403,18 +453,8 @@ def close_workorder_ui(user):
     col1, col2 = st.columns([1, 2])
 
     with col1:
-        if data.get("jobcard_photo"):
-            import base64
-            img_b64 = base64.b64encode(data["jobcard_photo"]).decode()
-            st.markdown(
-                f"""
-                <a href="data:image/png;base64,{img_b64}" target="_blank">
-                    <img src="data:image/png;base64,{img_b64}"
-                         style="max-width:180px;border-radius:6px;cursor:pointer;" />
-                </a>
-                """,
-                unsafe_allow_html=True
-            )
+        if image_store.has_image(data, "jobcard_photo"):
+            st.markdown(_jobcard_photo_html(data), unsafe_allow_html=True)
 
     with col2:
         st.write({
@@ -535,18 +575,8 @@ def reassign_workorder_ui(user):
     col1, col2 = st.columns([1, 2])
 
     with col1:
-        if data.get("jobcard_photo"):
-            import base64
-            img_b64 = base64.b64encode(data["jobcard_photo"]).decode()
-            st.markdown(
-                f"""
-                <a href="data:image/png;base64,{img_b64}" target="_blank">
-                    <img src="data:image/png;base64,{img_b64}"
-                         style="max-width:180px;border-radius:6px;cursor:pointer;" />
-                </a>
-                """,
-                unsafe_allow_html=True
-            )
+        if image_store.has_image(data, "jobcard_photo"):
+            st.markdown(_jobcard_photo_html(data), unsafe_allow_html=True)
 
     with col2:
         st.write({
@@ -587,22 +617,20 @@ def reassign_workorder_ui(user):
 
         tech = tech_map[new_technician]
 
-        # 1️⃣ Update OLD record
-        run_query(
-            """
+        # derived rows share the stored photo; move a legacy BLOB there first
+        if not _share_photo(data):
+            return
+
+        # 1️⃣ Update OLD record (only if it is still In Progress)
+        update_sql = """
             UPDATE workorder_entry
             SET
                 job_status = 'Re-assigned',
                 tl_remarks = :remarks,
                 tl_last_update = :ts
             WHERE id = :id
-            """,
-            {
-                "remarks": new_tl_remarks,
-                "ts": now_ist,
-                "id": workorder_id,
-            }
-        )
+              AND job_status = 'In Progress'
+        """
 
         # 2️⃣ Insert NEW record
         insert_sql = """
@@ -610,7 +638,7 @@ def reassign_workorder_ui(user):
                 jobcard_type,
                 technician_code,
                 name_of_technician,
-                jobcard_photo,
+                jobcard_photo_sha256,
                 vehicle_registration_no,
                 vehicle_manufacturer,
                 vehicle_model,
@@ -629,11 +657,11 @@ def reassign_workorder_ui(user):
                 tl_remarks,
                 job_status
             )
-            VALUES (
+            SELECT
                 'Re-assigned job',
                 :technician_code,
                 :name_of_technician,
-                :jobcard_photo,
+                jobcard_photo_sha256,
                 :vehicle_registration_no,
                 :vehicle_manufacturer,
                 :vehicle_model,
@@ -651,13 +679,15 @@ def reassign_workorder_ui(user):
                 :tl_last_update,
                 :tl_remarks,
                 'In Progress'
-            )
+            FROM workorder_entry
+            WHERE id = :source_id
         """
 
+        # the new row references the same stored photo (INSERT ... SELECT copies the hash)
         payload = {
+            "source_id": workorder_id,
             "technician_code": tech["employee_code"],
             "name_of_technician": tech["employee_name"],
-            "jobcard_photo": data["jobcard_photo"],
             "vehicle_registration_no": data["vehicle_registration_no"],
             "vehicle_manufacturer": data["vehicle_manufacturer"],
             "vehicle_model": data["vehicle_model"],
@@ -676,8 +706,23 @@ def reassign_workorder_ui(user):
             "tl_remarks": new_tl_remarks,
         }
 
-        run_query(insert_sql, payload)
-        st.success("✅ Workorder re-assigned successfully!")
+        # Both statements share one connection and one commit, so the old job
+        # is never left 'Re-assigned' without its replacement.
+        with transaction() as tx:
+            updated = tx.execute(
+                update_sql,
+                {
+                    "remarks": new_tl_remarks,
+                    "ts": now_ist,
+                    "id": workorder_id,
+                },
+            )
+            if updated["rowcount"] != 1:
+                tx.abort("❌ This workorder is no longer In Progress (it may have been re-assigned by someone else).")
+            tx.execute(insert_sql, payload)
+
+        if tx.ok:
+            st.success("✅ Workorder re-assigned successfully!")
 #=====================================================
 #Reapet Or Revisit UI
 #=====================================================
@@ -735,17 +780,7 @@ def repeat_revisit_ui(user, jobcard_type):
 
     col1, col2 = st.columns([1, 2])
     with col1:
-        import base64
-        img = base64.b64encode(data["jobcard_photo"]).decode()
-        st.markdown(
-            f"""
-            <a href="data:image/png;base64,{img}" target="_blank">
-                <img src="data:image/png;base64,{img}"
-                     style="max-width:180px;border-radius:6px;cursor:pointer;" />
-            </a>
-            """,
-            unsafe_allow_html=True
-        )
+        st.markdown(_jobcard_photo_html(data), unsafe_allow_html=True)
 
     with col2:
         st.write({
@@ -798,13 +833,16 @@ def repeat_revisit_ui(user, jobcard_type):
             st.error("New Jobcard No cannot be same as previous jobcard number.")
             return
 
+        # derived rows share the stored photo; move a legacy BLOB there first
+        if not _share_photo(data):
+            return
 
         insert_sql = """
             INSERT INTO workorder_entry (
                 jobcard_type,
                 technician_code,
                 name_of_technician,
-                jobcard_photo,
+                jobcard_photo_sha256,
                 previous_jobcard_no,
                 vehicle_registration_no,
                 vehicle_manufacturer,
@@ -824,11 +862,11 @@ def repeat_revisit_ui(user, jobcard_type):
                 tl_remarks,
                 job_status
             )
-            VALUES (
+            SELECT
                 :jobcard_type,
                 :technician_code,
                 :name_of_technician,
-                :jobcard_photo,
+                jobcard_photo_sha256,
                 :previous_jobcard_no,
                 :vehicle_registration_no,
                 :vehicle_manufacturer,
@@ -847,15 +885,17 @@ def repeat_revisit_ui(user, jobcard_type):
                 :tl_last_update,
                 :tl_remarks,
                 'In Progress'
-            )
+            FROM workorder_entry
+            WHERE id = :source_id
 
         """
 
+        # the new row references the same stored photo (INSERT ... SELECT copies the hash)
         payload = {
+            "source_id": workorder_id,
             "jobcard_type": jobcard_type,                # Repeat Repair / Re Visit
             "technician_code": tech["employee_code"],
             "name_of_technician": tech["employee_name"],
-            "jobcard_photo": data["jobcard_photo"],
 
             # ✅ OLD jobcard stored here
             "previous_jobcard_no": data["jobcard_no"],
@@ -881,6 +921,34 @@ def repeat_revisit_ui(user, jobcard_type):
         }
 
 
-        run_query(insert_sql, payload)
-        st.success(f"✅ {jobcard_type} workorder created successfully!")
+        # Re-check for an active workorder in the same transaction as the insert
+        # (the check above can be stale by the time the form is submitted).
+        with transaction() as tx:
+            active = tx.execute(
+                """
+                SELECT id
+                FROM workorder_entry
+                WHERE jobcard_no = :jobcard_no
+                  AND center_code = :center_code
+                  AND job_status = 'In Progress'
+                LIMIT 1
+                FOR UPDATE
+                """,
+                {
+                    "jobcard_no": data["jobcard_no"],
+                    "center_code": center["center_code"],
+                },
+                fetch_one=True,
+            )
+            if active:
+                tx.abort(
+                    "❌ The existing workorder is yet not closed. "
+                    "Please close the active workorder before creating Repeat Repair / Re Visit."
+                )
+            inserted = tx.execute(insert_sql, payload)
+            if inserted["rowcount"] != 1:
+                tx.abort("❌ The previous workorder no longer exists. Please reload and try again.")
+
+        if tx.ok:
+            st.success(f"✅ {jobcard_type} workorder created successfully!")
 #=====================================================
\ No newline at end of file
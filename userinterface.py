@@ -1,9 +1,10 @@
 # userinterface.py
 import streamlit as st
 from admin_update_workorder import admin_update_workorder_page
-from attendance import attendance_page
+from attendance import attendance_page, warm_up_face_detector
 from new_wo_entry import new_workorder_entry_page
 from view_workorders import view_workorders_page
+from image_server import install_image_route
 from PIL import Image
 import os
 from io import BytesIO
@@ -21,9 +22,16 @@ except Exception:
 
 
 
+try:
+    from admin_diagnostics import admin_diagnostics_page
+except Exception:
+    admin_diagnostics_page = None
+
+
+
 # Try to use project-level database helper if available
 try:
-    from database import fetch_employee_details
+    from database import fetch_employee_details, start_rerun_query_count
     DATABASE_HELPER_AVAILABLE = True
 except Exception:
     DATABASE_HELPER_AVAILABLE = False
@@ -309,11 +317,20 @@ def build_menu_for_role(role: str):
         if "Attendance Records" not in base:
             idx = base.index("Administration") + 1
             base.insert(idx, "Attendance Records")
+        # Database diagnostics at the end of the admin block
+        if "DB Diagnostics" not in base:
+            idx = base.index("Attendance Records") + 1
+            base.insert(idx, "DB Diagnostics")
 
     return base
 
 
 def user_interface():
+    if DATABASE_HELPER_AVAILABLE:
+        start_rerun_query_count()
+    install_image_route()
+    face_detector = warm_up_face_detector()
+
     # Expect st.session_state['user'] is set by login flow
     user = st.session_state.get("user")
     if not user:
@@ -327,6 +344,8 @@ def user_interface():
     )
 
     role = user.get("user_role")
+    if role in ("Admin", "Super Admin") and not face_detector["ok"]:
+        st.sidebar.warning(f"Face check disabled: {face_detector['error']}")
     menu = build_menu_for_role(role)
 
     choice = st.sidebar.radio("Please select an option", menu)
@@ -390,6 +409,11 @@ def user_interface():
         else:
             admin_attendance_page()
 
+    elif choice == "DB Diagnostics":
+        if admin_diagnostics_page is None:
+            st.error("Diagnostics module not available. Make sure admin_diagnostics.py exists and is importable.")
+        else:
+            admin_diagnostics_page()
 
     elif choice == "Workstation":
         st.write("Workstation page - to be implemented or wired to your workstation module.")
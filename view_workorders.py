@@ -2,23 +2,75 @@ import streamlit as st
 from datetime import timedelta
 from new_wo_entry import get_teamlead_center
 from attendance import get_current_ist
-from database import run_query
-import base64
+from database import stream_query_frames, STREAM_CHUNK_SIZE, BlobHandle, load_blobs
+import image_store
+from image_server import image_url, install_image_route
 import pandas as pd
 
-def prepare_workorder_dataframe(rows):
+def _photo_links(df):
+    """
+    Links to the image route for a chunk selecting jobcard_photo_sha256 and
+    LENGTH(jobcard_photo); no image bytes are read here.
+    """
+    hashes = df.pop("jobcard_photo_sha256") if "jobcard_photo_sha256" in df.columns else [None] * len(df)
+    links = []
+    for pk, size, sha in zip(df["Search ID"], df["Jobcard Photo"], hashes):
+        row = {
+            "id": pk,
+            "jobcard_photo_sha256": sha if isinstance(sha, str) else None,
+            "jobcard_photo": size if pd.notna(size) else None,
+        }
+        url = image_url("workorder_entry", "jobcard_photo", row)
+        links.append(f'<a href="{url}" target="_blank">View Photo</a>' if url else "")
+    return links
+
+
+def _chunk_photos(df, route):
+    """
+    The listing selects jobcard_photo_sha256 and LENGTH(jobcard_photo).
+    Photos with a hash come from the image store; the rest are fetched from
+    the BLOB column with one query for the whole chunk.
+    """
+    hashes = df.pop("jobcard_photo_sha256") if "jobcard_photo_sha256" in df.columns else [None] * len(df)
+    photos = []
+    for pk, size, sha in zip(df["Search ID"], df["Jobcard Photo"], hashes):
+        stored = image_store.get(sha) if isinstance(sha, str) else None
+        if stored is not None:
+            photos.append(stored)
+        elif pd.notna(size):
+            photos.append(BlobHandle("workorder_entry", "jobcard_photo", int(pk), size=size, route=route))
+        else:
+            photos.append(None)
+    load_blobs([p for p in photos if isinstance(p, BlobHandle)])
+    return photos
+
+
+def prepare_workorder_dataframe(df, route="primary"):
     """
     Converts jobcard_photo BLOB to clickable link.
+    Accepts a DataFrame (as yielded by stream_query_frames) or a list of rows.
     """
-    df = pd.DataFrame(rows)
+    if not isinstance(df, pd.DataFrame):
+        df = pd.DataFrame(df)
 
     if "Jobcard Photo" in df.columns:
+        if "Search ID" in df.columns and (
+            "jobcard_photo_sha256" in df.columns or pd.api.types.is_numeric_dtype(df["Jobcard Photo"])
+        ):
+            if install_image_route():
+                df["Jobcard Photo"] = _photo_links(df)
+                return df
+            df["Jobcard Photo"] = _chunk_photos(df, route)
+
         def make_link(blob):
             if blob is None:
                 return ""
+            if isinstance(blob, BlobHandle):
+                blob = blob.load()
+                if not blob:
+                    return ""
             try:
-                b64 = base64.b64encode(blob).decode("utf-8")
-                return f'<a href="data:image/png;base64,{b64}" target="_blank">View Photo</a>'
+                return f'<a href="{image_store.data_url(blob)}" target="_blank">View Photo</a>'
             except Exception:
                 return ""
 
@@ -27,6 +79,13 @@ def prepare_workorder_dataframe(rows):
     return df
 
 
+def _table_parts(df):
+    """(opening <table> with its header, the <tr> rows) of a chunk's HTML table."""
+    html = df.to_html(escape=False, index=False)
+    head, body = html.split("<tbody>", 1)
+    return head + "<tbody>", body.rsplit("</tbody>", 1)[0]
+
+
 
 def view_workorders_page(user):
 
@@ -55,6 +114,8 @@ def view_workorders_page(user):
         return
 
     role = user.get("user_role")
+    # Admin-wide listings are reports; send them to the read engine
+    reporting = role != "TeamLeader"
 
     params = {
         "from_date": from_date,
@@ -74,7 +135,8 @@ def view_workorders_page(user):
                 jobcard_type As 'Jobcard Type',
                 technician_code As 'Technician Code',
                 name_of_technician As 'Name of Technician',
-                jobcard_photo As 'Jobcard Photo',
+                LENGTH(jobcard_photo) As 'Jobcard Photo',
+                jobcard_photo_sha256,
                 previous_jobcard_no As 'Previous Jobcard No',
                 jobcard_type As 'Jobcard Type',
                 job_status As 'Job Status',
@@ -96,7 +158,8 @@ def view_workorders_page(user):
                 jobcard_type As 'Jobcard Type',
                 technician_code As 'Technician Code',
                 name_of_technician As 'Name of Technician',
-                jobcard_photo As 'Jobcard Photo',
+                LENGTH(jobcard_photo) As 'Jobcard Photo',
+                jobcard_photo_sha256,
                 previous_jobcard_no As 'Previous Jobcard No',
                 jobcard_type As 'Jobcard Type',
                 job_status As 'Job Status',
@@ -110,19 +173,28 @@ def view_workorders_page(user):
             ORDER BY job_assign_date DESC
         """
 
-    rows = run_query(sql, params, fetch_one=False)
-
-    if not rows:
+    # Stream the rows as DataFrame chunks and keep only each chunk's <tr>
+    # rows, so one chunk (and its photo BLOBs) is held by this process at a
+    # time and the page gets a single table with one header. The listing
+    # itself only carries photo hashes and sizes (see _photo_links /
+    # _chunk_photos).
+    head = None
+    rows = []
+    for chunk in stream_query_frames(sql, params, chunk_size=STREAM_CHUNK_SIZE, reporting=reporting):
+        df = prepare_workorder_dataframe(chunk, route="reporting" if reporting else "primary")
+        if df.empty:
+            continue
+        chunk_head, chunk_rows = _table_parts(df)
+        head = head or chunk_head
+        rows.append(chunk_rows)
+
+    if head is None:
         st.info("No workorders found for the selected date range.")
         return
 
     st.markdown("### 📋 Workorder List")
-    # st.dataframe(rows, use_container_width=True)
-
-    df = prepare_workorder_dataframe(rows)
-
     st.markdown(
-        df.to_html(escape=False, index=False),
+        head + "".join(rows) + "</tbody>\n</table>",
         unsafe_allow_html=True
         )
 